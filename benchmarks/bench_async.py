@@ -0,0 +1,82 @@
+# benchmarks/bench_async.py
+
+# Offline check of the async service layer against diet_rag.stubs.StubGemini:
+# compares sequential embed -> retrieve -> generate against overlapped
+# requests on the background loop, and shows cancellation of in-flight work.
+#
+# Usage: python benchmarks/bench_async.py --requests 20
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diet_data import DIET_DOCUMENTS  # noqa: E402
+from diet_rag.aio import (AsyncRAGService, BackgroundLoop,  # noqa: E402
+                          gemini_async_embedder, gemini_async_generator)
+from diet_rag.cache import EmbeddingCache  # noqa: E402
+from diet_rag.retrieval import NumpyBackend  # noqa: E402
+from diet_rag.store import sync_backend  # noqa: E402
+from diet_rag.stubs import StubGemini  # noqa: E402
+
+
+def build_prompt(query, documents):
+    return f"Problem: {query}\n\n" + "\n---\n".join(documents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async pipeline overlap benchmark")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--embed-latency", type=float, default=0.1)
+    parser.add_argument("--generate-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    stub = StubGemini(dimension=64, embed_latency=args.embed_latency,
+                      generate_latency=args.generate_latency)
+    backend = NumpyBackend()
+    sync_backend(backend, DIET_DOCUMENTS, embed_fn=stub.embedder)
+    queries = [f"{DIET_DOCUMENTS[i % len(DIET_DOCUMENTS)]['condition']} ({i})"
+               for i in range(args.requests)]
+
+    def query_fn(embedding, n_results, query=None):
+        return backend.query(embedding, n_results)
+
+    service = AsyncRAGService(gemini_async_embedder(api=stub), query_fn,
+                              gemini_async_generator(stub), EmbeddingCache())
+    loop = BackgroundLoop()
+
+    start = time.perf_counter()
+    for query in queries:
+        loop.run(service.recommend(query + " seq", build_prompt))
+    sequential = time.perf_counter() - start
+
+    async def overlapped():
+        return await asyncio.gather(*[service.recommend(q, build_prompt) for q in queries])
+
+    start = time.perf_counter()
+    loop.run(overlapped())
+    concurrent = time.perf_counter() - start
+    print(f"sequential: {sequential:.2f}s  overlapped: {concurrent:.2f}s  "
+          f"(peak in-flight stub calls: {stub.peak_in_flight})")
+
+    start = time.perf_counter()
+    loop.run(service.prewarm([d['condition'] for d in DIET_DOCUMENTS]))
+    prewarm = time.perf_counter() - start
+    start = time.perf_counter()
+    loop.run(service.retrieve(DIET_DOCUMENTS[0]['condition']))
+    warm_retrieve = time.perf_counter() - start
+    print(f"prewarm: {prewarm * 1000:.0f}ms, retrieval after prewarm: {warm_retrieve * 1000:.1f}ms")
+
+    future = loop.submit(service.recommend("cancel me", build_prompt))
+    time.sleep(args.embed_latency / 2)
+    future.cancel()
+    time.sleep(args.embed_latency + args.generate_latency)
+    print(f"cancelled in flight: {future.cancelled()}, stub calls still running: {stub.in_flight}")
+    loop.stop()
+
+
+if __name__ == "__main__":
+    main()
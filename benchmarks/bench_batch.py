@@ -0,0 +1,94 @@
+# benchmarks/bench_batch.py
+
+# Batch mode (diet_rag.batch) against answering the same condition list one
+# request at a time, offline with the diet_rag.stubs.StubGemini stub: embedding
+# calls, retrieval time and end-to-end throughput.
+#
+# Usage: python benchmarks/bench_batch.py [--conditions 2000] [--docs 2000] [--concurrency 8]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diet_rag import DietRAGEngine, EngineConfig  # noqa: E402
+from diet_rag.batch import dedupe, run_batch  # noqa: E402
+from diet_rag.stubs import StubGemini  # noqa: E402
+from workload import QUERY_TEMPLATES, synthetic_corpus  # noqa: E402
+
+# Free-text notes the condition router and lexical fast path don't resolve
+NOTES = ("patient {i} reports tiredness and poor sleep", "bloating after meals, case {i}",
+         "wants more energy for training ({i})", "low appetite since surgery #{i}")
+
+
+def condition_list(corpus, n, duplicates, seed):
+    rng = random.Random(seed)
+    unique = []
+    for i in range(max(1, int(n * (1 - duplicates)))):
+        if rng.random() < 0.5:
+            unique.append(rng.choice(NOTES).format(i=i))
+        else:
+            condition = rng.choice(corpus)['condition'].split(" #")[0]
+            unique.append(rng.choice(QUERY_TEMPLATES).format(condition=condition.lower()))
+    return [unique[i] if i < len(unique) else rng.choice(unique) for i in range(n)]
+
+
+def make_engine(args):
+    stub = StubGemini(dimension=args.dim, embed_latency=args.embed_latency,
+                      generate_latency=args.generate_latency, seed=args.seed)
+    engine = DietRAGEngine(EngineConfig(retrieval_backend="numpy", async_prefetch=False),
+                           documents=synthetic_corpus(args.docs), api=stub)
+    engine.warm_up(embed_fn=stub.embedder)
+    return engine, stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch mode vs one request at a time")
+    parser.add_argument("--conditions", type=int, default=2000)
+    parser.add_argument("--duplicates", type=float, default=0.5,
+                        help="Fraction of the list repeating an earlier condition")
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--generate-latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine, stub = make_engine(args)
+    conditions = condition_list(synthetic_corpus(args.docs), args.conditions, args.duplicates,
+                                args.seed)
+    print(f"{len(conditions)} conditions ({len(dedupe(conditions))} unique), {args.docs} docs, "
+          f"stub embed {args.embed_latency * 1000:.0f} ms, generate {args.generate_latency * 1000:.0f} ms")
+
+    embed_calls, start = stub.embed_calls, time.perf_counter()
+    for condition in conditions:
+        engine.retrieve(condition)
+    retrieve_s = time.perf_counter() - start
+    print(f"  {'sequential retrieve':22} {retrieve_s:7.2f} s  {stub.embed_calls - embed_calls} embed calls")
+    engine.close()
+
+    engine, stub = make_engine(args)
+    embed_calls, start = stub.embed_calls, time.perf_counter()
+    engine.retrieve_batch([condition for _, condition, _ in dedupe(conditions)])
+    batch_s = time.perf_counter() - start
+    print(f"  {'retrieve_batch':22} {batch_s:7.2f} s  {stub.embed_calls - embed_calls} embed calls")
+    engine.close()
+
+    engine, stub = make_engine(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = run_batch(engine, conditions, os.path.join(tmp, "out.jsonl"),
+                          concurrency=args.concurrency)
+    engine.close()
+    sequential_estimate = retrieve_s + len(conditions) * args.generate_latency
+    print(f"  {'run_batch end to end':22} {stats['seconds']:7.2f} s  {stats['written']} answers "
+          f"({stats['written'] / stats['seconds']:.0f}/s; one at a time would take "
+          f">= {sequential_estimate:.0f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# benchmarks/bench_load.py
+
+# Offline load test of the request path the Streamlit app and the HTTP API
+# share (DietRAGEngine: embed -> search -> generate, plus follow-ups) against
+# diet_rag.stubs.StubGemini with configurable latency and error distributions.
+# Replays a query mix over a synthetic corpus at several concurrency levels and
+# reports per-stage latency percentiles, throughput, cache hit rates, errors and
+# memory. Results can be saved as a baseline and later runs compared to it.
+#
+# Usage: python benchmarks/bench_load.py --docs 100000 --users 1,8,32 --sessions 100
+#        python benchmarks/bench_load.py --output baseline.json
+#        python benchmarks/bench_load.py --baseline baseline.json  # exits 1 on regression
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diet_rag import ConversationState, DietRAGEngine, DietRAGError, EngineConfig  # noqa: E402
+from diet_rag.stubs import LATENCY_DISTRIBUTIONS, StubGemini  # noqa: E402
+from workload import (current_rss_mb, peak_rss_mb, percentile,  # noqa: E402
+                      query_mix, synthetic_corpus)
+
+# Per-stage timings; "recommend" and "follow_up" are end-to-end per request
+STAGES = ("embed", "search", "first_chunk", "generate",
+          "follow_up_context", "follow_up_generate", "recommend", "follow_up")
+REPORTED_PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    """Collects latency samples (ms) and error counts per stage, thread-safely."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds * 1000)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except DietRAGError:
+            with self._lock:
+                self.errors[name] += 1
+            raise
+        self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        return {stage: {f"p{pct}": percentile(self.samples[stage], pct)
+                        for pct in REPORTED_PERCENTILES} | {"count": len(self.samples[stage])}
+                for stage in STAGES if self.samples[stage]}
+
+
+def consume(answer, timer, start):
+    """Reads a streamed answer, recording time to the first chunk."""
+    first = True
+    for _ in answer:
+        if first:
+            timer.record("first_chunk", time.perf_counter() - start)
+            first = False
+    return answer.text
+
+
+def run_session(engine, session, timer):
+    """One user: a recommendation followed by its follow-ups; stops at the first error."""
+    state = ConversationState()
+    query = session['query']
+    try:
+        start = time.perf_counter()
+        if engine.router is None or not engine.router.lookup(query)[0]:
+            with timer.stage("embed"):
+                engine.embed_query(query)
+        with timer.stage("search"):
+            # Any embedding is now cached, so this is the routing or vector store query
+            retrieved = engine.retrieve_for_session(state, query)
+        with timer.stage("generate"):
+            generate_start = time.perf_counter()
+            text = consume(engine.generate(query, retrieved, stream=True), timer, generate_start)
+        timer.record("recommend", time.perf_counter() - start)
+
+        chat_history = [(query, text)]
+        for message in session['follow_ups']:
+            start = time.perf_counter()
+            with timer.stage("follow_up_context"):
+                context_docs = engine.follow_up_context(state, message)
+            summary, recent = engine.compact_history(state, chat_history)
+            with timer.stage("follow_up_generate"):
+                text = engine.generate_follow_up(query, recent, message, context_docs=context_docs,
+                                                 history_summary=summary).resolve()
+            timer.record("follow_up", time.perf_counter() - start)
+            chat_history.append((message, text))
+    except DietRAGError:
+        pass
+
+
+def cache_delta(after, before):
+    hits = after['hits'] - before['hits']
+    lookups = hits + after['misses'] - before['misses']
+    return hits / lookups if lookups else 0.0
+
+
+def run_level(engine, sessions, users):
+    """Replays `sessions` with `users` concurrent users; returns the level's results."""
+    engine.embedding_cache.clear()
+    engine.response_cache.ensure_version(("bench", users))
+    before = engine.stats()
+    timer = StageTimer()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        for session in sessions:
+            executor.submit(run_session, engine, session, timer)
+    wall = time.perf_counter() - start
+    after = engine.stats()
+    completed = len(timer.samples["recommend"]) + len(timer.samples["follow_up"])
+    return {
+        "users": users,
+        "wall_s": wall,
+        "requests": completed,
+        "throughput_rps": completed / wall if wall else 0.0,
+        "errors": dict(timer.errors),
+        "embedding_cache_hit_rate": cache_delta(after['embedding_cache'], before['embedding_cache']),
+        "response_cache_hit_rate": cache_delta(after['response_cache'], before['response_cache']),
+        "router_hit_rate": (cache_delta(after['condition_router'], before['condition_router'])
+                            if 'condition_router' in after else 0.0),
+        "stages": timer.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_level(result):
+    errors = sum(result['errors'].values())
+    print(f"\n{result['users']} users: {result['requests']} requests in {result['wall_s']:.2f}s "
+          f"({result['throughput_rps']:.1f} req/s), {errors} errors {result['errors'] or ''}")
+    print(f"  cache hit rates: embedding {result['embedding_cache_hit_rate']:.0%}, "
+          f"response {result['response_cache_hit_rate']:.0%}, "
+          f"condition router {result['router_hit_rate']:.0%}")
+    print(f"  {'stage':20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, row in result['stages'].items():
+        print(f"  {stage:20} {row['count']:6d} {row['p50']:9.2f} {row['p95']:9.2f} {row['p99']:9.2f}")
+
+
+def compare(results, baseline, tolerance):
+    """Returns regression messages: p95 latency up or throughput down by more than `tolerance`."""
+    previous = {level['users']: level for level in baseline['levels']}
+    regressions = []
+    for level in results['levels']:
+        old = previous.get(level['users'])
+        if old is None:
+            continue
+        if level['throughput_rps'] < old['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{level['users']} users: throughput {old['throughput_rps']:.1f} -> "
+                               f"{level['throughput_rps']:.1f} req/s")
+        for stage, row in level['stages'].items():
+            old_row = old['stages'].get(stage)
+            if old_row and row['p95'] > old_row['p95'] * (1 + tolerance) + 1.0:
+                regressions.append(f"{level['users']} users: {stage} p95 {old_row['p95']:.1f} -> "
+                                   f"{row['p95']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test with a stub LLM")
+    parser.add_argument("--docs", type=int, default=10000,
+                        help="Synthetic corpus size (scaled up from DIET_DOCUMENTS)")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--backend", default="numpy", choices=("numpy", "chroma"))
+    parser.add_argument("--no-hybrid", action="store_true",
+                        help="Vector retrieval only (no BM25 fusion or lexical fast path)")
+    parser.add_argument("--no-router", action="store_true",
+                        help="Disable the condition router (every query goes to retrieval)")
+    parser.add_argument("--users", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--sessions", type=int, default=100, help="Sessions replayed per level")
+    parser.add_argument("--follow-ups", type=int, default=1, help="Follow-up turns per session")
+    parser.add_argument("--repeat-fraction", type=float, default=0.3,
+                        help="Share of sessions repeating an earlier query")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--generate-latency", type=float, default=0.8)
+    parser.add_argument("--latency-dist", default="lognormal", choices=LATENCY_DISTRIBUTIONS)
+    parser.add_argument("--latency-spread", type=float, default=0.4)
+    parser.add_argument("--tail-prob", type=float, default=0.01,
+                        help="Probability of a 10x slower call")
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON (e.g. a regression baseline)")
+    parser.add_argument("--baseline", help="Compare against an earlier --output file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression before failing")
+    args = parser.parse_args()
+
+    rss_start = current_rss_mb()
+    stub = StubGemini(dimension=args.dim, embed_latency=args.embed_latency,
+                      generate_latency=args.generate_latency,
+                      latency_distribution=args.latency_dist, latency_spread=args.latency_spread,
+                      tail_prob=args.tail_prob, error_rate=args.error_rate,
+                      rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    corpus = synthetic_corpus(args.docs)
+    engine = DietRAGEngine(EngineConfig(retrieval_backend=args.backend, async_prefetch=False,
+                                        hybrid_retrieval=not args.no_hybrid,
+                                        condition_router=not args.no_router),
+                           documents=corpus, api=stub)
+    start = time.perf_counter()
+    engine.warm_up(embed_fn=stub.embedder)  # Index build is not what's being measured
+    build_s = time.perf_counter() - start
+    rss_index = current_rss_mb()
+    print(f"{args.docs} docs x {args.dim} dims ({args.backend}): index built in {build_s:.2f}s, "
+          f"RSS {rss_start:.0f} -> {rss_index:.0f} MB")
+    print(f"stub: embed {args.embed_latency * 1000:.0f}ms, generate {args.generate_latency * 1000:.0f}ms "
+          f"({args.latency_dist}, spread {args.latency_spread}), "
+          f"errors {args.error_rate:.1%}, rate limits {args.rate_limit_rate:.1%}")
+
+    sessions = query_mix(corpus, args.sessions, follow_ups=args.follow_ups,
+                         repeat_fraction=args.repeat_fraction, seed=args.seed)
+    levels = []
+    for users in [int(n) for n in args.users.split(",")]:
+        result = run_level(engine, sessions, users)
+        print_level(result)
+        levels.append(result)
+    engine.close()
+
+    results = {
+        "config": vars(args),
+        "build_s": build_s,
+        "rss_start_mb": rss_start,
+        "rss_index_mb": rss_index,
+        "peak_rss_mb": peak_rss_mb(),
+        "levels": levels,
+    }
+    print(f"\npeak RSS: {results['peak_rss_mb']:.0f} MB")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# benchmarks/bench_resilience.py
+
+# Offline check of diet_rag.resilience.ResilientGemini against the
+# fault-injecting diet_rag.stubs.StubGemini. Four scenarios:
+#   errors       transient 5xx / 429 failures: success rate without and with retries
+#   tail         slow-call tail: embed latency percentiles without and with hedging
+#   outage       a 503 outage: the circuit breaker fails fast, then recovers
+#   concurrency  many concurrent callers: calls in flight stay under the cap
+#
+# Usage: python benchmarks/bench_resilience.py [--scenarios errors,tail] [--calls 200]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diet_rag.resilience import CircuitOpenError, ResilientGemini, RetryPolicy  # noqa: E402
+from diet_rag.stubs import StubGemini  # noqa: E402
+from workload import percentile  # noqa: E402
+
+SCENARIOS = ("errors", "tail", "outage", "concurrency")
+
+
+def run_calls(client, calls, users, text="query"):
+    """Issues `calls` embed calls from `users` threads; returns (latencies ms, errors by type)."""
+    latencies, errors = [], {}
+
+    def call(i):
+        start = time.perf_counter()
+        try:
+            client.embed_content(model="stub", content=f"{text} {i}", task_type="retrieval_query")
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(call, range(calls)))
+    return latencies, errors
+
+
+def describe(label, latencies, errors, calls):
+    print(f"  {label:24} ok {len(latencies) / calls:6.1%}  p50 {percentile(latencies, 50):7.1f} ms  "
+          f"p99 {percentile(latencies, 99):7.1f} ms  errors {errors or '-'}")
+
+
+def scenario_errors(args):
+    print(f"errors: {args.error_rate:.0%} 5xx + {args.rate_limit_rate:.0%} 429 per call")
+    for label, attempts in (("no retries", 1), (f"{args.attempts} attempts", args.attempts)):
+        stub = StubGemini(dimension=16, embed_latency=args.latency, error_rate=args.error_rate,
+                          rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+        client = ResilientGemini(stub, retry_policy=RetryPolicy(attempts, initial_delay=0.02),
+                                 failure_threshold=0)
+        latencies, errors = run_calls(client, args.calls, args.users)
+        describe(label, latencies, errors, args.calls)
+
+
+def scenario_tail(args):
+    print(f"tail: {args.tail_prob:.0%} of calls 10x slower (median {args.latency * 1000:.0f} ms)")
+    for label, hedge_delay in (("no hedging", 0.0), (f"hedge after {args.hedge_delay * 1000:.0f} ms",
+                                                     args.hedge_delay)):
+        stub = StubGemini(dimension=16, embed_latency=args.latency, latency_distribution="lognormal",
+                          latency_spread=0.2, tail_prob=args.tail_prob, seed=args.seed)
+        client = ResilientGemini(stub, hedge_delay=hedge_delay)
+        latencies, errors = run_calls(client, args.calls, args.users)
+        describe(label, latencies, errors, args.calls)
+        if hedge_delay:
+            stats = client.stats()
+            print(f"  {'':24} {stats['hedges']} hedges sent, {stats['hedge_wins']} won; "
+                  f"{stub.embed_calls} API calls for {args.calls} requests")
+
+
+def scenario_outage(args):
+    print(f"outage: every call fails for {args.outage:.1f}s, breaker resets after {args.reset:.1f}s")
+    stub = StubGemini(dimension=16, embed_latency=args.latency, seed=args.seed)
+    client = ResilientGemini(stub, retry_policy=RetryPolicy(2, initial_delay=0.01),
+                             failure_threshold=5, reset_timeout=args.reset)
+    stub.start_outage(args.outage)
+    start = time.perf_counter()
+    outcomes = []
+    while time.perf_counter() - start < args.outage + 3 * args.reset:
+        try:
+            client.embed_content(model="stub", content="ping", task_type="retrieval_query")
+            outcomes.append("ok")
+        except CircuitOpenError:
+            outcomes.append("fast-fail")
+        except Exception:
+            outcomes.append("error")
+        time.sleep(0.02)
+    recovered = next((i for i, outcome in enumerate(outcomes) if outcome == "ok"), None)
+    circuit = client.stats()['circuits']['embed']
+    print(f"  {len(outcomes)} calls: {outcomes.count('error')} reached the API and failed, "
+          f"{outcomes.count('fast-fail')} failed fast, {outcomes.count('ok')} succeeded")
+    print(f"  API calls during the run: {stub.embed_calls}; breaker opened {circuit['opened']}x, "
+          f"first success at call {recovered}, final state {circuit['state']}")
+
+
+def scenario_concurrency(args):
+    print(f"concurrency: {args.users * 4} callers, cap {args.max_in_flight} in flight")
+    stub = StubGemini(dimension=16, embed_latency=args.latency, seed=args.seed)
+    client = ResilientGemini(stub, max_in_flight=args.max_in_flight)
+    start = time.perf_counter()
+    latencies, errors = run_calls(client, args.calls, args.users * 4)
+    wall = time.perf_counter() - start
+    describe(f"cap {args.max_in_flight}", latencies, errors, args.calls)
+    print(f"  {'':24} peak in flight at the API {stub.peak_in_flight} "
+          f"(client {client.stats()['peak_in_flight']}), {args.calls / wall:.0f} calls/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resilient client checks against a faulty stub")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="Median embed latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.05)
+    parser.add_argument("--attempts", type=int, default=4)
+    parser.add_argument("--tail-prob", type=float, default=0.05)
+    parser.add_argument("--hedge-delay", type=float, default=0.05)
+    parser.add_argument("--outage", type=float, default=1.0)
+    parser.add_argument("--reset", type=float, default=0.5)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    runners = {"errors": scenario_errors, "tail": scenario_tail, "outage": scenario_outage,
+               "concurrency": scenario_concurrency}
+    for name in args.scenarios.split(","):
+        if name not in runners:
+            parser.error(f"unknown scenario {name!r} (expected some of {', '.join(SCENARIOS)})")
+        runners[name](args)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# benchmarks/bench_retrieval.py
+
+# Compares retrieval backends (ChromaDB vs in-process NumPy) on a synthetic
+# corpus: index build time, query latency percentiles and resident memory.
+# Each backend runs in its own subprocess so RSS numbers don't mix.
+#
+# Usage: python benchmarks/bench_retrieval.py --docs 20000 --queries 500
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from workload import current_rss_mb, percentile  # noqa: E402
+
+
+def run_child(args):
+    import numpy as np
+
+    rss_start = current_rss_mb()
+    from diet_rag.retrieval import make_backend  # noqa: E402
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.docs, args.dim), dtype=np.float32)
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    ids = [f"doc{i}" for i in range(args.docs)]
+    documents = [f"Synthetic document {i}" for i in range(args.docs)]
+    metadatas = [{"condition": f"Condition {i}"} for i in range(args.docs)]
+    rss_data = current_rss_mb()
+
+    start = time.perf_counter()
+    backend = make_backend(args.backend, f"bench-{args.backend}")
+    backend.upsert(ids, documents, metadatas, embeddings.tolist())
+    build_s = time.perf_counter() - start
+    rss_built = current_rss_mb()
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.query(query.tolist(), n_results=args.k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    print(json.dumps({
+        "backend": args.backend,
+        "build_s": build_s,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "index_rss_mb": rss_built - rss_data,
+        "total_rss_mb": rss_built,
+        "import_rss_mb": rss_start,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval backend benchmark")
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--backends", default="chroma,numpy")
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_child(args)
+        return
+
+    print(f"{args.docs} docs x {args.dim} dims, {args.queries} queries, k={args.k}")
+    print(f"{'backend':8} {'build s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'index MB':>9} {'RSS MB':>8}")
+    for backend in args.backends.split(","):
+        out = subprocess.run(
+            [sys.executable, __file__, "--backend", backend, "--docs", str(args.docs),
+             "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k)],
+            capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['backend']:8} {r['build_s']:8.2f} {r['p50_ms']:8.3f} {r['p95_ms']:8.3f} "
+              f"{r['p99_ms']:8.3f} {r['index_rss_mb']:9.1f} {r['total_rss_mb']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
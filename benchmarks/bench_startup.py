@@ -0,0 +1,122 @@
+# benchmarks/bench_startup.py
+
+# Cold-start timings of the app's two startup strategies, offline against the
+# diet_rag.stubs.StubGemini stub:
+#   imports  seconds to import the modules the app used to import eagerly
+#            (chromadb, pandas, google.generativeai) vs the ones it imports
+#            before rendering now (diet_rag), each in a fresh interpreter
+#   engine   eager: build and warm up the engine before the page renders;
+#            background (diet_rag.startup.BackgroundStartup): the page renders
+#            at once and a question asked at t=0 waits for the engine
+#
+# Usage: python benchmarks/bench_startup.py [--docs 500] [--embed-latency 0.002]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diet_rag import DietRAGEngine, EngineConfig  # noqa: E402
+from diet_rag.startup import BackgroundStartup  # noqa: E402
+from diet_rag.stubs import StubGemini  # noqa: E402
+from workload import synthetic_corpus  # noqa: E402
+
+EAGER_IMPORTS = ("chromadb", "pandas", "google.generativeai", "diet_rag")
+LAZY_IMPORTS = ("diet_rag",)
+QUESTION = "I have high blood pressure"
+
+
+def import_seconds(modules, repeat):
+    """Best-of-`repeat` seconds to import `modules` in a fresh interpreter (None if one is missing)."""
+    script = ("import time, warnings; warnings.simplefilter('ignore'); start = time.perf_counter()\n"
+              + "".join(f"import {module}\n" for module in modules)
+              + "print(time.perf_counter() - start)")
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if result.returncode:
+            return None
+        seconds = float(result.stdout.strip().splitlines()[-1])
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def scenario_imports(args):
+    print("imports before the first render (fresh interpreter, best of "
+          f"{args.repeat}):")
+    for label, modules in (("eager", EAGER_IMPORTS), ("lazy", LAZY_IMPORTS)):
+        seconds = import_seconds(modules, args.repeat)
+        shown = "not installed" if seconds is None else f"{seconds * 1000:7.0f} ms"
+        print(f"  {label:12} {shown}  ({', '.join(modules)})")
+
+
+def make_factory(args):
+    corpus = synthetic_corpus(args.docs)
+
+    def factory():
+        stub = StubGemini(dimension=args.dim, embed_latency=args.embed_latency,
+                          generate_latency=args.generate_latency, seed=args.seed)
+        return DietRAGEngine(EngineConfig(retrieval_backend="numpy", async_prefetch=False),
+                             documents=corpus, api=stub)
+    return factory
+
+
+def answer(engine):
+    return engine.generate(QUESTION, engine.retrieve(QUESTION)).text
+
+
+def scenario_engine(args):
+    print(f"engine: {args.docs} docs, stub embed {args.embed_latency * 1000:.1f} ms, "
+          f"generate {args.generate_latency * 1000:.0f} ms")
+    factory = make_factory(args)
+
+    start = time.perf_counter()
+    engine = factory()
+    engine.warm_up()
+    rendered = time.perf_counter() - start
+    answer(engine)
+    answered = time.perf_counter() - start
+    engine.close()
+    print(f"  {'eager':12} page rendered {rendered * 1000:7.0f} ms  ready {rendered * 1000:7.0f} ms  "
+          f"first answer {answered * 1000:7.0f} ms")
+
+    start = time.perf_counter()
+    startup = BackgroundStartup(factory).start()
+    rendered = time.perf_counter() - start
+    engine = startup.wait()  # The question asked at t=0 is queued until here
+    ready = time.perf_counter() - start
+    answer(engine)
+    answered = time.perf_counter() - start
+    engine.close()
+    print(f"  {'background':12} page rendered {rendered * 1000:7.0f} ms  ready {ready * 1000:7.0f} ms  "
+          f"first answer {answered * 1000:7.0f} ms")
+    print(f"  {'':12} startup stages: "
+          + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in startup.timings.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start timings, eager vs background startup")
+    parser.add_argument("--scenarios", default="imports,engine")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.002,
+                        help="Stub latency per embedding request (s)")
+    parser.add_argument("--generate-latency", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3, help="Import timing runs per set")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    runners = {"imports": scenario_imports, "engine": scenario_engine}
+    for name in args.scenarios.split(","):
+        if name not in runners:
+            parser.error(f"unknown scenario {name!r} (expected some of {', '.join(runners)})")
+        runners[name](args)
+        print()
+
+
+if __name__ == "__main__":
+    main()
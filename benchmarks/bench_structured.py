@@ -0,0 +1,74 @@
+# benchmarks/bench_structured.py
+
+# Output tokens and latency of first recommendations in markdown mode vs
+# structured output mode (STRUCTURED_OUTPUT, diet_rag.structured), for one
+# question per knowledge base condition. Output tokens come from the API's
+# usage metadata, or are estimated locally (diet_rag.history.count_tokens)
+# when the response has none, as with the stub. Also reports how large the
+# answers are as stored in the response cache and the chat history.
+#
+# Usage: GOOGLE_API_KEY=... python benchmarks/bench_structured.py [--questions 10]
+#        python benchmarks/bench_structured.py --stub   (offline; the stub answers both
+#        modes with the same recommendation, so only the formatting differs)
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diet_data import DIET_DOCUMENTS  # noqa: E402
+from diet_rag import DietRAGEngine, EngineConfig  # noqa: E402
+from workload import percentile  # noqa: E402
+
+MODES = (("markdown", False), ("structured", True))
+
+
+def run_mode(api, structured, questions):
+    """Per question: (output tokens, generate ms, stored bytes, parsed)."""
+    engine = DietRAGEngine(EngineConfig(retrieval_backend="numpy", async_prefetch=False,
+                                        structured_output=structured), api=api)
+    engine.warm_up()
+    rows = []
+    for question in questions:
+        with engine.trace("recommend") as trace:
+            answer = engine.generate(question, engine.retrieve(question))
+            text = answer.resolve()
+        stored = answer.structured.to_json() if answer.structured is not None else text
+        rows.append((trace.tokens.get('output', 0), trace.stages.get('generate', 0.0),
+                     len(stored.encode("utf-8")), answer.structured is not None))
+    engine.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Markdown vs structured output: tokens and latency")
+    parser.add_argument("--questions", type=int, default=len(DIET_DOCUMENTS))
+    parser.add_argument("--stub", action="store_true", help="run offline against the Gemini stub")
+    args = parser.parse_args()
+
+    if args.stub:
+        from diet_rag.stubs import StubGemini
+        api = StubGemini(embed_latency=0.0, generate_latency=0.0, answer_from_context=True)
+    else:
+        import google.generativeai as api
+        api.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    questions = [f"What should I eat for {doc['condition'].lower()}?"
+                 for doc in DIET_DOCUMENTS][:args.questions]
+
+    print(f"{len(questions)} questions against {'the stub' if args.stub else 'the Gemini API'}")
+    baseline = None
+    for label, structured in MODES:
+        rows = run_mode(api, structured, questions)
+        tokens = [row[0] for row in rows]
+        mean_tokens = sum(tokens) / len(tokens)
+        baseline = baseline or mean_tokens
+        stored = sum(row[2] for row in rows) / len(rows)
+        parsed = f", {sum(row[3] for row in rows)}/{len(rows)} parsed" if structured else ""
+        print(f"  {label:11} output tokens mean {mean_tokens:6.0f} ({mean_tokens / baseline:5.0%})  "
+              f"p95 {percentile(tokens, 95):6.0f}  generate p50 "
+              f"{percentile([row[1] for row in rows], 50):7.0f} ms  stored {stored:5.0f} B{parsed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/workload.py
+
+# Helpers shared by the benchmark scripts: synthetic corpora scaled up from
+# DIET_DOCUMENTS, replayable query mixes, percentiles and memory readings.
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diet_data import DIET_DOCUMENTS  # noqa: E402
+from diet_rag.config import COMMON_FOLLOW_UPS  # noqa: E402
+
+QUERY_TEMPLATES = (
+    "I have {condition}",
+    "What should I eat with {condition}?",
+    "diet for {condition}",
+    "My doctor says I have {condition}, any food advice?",
+)
+
+
+def synthetic_corpus(n_docs, base=DIET_DOCUMENTS):
+    """Scales `base` up to n_docs by cycling and renaming entries."""
+    corpus = []
+    for i in range(n_docs):
+        doc_data = base[i % len(base)]
+        corpus.append({
+            "id": f"{doc_data['id']}-{i}",
+            "condition": f"{doc_data['condition']} #{i}",
+            "text": doc_data['text'],
+        })
+    return corpus
+
+
+def query_mix(documents, n_sessions, follow_ups=1, repeat_fraction=0.3, seed=0):
+    """Builds a replayable list of sessions: {'query', 'follow_ups'}.
+
+    A `repeat_fraction` of sessions reuse an earlier session's first query
+    (popular conditions), the rest ask about a random document's condition in
+    one of QUERY_TEMPLATES' phrasings. Follow-ups mix COMMON_FOLLOW_UPS with
+    one-off questions.
+    """
+    rng = random.Random(seed)
+    sessions = []
+    for i in range(n_sessions):
+        if sessions and rng.random() < repeat_fraction:
+            query = rng.choice(sessions)['query']
+        else:
+            condition = rng.choice(documents)['condition']
+            query = rng.choice(QUERY_TEMPLATES).format(condition=condition)
+        turns = [rng.choice(COMMON_FOLLOW_UPS) if rng.random() < 0.5
+                 else f"is food #{rng.randrange(1000)} ok for me?"
+                 for _ in range(follow_ups)]
+        sessions.append({'query': query, 'follow_ups': turns})
+    return sessions
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
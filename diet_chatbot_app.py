@@ -1,11 +1,14 @@
 # app.py
+# google.generativeai and chromadb are imported on the startup thread, once needed
+import time
 import streamlit as st
-import google.generativeai as genai_default
-import chromadb
-import pandas as pd
 import os
-import time
-from diet_data import DIET_DOCUMENTS  # Import from the separate file
+from diet_rag import (ConversationState, DietRAGEngine, DietRAGError, EmbeddingError,
+                      EngineConfig, RetrievalError)
+from diet_rag.aio import TaskGroup
+from diet_rag.prompts import ERROR_FOLLOW_UP_MESSAGE, ERROR_INITIAL_MESSAGE
+from diet_rag.startup import BackgroundStartup
+from diet_rag.structured import SECTION_TITLES, Recommendation, SchemaError
 
 # --- Streamlit App UI and Logic ---
 
@@ -19,218 +22,241 @@ st.caption("Your friendly AI diet planner for health conditions")
 try:
     GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
     os.environ['GOOGLE_API_KEY'] = GOOGLE_API_KEY
-    genai_default.configure(api_key=GOOGLE_API_KEY)
     st.sidebar.success("API Key configured successfully.", icon="✅")
 except KeyError:
     st.error(
         "!! WARNING! Google API Key not found! Please add it to Streamlit Secrets (key: GOOGLE_API_KEY).")
     st.stop()
-except Exception as e:
-    st.error(f"!! WARNING! Error configuring API Key: {e}")
-    st.stop()
+
+# Engine settings come from Streamlit Secrets (upper-case field names, e.g.
+# RETRIEVAL_BACKEND = "numpy"), falling back to environment variables.
+# See diet_rag/config.py for the full list.
+ENGINE_CONFIG = EngineConfig.from_mapping(st.secrets, env=os.environ)
+
+# Stream tokens into the chat as they arrive instead of waiting for the full answer
+STREAM_RESPONSES = str(st.secrets.get("STREAM_RESPONSES", "true")).lower() == "true"
+# Show the last request's timing breakdown and a metrics download in the sidebar
+DEBUG_PANEL = str(st.secrets.get("DEBUG_PANEL", "false")).lower() == "true"
+# Conditions listed in the sidebar before a filter box is offered
+MAX_LISTED_CONDITIONS = 30
+# How often the sidebar redraws the knowledge base progress while the engine starts
+STARTUP_POLL_SECONDS = 0.5
 
 
 # --- Caching Functions ---
-# Cache models and ChromaDB client/collection to avoid re-initializing on every interaction
+# The engine (models, vector store, caches) is built once per process, on a
+# background thread so the page renders while the knowledge base is indexed
 
-@st.cache_resource
-def load_models():
-    """Loads and caches the embedding and generative models."""
-    try:
-        embedding_model = genai_default.GenerativeModel(
-            'models/text-embedding-004')
-        generative_model = genai_default.GenerativeModel('gemini-2.0-flash')
-        return embedding_model, generative_model
-    except Exception as e:
-        st.error(f"!! WARNING! Error loading Google AI models: {e}")
-        st.stop()
+
+def create_engine():
+    """Creates the RAG engine; runs on the startup thread along with the API client import."""
+    import google.generativeai as genai_default
+    genai_default.configure(api_key=GOOGLE_API_KEY)
+    # The knowledge base is KNOWLEDGE_BASE_PATH if set, else DIET_DOCUMENTS
+    return DietRAGEngine(ENGINE_CONFIG, api=genai_default)
 
 
 @st.cache_resource
-def setup_chromadb():
-    """Sets up and caches the ChromaDB client and collection, embedding documents."""
-    client = chromadb.Client()  # In-memory client
-    DB_COLLECTION_NAME = "diet_recommendations_streamlit"
+def start_engine():
+    """Starts creating and warming up the engine (embeds new or changed documents) in the background."""
+    return BackgroundStartup(create_engine, prewarm=ENGINE_CONFIG.async_prefetch).start()
+
+
+def wait_for_engine():
+    """Returns the ready engine; a request made during startup waits here with a progress bar.
 
-    # Check if collection exists, if so, use it, otherwise create and populate
+    Nothing is answered before the engine is ready (the caches live in it),
+    so the request polls the startup progress until then. A failed startup
+    is dropped from the resource cache, so the next rerun starts over.
+    """
+    if not startup.done:
+        progress_bar = st.progress(0.0)
+        while not startup.done:
+            done, total = startup.progress
+            # The total is unknown while a knowledge base file is read for the first time
+            progress_bar.progress(min(done / total, 1.0) if total else 0.0,
+                                  text=f"Preparing the knowledge base ({done} documents indexed); "
+                                       "your question is queued...")
+            time.sleep(0.1)
+        progress_bar.empty()
     try:
-        db_collection = client.get_collection(name=DB_COLLECTION_NAME)
-        if db_collection.count() != len(DIET_DOCUMENTS):
-            st.warning(
-                "Collection exists but document count mismatch. Recreating...")
-            client.delete_collection(name=DB_COLLECTION_NAME)
-            raise Exception("Recreate collection")  # Force recreation
-        st.sidebar.info(
-            f"Using existing ChromaDB collection: '{DB_COLLECTION_NAME}'")
-
-    except Exception:
-        st.sidebar.info(
-            f"Creating new ChromaDB collection: '{DB_COLLECTION_NAME}'")
-        db_collection = client.create_collection(
-            name=DB_COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
-
-        # Embed and Store Documents
-        st.sidebar.text("Embedding documents...")
-        progress_bar = st.sidebar.progress(0)
-        total_docs = len(DIET_DOCUMENTS)
-
-        doc_embeddings = []
-        doc_ids = []
-        doc_texts = []
-        doc_metadatas = []
-
-        for i, doc_data in enumerate(DIET_DOCUMENTS):
-            try:
-                text_to_embed = f"Condition: {doc_data['condition']}\nDetails: {doc_data['text']}"
-                # Use the loaded embedding model here
-                embedding = genai_default.embed_content(model='models/text-embedding-004',  # Explicitly use model name
-                                                        content=text_to_embed,
-                                                        task_type="retrieval_document")['embedding']
-                if embedding:
-                    doc_embeddings.append(embedding)
-                    doc_ids.append(doc_data['id'])
-                    doc_texts.append(doc_data['text'])
-                    doc_metadatas.append({"condition": doc_data['condition']})
-                else:
-                    st.warning(
-                        f"Skipping document id {doc_data['id']} due to embedding error.")
-                time.sleep(0.1)  # Small delay
-                progress_bar.progress((i + 1) / total_docs)
-
-            except Exception as e:
-                st.error(f"Error embedding doc {doc_data['id']}: {e}")
-                st.sidebar.error(
-                    "Embedding process failed. Please check logs/API Key.")
-                st.stop()
-
-        if doc_embeddings:
-            db_collection.add(
-                embeddings=doc_embeddings,
-                documents=doc_texts,
-                metadatas=doc_metadatas,
-                ids=doc_ids
-            )
-            st.sidebar.success(f"Added {db_collection.count()} documents.")
-            progress_bar.empty()  # Remove progress bar after completion
-        else:
-            st.sidebar.error("No documents were embedded.")
-            st.stop()
+        return startup.wait()
+    except ValueError as e:
+        st.error(f"!! WARNING! {e}")
+    except EmbeddingError as e:
+        st.error(f"Error embedding documents: {e}")
+        st.sidebar.error(
+            "Embedding process failed. Please check logs/API Key.")
+    except Exception as e:
+        st.error(f"!! WARNING! Error loading Google AI models: {e}")
+    start_engine.clear()
+    st.stop()
+
 
-    return client, db_collection
+@st.fragment(run_every=STARTUP_POLL_SECONDS)
+def startup_progress():
+    """Live knowledge base progress; reruns the whole page once startup finishes."""
+    if startup.done:
+        st.rerun()
+    done, total = startup.progress
+    st.info(f"Preparing the knowledge base: {done}"
+            f"{f' of {total}' if total else ''} documents indexed...")
+
+
+def show_startup_status():
+    """Sidebar summary of the knowledge base load (or its live progress while starting)."""
+    if not startup.ready:
+        with st.sidebar:
+            startup_progress()
+        return
+    sync_stats = startup.sync_stats
+    load_report = engine.load_report
+    if load_report.dropped:
+        st.sidebar.warning(
+            f"Ignored {load_report.dropped} knowledge base entries "
+            f"({load_report.invalid} invalid, "
+            f"{load_report.duplicate_ids + load_report.duplicate_content} duplicates).")
+    if sync_stats['skipped']:
+        st.sidebar.warning(
+            f"Skipped {sync_stats['skipped']} document(s) due to embedding errors.")
+    st.sidebar.info(
+        f"Using {engine.vector_store.name} vector store: '{engine.collection_name()}'")
+    st.sidebar.success(
+        f"{engine.vector_store.count()} documents ready "
+        f"({sync_stats['embedded']} embedded, {sync_stats['from_artifact']} from artifact, "
+        f"{sync_stats['deleted']} removed, "
+        f"{sync_stats['unchanged']} unchanged) in {startup.timings['total']:.1f}s.")
 
 
 # --- Load Resources ---
-embedding_model, generative_model = load_models()
-chroma_client, chroma_collection = setup_chromadb()
+startup = start_engine()
+# None until startup finishes; requests call wait_for_engine() first
+engine = wait_for_engine() if startup.done else None
+show_startup_status()
 
 # --- Helper Functions ---
+# Thin wrappers that surface engine errors in the UI
 
 
 def embed_text_streamlit(text, task_type="retrieval_document"):
-    """Embeds text using the loaded Google AI embedding model."""
+    """Embeds text using the engine (cached per normalized text)."""
     try:
-        embedding = genai_default.embed_content(model=embedding_model.model_name,
-                                                content=text,
-                                                task_type=task_type)
-        return embedding['embedding']
-    except Exception as e:
+        return engine.embed_query(text, task_type=task_type)
+    except EmbeddingError as e:
         st.error(f"Error embedding text: {e}")
         return None
 
 
-def retrieve_relevant_documents_streamlit(query, n_results=2):
-    """Retrieves relevant documents from the cached ChromaDB collection."""
-    if not query:
-        return []
-    query_embedding = embed_text_streamlit(query, task_type="retrieval_query")
-    if query_embedding is None:
-        return []
+def retrieve_for_session(query, n_results=None):
+    """Retrieves documents for a query, reusing results already fetched this session.
 
-    try:
-        results = chroma_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results,
-            include=['documents']
-        )
-        return results.get('documents', [[]])[0]
-    except Exception as e:
-        st.error(f"Error querying ChromaDB: {e}")
-        return []
-
-
-def generate_response_streamlit(user_problem, retrieved_docs):
-    """Generates initial diet recommendation response."""
-    context = "\n\n---\n\n".join(
-        retrieved_docs) if retrieved_docs else "No specific context found."
-    prompt = f"""You are a friendly and helpful AI assistant acting like a personal diet planner. Your goal is to provide diet recommendations based *only* on the provided context information.
-
-    **User's Problem:** "{user_problem}"
-
-    **Context Information:**
-    ```
-    {context}
-    ```
-
-    **Instructions:**
-    1. Carefully review the context information related to the user's problem.
-    2. If relevant context is found, synthesize the information to provide clear diet recommendations. List specific suggestions for:
-        * Fruits
-        * Vegetables
-        * Meats/Proteins
-        * Other relevant foods/tips
-        * Suggest 1-2 simple recipe ideas mentioned or inspired by the context.
-    3. If no relevant context is found, state that you couldn't find specific information for that exact condition, but offer general healthy eating tips. Do NOT invent recommendations.
-    4. Use a friendly, empathetic, family meal planner tone.
-    5. **Crucially:** After providing the recommendations/info, ALWAYS end your response by asking: "Do you want to discuss further details about your problem?"
-
-    **Your Response:**
+    Returns {'embedding', 'ids', 'documents'} (empty lists if retrieval failed).
     """
     try:
-        response = generative_model.generate_content(prompt)
-        # Basic safety check (example)
-        if response.prompt_feedback.block_reason:
-            st.warning(
-                f"Response blocked: {response.prompt_feedback.block_reason}")
-            return "I apologize, but I can't provide a response to that specific request due to safety guidelines. Could you perhaps rephrase or ask about a different aspect? After responding, ask: Do you want to discuss further details about your problem?"
-        return response.text
-    except Exception as e:
-        st.error(f"Error generating response from Gemini: {e}")
-        return "Sorry, I encountered an error. Please try again. Do you want to discuss further details about your problem?"
-
+        return engine.retrieve_for_session(st.session_state.conversation, query, n_results)
+    except EmbeddingError as e:
+        st.error(f"Error embedding text: {e}")
+    except RetrievalError as e:
+        st.error(f"Error querying the vector store: {e}")
+    return {'embedding': None, 'ids': [], 'documents': []}
 
-def generate_follow_up_response(initial_problem, conversation_history, user_input):
-    """Generates a response for follow-up conversation."""
 
-    # Basic conversation history string (can be improved)
-    history_str = "\n".join(
-        [f"User: {turn['user']}\nAI: {turn['ai']}" for turn in conversation_history])
+def retrieve_relevant_documents_streamlit(query, n_results=2):
+    """Retrieves relevant documents: BM25 and vector results fused, or decisive
+    lexical matches alone without embedding the query (see DietRAGEngine.retrieve)."""
+    return retrieve_for_session(query, n_results)['documents']
 
-    prompt = f"""You are a friendly AI personal diet planner continuing a conversation.
 
-    The user's initial problem was: "{initial_problem}"
-    Conversation History:
-    {history_str}
+def follow_up_context(user_input, pending=None):
+    """Context for a follow-up turn: new matches for the input, then earlier session documents."""
+    conversation = st.session_state.conversation
+    if engine.collect_speculative_results(conversation, st.session_state.speculative_tasks.get('follow_ups')):
+        st.session_state.speculative_tasks.pop('follow_ups')
+    try:
+        return engine.follow_up_context(conversation, user_input, pending)
+    except DietRAGError as e:
+        st.error(f"Error retrieving context: {e}")
+        return engine.session_documents(conversation)
+
+
+def render_recommendation(recommendation):
+    """Lays out a structured recommendation (STRUCTURED_OUTPUT) in the current container."""
+    st.write(recommendation.summary)
+    sections = [(title, getattr(recommendation, name)) for name, title in SECTION_TITLES.items()
+                if name != "tips" and getattr(recommendation, name)]
+    for column, (title, items) in zip(st.columns(len(sections)) if sections else [], sections):
+        column.markdown(f"**{title}**\n" + "\n".join(f"- {item}" for item in items))
+    if recommendation.tips:
+        st.markdown(f"**{SECTION_TITLES['tips']}**\n" + "\n".join(f"- {tip}" for tip in recommendation.tips))
+    for recipe in recommendation.recipes:
+        with st.expander(f"Recipe idea: {recipe['name']}"):
+            st.write(recipe['description'])
+
+
+def render_message(ai_msg):
+    """Writes a chat history answer; structured ones are stored as compact JSON."""
+    if ENGINE_CONFIG.structured_output and ai_msg.startswith("{"):
+        try:
+            render_recommendation(Recommendation.from_compact(ai_msg))
+            return
+        except SchemaError:
+            pass
+    st.write(ai_msg)
+
+
+def render_answer(answer, stream):
+    """Writes a streamed answer into an assistant chat message; returns the final text.
+
+    Structured answers are not streamed and are returned as compact JSON.
+    """
+    if answer.blocked:
+        st.warning(f"Response blocked: {answer.block_reason}")
+        return answer.text
+    if answer.structured is not None:
+        if stream:
+            with st.chat_message("assistant"):
+                render_recommendation(answer.structured)
+        return answer.structured.to_json()
+    if stream:
+        return st.chat_message("assistant").write_stream(answer)
+    return answer.resolve()
+
+
+def generate_response_streamlit(user_problem, retrieved, stream=False):
+    """Generates initial diet recommendation response.
+
+    `retrieved` is the retrieval result; similar earlier questions that retrieved
+    the same documents are answered from the semantic response cache. With
+    `stream=True` the answer is streamed into the chat as it is generated.
+    """
+    try:
+        return render_answer(engine.generate(user_problem, retrieved, stream=stream), stream)
+    except DietRAGError as e:
+        st.error(f"Error generating response from Gemini: {e}")
+        return ERROR_INITIAL_MESSAGE
 
-    The user's latest input is: "{user_input}"
 
-    Instructions:
-    1. Respond helpfully and conversationally to the user's latest input, keeping the initial problem and prior conversation in mind.
-    2. Provide additional details, clarification, or answer related questions. Prioritize safety and avoid giving specific medical advice - stick to general dietary patterns and suggestions based on common knowledge for the condition.
-    3. Keep the tone friendly and supportive.
-    4. **Crucially:** After your response, ALWAYS ask: "Do you want to continue discussing?"
+def generate_follow_up_response(initial_problem, conversation_history, user_input, stream=False,
+                                context_docs=None, history_summary=None):
+    """Generates a response for follow-up conversation (streamed into the chat if `stream=True`).
 
-    **Your Response:**
+    `context_docs` are knowledge base documents the answer should be grounded in;
+    `history_summary` summarizes turns older than `conversation_history`.
     """
     try:
-        response = generative_model.generate_content(prompt)
-        if response.prompt_feedback.block_reason:
-            st.warning(
-                f"Response blocked: {response.prompt_feedback.block_reason}")
-            return "I apologize, but I can't provide a response to that specific request due to safety guidelines. Could you perhaps rephrase or ask about a different aspect? After responding, ask: Do you want to continue discussing?"
-        return response.text
-    except Exception as e:
+        answer = engine.generate_follow_up(initial_problem, conversation_history, user_input,
+                                           context_docs=context_docs,
+                                           history_summary=history_summary,
+                                           stream=stream)
+        return render_answer(answer, stream)
+    except DietRAGError as e:
         st.error(f"Error generating follow-up response: {e}")
-        return "Sorry, I had trouble processing that. Do you want to try asking differently? Do you want to continue discussing?"
+        return ERROR_FOLLOW_UP_MESSAGE
+
+
+def select_condition(condition):
+    """Sidebar button callback: asks about `condition` on the next run."""
+    st.session_state.selected_condition = condition
 
 
 # --- Streamlit App UI and Logic ---
@@ -253,6 +279,24 @@ if 'current_user_input' not in st.session_state:  # To hold input temporarily
 # NEW: State to manage follow-up input
 if "follow_up_text_key" not in st.session_state:
     st.session_state["follow_up_text_key"] = ""
+# Engine state for this conversation: retrieval results reused across turns,
+# documents retrieved so far and the rolling history summary
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = ConversationState()
+# Condition clicked in the sidebar, answered on the next run like a submitted problem
+if 'selected_condition' not in st.session_state:
+    st.session_state.selected_condition = None
+# Breakdown of the last request (diet_rag.metrics.RequestTrace.to_dict) for the debug panel
+if 'last_trace' not in st.session_state:
+    st.session_state.last_trace = None
+# Background futures: run_tasks belong to a single script run, speculative_tasks
+# are meant to be picked up by a later run
+if 'run_tasks' not in st.session_state:
+    st.session_state.run_tasks = TaskGroup()
+if 'speculative_tasks' not in st.session_state:
+    st.session_state.speculative_tasks = TaskGroup()
+# A rerun abandons whatever the previous run left in flight
+st.session_state.run_tasks.cancel_all()
 
 
 # --- Main Interaction Area ---
@@ -271,7 +315,8 @@ with chat_placeholder:
             if user_msg and user_msg != "(Decision made)":
                 st.chat_message("user").write(user_msg)
             if ai_msg:
-                st.chat_message("assistant").write(ai_msg)
+                with st.chat_message("assistant"):
+                    render_message(ai_msg)
     st.write("---")  # Separator
 
 
@@ -283,21 +328,37 @@ with input_placeholder:
             "What's your problem or health condition? (e.g., 'back pain', 'high blood pressure')",
             key="initial_input_key"  # Unique key
         )
-        if st.button("Get Recommendations", key="submit_initial"):
+        submitted = st.button("Get Recommendations", key="submit_initial")
+        if st.session_state.selected_condition:
+            user_problem_input, submitted = st.session_state.selected_condition, True
+            st.session_state.selected_condition = None
+        if submitted:
             if user_problem_input:
+                engine = wait_for_engine()
                 st.session_state.initial_problem = user_problem_input
                 st.session_state.current_user_input = user_problem_input  # Store for history
 
-                with st.spinner("Thinking... 🤔"):
-                    retrieved = retrieve_relevant_documents_streamlit(
-                        user_problem_input)
-                    ai_response = generate_response_streamlit(
-                        user_problem_input, retrieved)
+                with engine.trace("recommend") as trace:
+                    with st.spinner("Thinking... 🤔"):
+                        retrieved = retrieve_for_session(user_problem_input)
+                        if not STREAM_RESPONSES:
+                            ai_response = generate_response_streamlit(
+                                user_problem_input, retrieved)
+                    if STREAM_RESPONSES:
+                        # Tokens are written into the chat as they arrive (no spinner)
+                        st.chat_message("user").write(user_problem_input)
+                        ai_response = generate_response_streamlit(
+                            user_problem_input, retrieved, stream=True)
+                st.session_state.last_trace = trace.to_dict()
 
                 # Add to history and update state
                 st.session_state.chat_history.append(
                     (st.session_state.current_user_input, ai_response)
                 )
+                if ENGINE_CONFIG.async_prefetch:
+                    speculative = engine.start_speculative_retrieval(st.session_state.conversation)
+                    if speculative is not None:
+                        st.session_state.speculative_tasks.add('follow_ups', speculative)
                 st.session_state.conversation_stage = 'awaiting_follow_up_decision'
                 st.session_state.current_user_input = ""  # Clear temp input storage
                 st.rerun()
@@ -320,6 +381,7 @@ with input_placeholder:
             if st.button("No 👎", key="follow_up_no"):
                 # End conversation
                 st.session_state.conversation_stage = 'ended'
+                st.session_state.speculative_tasks.cancel_all()
                 final_msg = "Okay, sounds good! Remember, these are general suggestions. Always consult with a healthcare professional or registered dietitian for personalized advice. Stay healthy! 😊"
                 # Add final message to history
                 st.session_state.chat_history.append(
@@ -338,18 +400,40 @@ with input_placeholder:
 
         # Process input when user types something and presses Enter
         if follow_up_input:  # Streamlit text_input triggers rerun on Enter or interaction
+            engine = wait_for_engine()
             st.session_state.current_user_input = follow_up_input  # Store for history
-
-            with st.spinner("Thinking... 🤔"):
-                # Prepare history context if needed by the generation function
-                # Example: last few turns (adjust as needed)
-                history_context = [{"user": u, "ai": a}
-                                   for u, a in st.session_state.chat_history[-3:] if u and a]
-                ai_response = generate_follow_up_response(
-                    st.session_state.initial_problem,
-                    history_context,  # Pass relevant history
-                    st.session_state.current_user_input  # Pass the actual user input
-                )
+            # Retrieval runs in the background while history is compacted and rendered
+            pending_retrieval = engine.start_follow_up_retrieval(
+                st.session_state.conversation, follow_up_input)
+            if pending_retrieval is not None:
+                st.session_state.run_tasks.add('follow_up_retrieval', pending_retrieval)
+
+            with engine.trace("follow_up") as trace:
+                # Recent turns within the token budget; older ones as a cached rolling summary
+                history_summary, history_context = engine.compact_history(
+                    st.session_state.conversation, st.session_state.chat_history)
+                if STREAM_RESPONSES:
+                    st.chat_message("user").write(follow_up_input)
+                    with st.spinner("Thinking... 🤔"):
+                        context_docs = follow_up_context(follow_up_input, pending_retrieval)
+                    ai_response = generate_follow_up_response(
+                        st.session_state.initial_problem,
+                        history_context,  # Pass relevant history
+                        st.session_state.current_user_input,  # Pass the actual user input
+                        stream=True,
+                        context_docs=context_docs,
+                        history_summary=history_summary
+                    )
+                else:
+                    with st.spinner("Thinking... 🤔"):
+                        ai_response = generate_follow_up_response(
+                            st.session_state.initial_problem,
+                            history_context,  # Pass relevant history
+                            st.session_state.current_user_input,  # Pass the actual user input
+                            context_docs=follow_up_context(follow_up_input, pending_retrieval),
+                            history_summary=history_summary
+                        )
+            st.session_state.last_trace = trace.to_dict()
 
             # Add follow-up Q&A to history
             st.session_state.chat_history.append(
@@ -378,7 +462,59 @@ This AI chatbot provides general diet suggestions based on common health conditi
 
 **Disclaimer:** This is an AI demo and not a substitute for professional medical or dietary advice. Always consult a qualified healthcare provider.
 """)
+if engine is not None:
+    engine_stats = engine.stats()
+    cache_stats = engine_stats['embedding_cache']
+    st.sidebar.caption(
+        f"Query embedding cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['entries']} entries)")
+    response_stats = engine_stats['response_cache']
+    st.sidebar.caption(
+        f"Response cache: {response_stats['hits']} hits / {response_stats['misses']} misses "
+        f"({response_stats['entries']} entries)")
+    router_stats = engine_stats.get('condition_router')
+    if router_stats and router_stats['hits'] + router_stats['misses']:
+        st.sidebar.caption(
+            f"Condition router: {router_stats['hits']} of {router_stats['hits'] + router_stats['misses']} "
+            f"queries answered without an embedding call ({router_stats['hit_rate']:.0%})")
+    precomputed_stats = engine_stats.get('precomputed_answers')
+    if precomputed_stats:
+        st.sidebar.caption(
+            f"Precomputed answers: {precomputed_stats['hits']} served "
+            f"({precomputed_stats['entries']} conditions and aliases)")
+if DEBUG_PANEL and engine is not None:
+    with st.sidebar.expander("Debug: last request"):
+        last_trace = st.session_state.last_trace
+        if last_trace is None:
+            st.caption("No request yet.")
+        else:
+            st.caption(f"{last_trace['request']}: {last_trace['duration_ms']:.0f} ms total")
+            st.table({'stage': list(last_trace['stages_ms']),
+                      'ms': [round(ms, 1) for ms in last_trace['stages_ms'].values()]})
+            st.json({key: last_trace[key] for key in ('tokens', 'cache', 'retries', 'errors')})
+        st.caption("Prompt prefixes: " + ", ".join(
+            f"{name} {prefix['prefix_tokens']} tokens ({prefix['mode'].replace('_', ' ')})"
+            for name, prefix in engine.prompt_prefix_stats().items()))
+        st.download_button("Download metrics (Prometheus)", engine.metrics_text(),
+                           file_name="diet_rag_metrics.prom", mime="text/plain")
 st.sidebar.header("Knowledge Base Conditions")
-# Display conditions from the loaded data
-for item in DIET_DOCUMENTS:
-    st.sidebar.markdown(f"- {item['condition']}")
+# Display conditions from the loaded data; large knowledge bases get a filter
+conditions = sorted(set(engine.conditions.values()), key=str.lower) if engine is not None else []
+if engine is None:
+    st.sidebar.caption("Loading conditions...")
+if len(conditions) > MAX_LISTED_CONDITIONS:
+    condition_filter = st.sidebar.text_input("Filter conditions", "").strip().lower()
+    if condition_filter:
+        conditions = [condition for condition in conditions if condition_filter in condition.lower()]
+
+if st.session_state.conversation_stage == 'initial' and conditions:
+    # Conditions with a precomputed answer (python -m diet_rag.answers build) are answered instantly
+    st.sidebar.caption("Click a condition to get its recommendations.")
+    for condition in conditions[:MAX_LISTED_CONDITIONS]:
+        st.sidebar.button(condition, key=f"condition_{condition}", on_click=select_condition,
+                          args=(condition,), use_container_width=True)
+else:
+    for condition in conditions[:MAX_LISTED_CONDITIONS]:
+        st.sidebar.markdown(f"- {condition}")
+if len(conditions) > MAX_LISTED_CONDITIONS:
+    st.sidebar.caption(f"...and {len(conditions) - MAX_LISTED_CONDITIONS} more")
@@ -0,0 +1,19 @@
+# diet_rag/__init__.py
+
+# Headless diet recommendation RAG core, importable without Streamlit.
+
+from diet_rag.config import EngineConfig
+from diet_rag.engine import (Answer, DietRAGEngine, DietRAGError, EmbeddingError,
+                             GenerationError, RetrievalError)
+from diet_rag.session import ConversationState
+
+__all__ = [
+    "Answer",
+    "ConversationState",
+    "DietRAGEngine",
+    "DietRAGError",
+    "EmbeddingError",
+    "EngineConfig",
+    "GenerationError",
+    "RetrievalError",
+]
@@ -0,0 +1,172 @@
+# diet_rag/aio.py
+
+# Async service layer: runs embedding, retrieval and generation as coroutines
+# on one background event loop so independent work can overlap with the
+# Streamlit script thread (pre-warming embeddings, speculative retrieval).
+# Futures handed back to the script can be cancelled when the user reruns it.
+
+import asyncio
+import threading
+
+from diet_rag.ingest import EMBEDDING_MODEL_NAME
+
+
+class BackgroundLoop:
+    """An asyncio event loop running forever in a daemon thread."""
+
+    def __init__(self, name="diet-async-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """Schedules a coroutine; returns a concurrent.futures.Future (cancel() cancels the task)."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Runs a coroutine on the loop and blocks the calling thread for its result."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# --- Gemini adapters ---
+
+def gemini_async_embedder(model_name=EMBEDDING_MODEL_NAME, api=None):
+    """Returns `async embed(texts, task_type) -> list of embeddings` using embed_content_async.
+
+    `api` defaults to google.generativeai; pass a diet_rag.stubs.StubGemini to run offline.
+    """
+    if api is None:
+        import google.generativeai as api
+
+    async def embed(texts, task_type):
+        result = await api.embed_content_async(model=model_name, content=list(texts),
+                                               task_type=task_type)
+        return result['embedding']
+
+    return embed
+
+
+def gemini_async_generator(model):
+    """Returns `async generate(prompt) -> (text, block_reason)` using generate_content_async."""
+
+    async def generate(prompt):
+        response = await model.generate_content_async(prompt)
+        block_reason = response.prompt_feedback.block_reason
+        return (None if block_reason else response.text), block_reason
+
+    return generate
+
+
+class AsyncRAGService:
+    """Coroutine versions of the app's embed -> retrieve -> generate steps.
+
+    `embed_async(texts, task_type)` and `generate_async(prompt)` are async
+    callables (see the adapters above); `query_fn(embedding, n_results, query)`
+    is a synchronous search (e.g. DietRAGEngine.search, which also gets the
+    query text for lexical fusion), run in a worker thread. `fast_path_fn(query,
+    n_results)`, if given, may return a retrieval result without an embedding
+    (DietRAGEngine.fast_path) or None. `embedding_cache` is the shared
+    diet_rag.cache.EmbeddingCache, if any. `n_results` is the default number
+    of documents retrieved (the engine passes its config.n_results).
+    """
+
+    def __init__(self, embed_async, query_fn, generate_async=None, embedding_cache=None,
+                 fast_path_fn=None, n_results=2):
+        self.n_results = n_results
+        self.embed_async = embed_async
+        self.query_fn = query_fn
+        self.generate_async = generate_async
+        self.embedding_cache = embedding_cache
+        self.fast_path_fn = fast_path_fn
+
+    async def embed_many(self, texts, task_type="retrieval_query"):
+        """Embeds texts in one batch call, serving cached ones from the embedding cache."""
+        texts = list(texts)
+        results = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            if self.embedding_cache is not None:
+                results[i] = self.embedding_cache.get(text, task_type)
+            if results[i] is None:
+                missing.append(i)
+        if missing:
+            embeddings = await self.embed_async([texts[i] for i in missing], task_type)
+            for i, embedding in zip(missing, embeddings):
+                results[i] = embedding
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put(texts[i], task_type, embedding)
+        return results
+
+    async def embed(self, text, task_type="retrieval_query"):
+        return (await self.embed_many([text], task_type))[0]
+
+    async def retrieve(self, query, n_results=None):
+        """Returns {'embedding', 'ids', 'documents'} like DietRAGEngine.retrieve."""
+        return (await self.retrieve_many([query], n_results))[0]
+
+    async def retrieve_many(self, queries, n_results=None):
+        """Retrieves for several queries with one batched embedding call and concurrent queries.
+
+        Queries answered by `fast_path_fn` are not embedded.
+        """
+        n_results = n_results or self.n_results
+        queries = list(queries)
+        retrieved = [None] * len(queries)
+        if self.fast_path_fn is not None:
+            retrieved = await asyncio.to_thread(
+                lambda: [self.fast_path_fn(query, n_results) for query in queries])
+        pending = [i for i, result in enumerate(retrieved) if result is None]
+        if pending:
+            embeddings = await self.embed_many([queries[i] for i in pending])
+            results = await asyncio.gather(*[
+                asyncio.to_thread(self.query_fn, embedding, n_results, queries[i])
+                for i, embedding in zip(pending, embeddings)])
+            for i, embedding, r in zip(pending, embeddings, results):
+                retrieved[i] = {'embedding': embedding, 'ids': r['ids'], 'documents': r['documents']}
+        return retrieved
+
+    async def prewarm(self, texts, task_type="retrieval_query"):
+        """Fills the embedding cache for texts users are likely to send (e.g. sidebar conditions)."""
+        await self.embed_many(texts, task_type)
+        return len(texts)
+
+    async def recommend(self, query, build_prompt, n_results=None):
+        """Full pipeline: retrieve, then generate with `build_prompt(query, documents)`.
+
+        Returns (retrieved, text, block_reason).
+        """
+        retrieved = await self.retrieve(query, n_results)
+        text, block_reason = await self.generate_async(build_prompt(query, retrieved['documents']))
+        return retrieved, text, block_reason
+
+
+class TaskGroup:
+    """Tracks futures started during one script run so the next rerun can cancel leftovers."""
+
+    def __init__(self):
+        self._futures = {}
+
+    def add(self, key, future):
+        previous = self._futures.get(key)
+        if previous is not None and previous is not future:
+            previous.cancel()
+        self._futures[key] = future
+        return future
+
+    def get(self, key):
+        return self._futures.get(key)
+
+    def pop(self, key):
+        return self._futures.pop(key, None)
+
+    def cancel_all(self):
+        """Cancels every unfinished future; returns how many were cancelled."""
+        cancelled = 0
+        for future in self._futures.values():
+            if not future.done() and future.cancel():
+                cancelled += 1
+        self._futures.clear()
+        return cancelled
@@ -0,0 +1,255 @@
+# diet_rag/answers.py
+
+# Precomputed first-turn answers, built offline for every condition in the
+# knowledge base. The first answer for a question that just names a condition
+# ("GERD / Acid Reflux Management", "heartburn") is nearly deterministic, so it
+# is generated once and served from a JSON file instead of a model call. Each
+# entry is keyed by a hash of its condition's documents and by the answer
+# version (generative model + prompt template), so an entry whose documents
+# changed is ignored at serve time and regenerated by the next build; unchanged
+# entries are reused as they are.
+#
+# Usage: python -m diet_rag.answers build --output diet_answers.json [--structured]
+#        python -m diet_rag.answers info diet_answers.json
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from diet_rag.lexical import TOKEN_PATTERN, tokenize
+from diet_rag.router import LABEL_FILLER, NEGATIONS, SYNONYMS, label_aliases
+from diet_rag.store import content_hash
+
+ANSWERS_FORMAT = 1
+
+
+class AnswerStoreError(Exception):
+    """The answer file is malformed or of an unsupported format."""
+
+
+def answer_version(model_name, template):
+    """Identifies the model and prompt (diet_rag.prompts.PromptTemplate) answers come from."""
+    hasher = hashlib.sha256()
+    source = template.render(**{field: "{" + field + "}" for field in template.fields})
+    for part in (model_name, template.name, template.system_instruction, source):
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\x00')
+    return hasher.hexdigest()[:16]
+
+
+def answer_key(text):
+    """Lookup form of a question: its index terms minus label filler ("I have GERD" -> "gerd").
+
+    Empty for negated questions ("no back pain"), which have no stored answer.
+    """
+    text = text or ""
+    if NEGATIONS.intersection(TOKEN_PATTERN.findall(text.lower())):
+        return ""
+    return " ".join(term for term in tokenize(text) if term not in LABEL_FILLER)
+
+
+def condition_aliases(label):
+    """Lookup keys of alternative names for `label`: its parts and their synonyms."""
+    parts = [" ".join(alias) for alias in label_aliases(label)]
+    aliases = parts + [phrasing for target, phrasings in SYNONYMS.items()
+                       if answer_key(target) in parts for phrasing in phrasings]
+    return [key for key in dict.fromkeys(map(answer_key, aliases)) if key]
+
+
+class ConditionHasher:
+    """Incremental per-condition hash of documents streamed in load order."""
+
+    def __init__(self, version, labels=None):
+        self.version = version
+        self.labels = labels  # Only these conditions are hashed (all if None)
+        self._hashers = {}
+
+    def update(self, documents):
+        for doc_data in documents:
+            label = doc_data['condition']
+            if self.labels is not None and label not in self.labels:
+                continue
+            hasher = self._hashers.get(label)
+            if hasher is None:
+                hasher = self._hashers[label] = hashlib.sha256()
+            hasher.update(content_hash(doc_data, self.version).encode('ascii'))
+
+    def hexdigests(self):
+        return {label: hasher.hexdigest() for label, hasher in self._hashers.items()}
+
+
+@dataclasses.dataclass
+class AnswerStore:
+    """Stored answers by condition label: {"hash", "answer", "aliases"} entries."""
+
+    version: str
+    entries: dict = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get('format') != ANSWERS_FORMAT:
+                raise AnswerStoreError(f"Unsupported answers format {data.get('format')!r} in {path}")
+            return cls(data['version'], data['entries'])
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            raise AnswerStoreError(f"Cannot load precomputed answers {path!r}: {e}") from e
+
+    def save(self, path):
+        """Writes the store atomically (a reader never sees a partial file)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'format': ANSWERS_FORMAT, 'version': self.version,
+                       'entries': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def current(self, hashes):
+        """Labels whose entry matches `hashes` (label -> ConditionHasher digest)."""
+        return [label for label, entry in self.entries.items() if hashes.get(label) == entry['hash']]
+
+    def index(self, hashes):
+        """answer_key of a label or alias -> answer, for the entries still matching `hashes`.
+
+        An alias claimed by several conditions is left out.
+        """
+        index, claimed = {}, {}
+        for label in self.current(hashes):
+            entry = self.entries[label]
+            index[answer_key(label)] = entry['answer']
+            for alias in entry['aliases']:
+                claimed.setdefault(alias, []).append(entry['answer'])
+        for alias, answers in claimed.items():
+            if len(answers) == 1:
+                index.setdefault(alias, answers[0])
+        return index
+
+
+def build_answers(engine, documents, path, concurrency=4, progress_callback=None):
+    """Generates the first answer of every condition in `documents` into the store at `path`.
+
+    Entries whose documents and answer version are unchanged are reused;
+    conditions no longer in `documents` are dropped. The context of a
+    condition is its first `n_results` documents, as the condition router
+    would retrieve them. Returns counts: generated, reused, removed, failed.
+    """
+    version = engine.answer_version
+    store = AnswerStore(version)
+    if os.path.exists(path):
+        try:
+            previous = AnswerStore.load(path)
+        except AnswerStoreError:
+            previous = None
+        if previous is not None and previous.version == version:
+            store.entries = previous.entries
+    hasher = ConditionHasher(version)
+    texts = {}
+    for doc_data in documents:
+        hasher.update([doc_data])
+        texts.setdefault(doc_data['condition'], []).append(doc_data['text'])
+    hashes = hasher.hexdigests()
+    stats = {'reused': len(set(store.current(hashes))), 'generated': 0, 'failed': 0,
+             'removed': len([label for label in store.entries if label not in hashes])}
+    store.entries = {label: entry for label, entry in store.entries.items() if label in hashes}
+    todo = [label for label in texts if store.entries.get(label, {}).get('hash') != hashes[label]]
+
+    def generate(label):
+        retrieved = {'embedding': None, 'ids': [],
+                     'documents': texts[label][:engine.config.n_results]}
+        answer = engine.generate(label, retrieved)
+        if answer.blocked:
+            raise ValueError(f"blocked ({answer.block_reason})")
+        return answer.structured.to_json() if answer.structured is not None else answer.resolve()
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(generate, label): label for label in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            label = futures[future]
+            try:
+                store.entries[label] = {'hash': hashes[label], 'answer': future.result(),
+                                        'aliases': condition_aliases(label)}
+                stats['generated'] += 1
+            except Exception as e:
+                store.entries.pop(label, None)
+                print(f"Failed {label!r}: {e}", file=sys.stderr)
+                stats['failed'] += 1
+            if progress_callback:
+                progress_callback(done, len(todo))
+    store.save(path)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the precomputed first answers")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="generate answers for new or changed conditions")
+    build.add_argument("--output", help="defaults to diet_answers.json, required with --stub")
+    build.add_argument("--source", help="JSON/JSONL knowledge base file or directory "
+                                        "(diet_data_format.txt layout); defaults to DIET_DOCUMENTS")
+    build.add_argument("--structured", action="store_true",
+                       help="store structured answers (for STRUCTURED_OUTPUT deployments)")
+    build.add_argument("--concurrency", type=int, default=4)
+    build.add_argument("--stub", action="store_true",
+                       help="use the offline Gemini stub (answers are versioned as the stub's)")
+    info = commands.add_parser("info", help="check the stored answers against the corpus")
+    info.add_argument("path", nargs="?", default="diet_answers.json")
+    info.add_argument("--source")
+    info.add_argument("--structured", action="store_true")
+    args = parser.parse_args(argv)
+    if args.command == "build" and args.output is None:
+        if args.stub:
+            parser.error("--stub needs an explicit --output: the app loads diet_answers.json")
+        args.output = "diet_answers.json"
+
+    from diet_rag import prompts
+    from diet_rag.config import EngineConfig
+    from diet_rag.kb import KnowledgeBase
+    if args.source:
+        knowledge = KnowledgeBase(source=args.source)
+    else:
+        from diet_data import DIET_DOCUMENTS
+        knowledge = KnowledgeBase(documents=DIET_DOCUMENTS)
+    documents = list(knowledge)
+    config = dataclasses.replace(EngineConfig.from_mapping(env=os.environ), async_prefetch=False,
+                                 structured_output=args.structured, precomputed_answers="")
+
+    if args.command == "info":
+        template = prompts.STRUCTURED_INITIAL_PROMPT if args.structured else prompts.INITIAL_PROMPT
+        store = AnswerStore.load(args.path)
+        hasher = ConditionHasher(store.version)
+        hasher.update(documents)
+        hashes = hasher.hexdigests()
+        current = store.current(hashes)
+        matches = store.version == answer_version(config.generative_model_name, template)
+        print(f"{args.path}: {len(store.entries)} conditions, version {store.version} "
+              f"({'matches' if matches else 'differs from'} the configured model and prompt)")
+        print(f"{len(current)} current, {len(store.entries) - len(current)} stale, "
+              f"{len([label for label in hashes if label not in store.entries])} conditions missing")
+        return
+
+    from diet_rag.engine import DietRAGEngine
+    if args.stub:
+        from diet_rag.stubs import STUB_MODEL_NAME, StubGemini
+        api = StubGemini(embed_latency=0.0, generate_latency=0.0)
+        # Canned answers must never match the configured model's answer version
+        config = dataclasses.replace(config, generative_model_name=STUB_MODEL_NAME)
+    else:
+        import google.generativeai as api
+        api.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    engine = DietRAGEngine(config, documents=documents, api=api)
+
+    def report(done, total):
+        print(f"\rGenerated {done}/{total}", end="", flush=True)
+
+    stats = build_answers(engine, documents, args.output, concurrency=args.concurrency,
+                          progress_callback=report)
+    print(f"\nWrote {args.output}: {stats['generated']} generated, {stats['reused']} unchanged, "
+          f"{stats['removed']} removed, {stats['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
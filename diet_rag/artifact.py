@@ -0,0 +1,200 @@
+# diet_rag/artifact.py
+
+# Precomputed embedding artifact, built once at build time and shipped with
+# the knowledge base so a fresh deployment can fill its vector store without
+# any embedding calls. Two files per artifact:
+#   <path>.npy   (n_docs, dim) matrix of L2-normalized rows, float32 or float16
+#   <path>.json  model name, corpus hash, dtype and the id/text/metadata table
+# Every row carries its document's content hash (diet_rag.store.content_hash),
+# so documents that changed since the build are re-embedded live and the rest
+# are still served from the artifact.
+#
+# Usage: python -m diet_rag.artifact build --output diet_embeddings [--dtype float16]
+#        python -m diet_rag.artifact info diet_embeddings
+#        (chunks or whole documents as CHUNKED_RETRIEVAL says, unless --[no-]chunked)
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from diet_rag.config import EngineConfig
+from diet_rag.ingest import EMBEDDING_MODEL_NAME, FAKE_EMBEDDING_MODEL_NAME, embed_documents
+from diet_rag.kb import KnowledgeBase
+from diet_rag.store import content_hash, corpus_hash
+
+ARTIFACT_FORMAT = 1
+DTYPES = ("float32", "float16")
+
+
+class ArtifactError(Exception):
+    """The artifact is missing, malformed or of an unsupported format."""
+
+
+class EmbeddingArtifact:
+    """A loaded artifact. `matrix` is memory-mapped (float32) or converted once (float16)."""
+
+    def __init__(self, header, matrix):
+        self.model_name = header['model_name']
+        self.corpus_hash = header['corpus_hash']
+        self.dtype = header['dtype']
+        self.ids = header['ids']
+        self.documents = header['documents']
+        self.metadatas = header['metadatas']
+        self.matrix = matrix
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def matches(self, documents, model_name=EMBEDDING_MODEL_NAME):
+        """True if the artifact was built from exactly `documents` with `model_name`."""
+        return self.model_name == model_name and self.corpus_hash == corpus_hash(documents, model_name)
+
+    def rows_for(self, documents, model_name=EMBEDDING_MODEL_NAME):
+        """Splits `documents` into (artifact rows for unchanged ones, documents to embed live)."""
+        rows, missing = [], []
+        for doc_data in documents:
+            row = self._rows.get(doc_data['id'])
+            if (row is not None and self.model_name == model_name
+                    and self.metadatas[row].get('content_hash') == content_hash(doc_data, model_name)):
+                rows.append(row)
+            else:
+                missing.append(doc_data)
+        return rows, missing
+
+
+def build_artifact(documents, path, embed_fn=None, model_name=EMBEDDING_MODEL_NAME,
+                   dtype="float32", progress_callback=None, **embed_kwargs):
+    """Embeds `documents` and writes the artifact to `<path>.npy` / `<path>.json`.
+
+    Returns the header written (without the id/text/metadata table).
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype!r} (expected one of {DTYPES})")
+    documents = list(documents)
+    doc_ids, doc_texts, doc_metadatas, doc_embeddings = embed_documents(
+        documents, embed_fn=embed_fn, progress_callback=progress_callback, **embed_kwargs)
+    if len(doc_ids) != len(documents):
+        raise ArtifactError(f"Only {len(doc_ids)} of {len(documents)} documents were embedded")
+
+    matrix = np.asarray(doc_embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = (matrix / norms).astype(dtype)
+    hashes = {doc_data['id']: content_hash(doc_data, model_name) for doc_data in documents}
+    for doc_id, metadata in zip(doc_ids, doc_metadatas):
+        metadata['content_hash'] = hashes[doc_id]
+        metadata['embedding_model'] = model_name
+
+    header = {
+        'format': ARTIFACT_FORMAT,
+        'model_name': model_name,
+        'corpus_hash': corpus_hash(documents, model_name),
+        'dtype': dtype,
+        'count': len(doc_ids),
+        'dimension': int(matrix.shape[1]) if len(doc_ids) else 0,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.save(path + ".npy", matrix)
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump({**header, 'ids': doc_ids, 'documents': doc_texts,
+                   'metadatas': doc_metadatas}, f)
+    return header
+
+
+def exists(path):
+    return bool(path) and os.path.exists(path + ".npy") and os.path.exists(path + ".json")
+
+
+def load_artifact(path):
+    """Loads an artifact; float32 matrices are memory-mapped copy-on-write."""
+    try:
+        with open(path + ".json", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get('format') != ARTIFACT_FORMAT:
+            raise ArtifactError(f"Unsupported artifact format {header.get('format')!r} in {path}")
+        matrix = np.load(path + ".npy", mmap_mode='c')
+    except (OSError, ValueError, KeyError) as e:
+        raise ArtifactError(f"Cannot load embedding artifact {path!r}: {e}") from e
+    if matrix.dtype != np.float32:
+        matrix = matrix.astype(np.float32)  # float16 halves the file; search runs in float32
+    if matrix.shape[0] != len(header['ids']):
+        raise ArtifactError(f"Artifact {path!r} has {matrix.shape[0]} rows for {len(header['ids'])} ids")
+    return EmbeddingArtifact(header, matrix)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the precomputed embedding artifact")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="embed the knowledge base and write the artifact")
+    build.add_argument("--output", help="artifact path (without extension); defaults to "
+                                        "diet_embeddings, required with --stub")
+    build.add_argument("--source", help="JSON/JSONL knowledge base file or directory "
+                                        "(diet_data_format.txt layout); defaults to DIET_DOCUMENTS")
+    build.add_argument("--dtype", default="float32", choices=DTYPES)
+    build.add_argument("--chunked", action=argparse.BooleanOptionalAction,
+                       help="embed section chunks; defaults to the CHUNKED_RETRIEVAL setting")
+    build.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    build.add_argument("--stub", action="store_true",
+                       help=f"use the offline FakeEmbedder (tagged {FAKE_EMBEDDING_MODEL_NAME!r})")
+    info = commands.add_parser("info", help="describe an artifact and check it against the corpus")
+    info.add_argument("path", nargs="?", default="diet_embeddings")
+    info.add_argument("--source")
+    info.add_argument("--chunked", action=argparse.BooleanOptionalAction,
+                      help="compare against section chunks; defaults to CHUNKED_RETRIEVAL")
+    args = parser.parse_args(argv)
+    if args.chunked is None:  # Same setting the engine reads, so both sides use the same units
+        args.chunked = EngineConfig.from_mapping(env=os.environ).chunked_retrieval
+    if args.command == "build" and args.output is None:
+        if args.stub:
+            parser.error("--stub needs an explicit --output: the app loads diet_embeddings")
+        args.output = "diet_embeddings"
+
+    if args.source:
+        knowledge = KnowledgeBase(source=args.source)
+    else:
+        from diet_data import DIET_DOCUMENTS
+        knowledge = KnowledgeBase(documents=DIET_DOCUMENTS)
+    documents = list(knowledge)
+    if knowledge.report.dropped:
+        print(f"Ignored {knowledge.report.dropped} invalid or duplicate knowledge base entries")
+    if args.chunked:
+        from diet_rag.chunking import chunk_documents
+        documents = chunk_documents(documents)
+
+    if args.command == "info":
+        artifact = load_artifact(args.path)
+        model_name = artifact.model_name
+        rows, missing = artifact.rows_for(documents, model_name)
+        print(f"{args.path}: {len(artifact)} x {artifact.matrix.shape[1]} {artifact.dtype}, "
+              f"model {model_name}")
+        print(f"corpus {'matches' if artifact.matches(documents, model_name) else 'differs'}: "
+              f"{len(rows)} documents served from the artifact, {len(missing)} need live embedding")
+        return
+
+    model_name = args.model
+    if args.stub:
+        from diet_rag.ingest import FakeEmbedder
+        embed_fn = FakeEmbedder()
+        model_name = FAKE_EMBEDDING_MODEL_NAME
+    else:
+        import google.generativeai as genai
+        from diet_rag.ingest import gemini_batch_embedder
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        embed_fn = gemini_batch_embedder(args.model, api=genai)
+
+    def report(done, total):
+        print(f"\rEmbedded {done}/{total}", end="", flush=True)
+
+    header = build_artifact(documents, args.output, embed_fn=embed_fn, model_name=model_name,
+                            dtype=args.dtype, progress_callback=report)
+    print(f"\nWrote {args.output}.npy/.json: {header['count']} x {header['dimension']} "
+          f"{header['dtype']}, corpus {header['corpus_hash'][:12]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# diet_rag/batch.py
+
+# Batch mode: first-turn recommendations for a whole list of conditions (e.g.
+# a clinic's patient list) without the UI. Conditions are read from CSV or
+# JSONL and deduplicated, then processed in chunks: each chunk is retrieved at
+# once (DietRAGEngine.retrieve_batch: batch embedding requests and a single
+# vectorized top-k), and its answers are generated concurrently, at most
+# `concurrency` at a time. Results are appended to a JSONL file as they
+# complete, one line per unique condition; the file doubles as the checkpoint,
+# so a rerun skips the conditions already in it.
+#
+# Usage: python -m diet_rag.batch conditions.csv --output handouts.jsonl [--concurrency 8] [--stub]
+#        (GOOGLE_API_KEY from the environment; settings as in diet_rag/config.py)
+
+import argparse
+import csv
+import dataclasses
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from diet_rag.cache import normalize_query
+from diet_rag.config import EngineConfig
+from diet_rag.engine import DietRAGEngine, DietRAGError
+
+# Input columns / JSON keys holding the condition, in order of preference
+INPUT_FIELDS = ("condition", "problem", "query", "text")
+JSONL_EXTENSIONS = (".jsonl", ".json", ".ndjson")
+DEFAULT_CHUNK_SIZE = 256
+DEFAULT_CONCURRENCY = 8
+
+
+class BatchInputError(ValueError):
+    """The input file is missing or malformed."""
+
+
+def _read_csv(f, path):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [name.strip().lower() for name in header]
+    field = next((name for name in INPUT_FIELDS if name in columns), None)
+    if field is None:
+        # No header naming a known column: the first column holds the conditions
+        column, rows = 0, itertools.chain([header], reader)
+    else:
+        column, rows = columns.index(field), reader
+    for row in rows:
+        if len(row) > column:
+            yield row[column]
+
+
+def _read_jsonl(f, path):
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise BatchInputError(f"{path}:{line_number}: invalid JSON ({e.msg})") from e
+        if isinstance(record, str):
+            yield record
+            continue
+        field = next((name for name in INPUT_FIELDS
+                      if isinstance(record, dict) and name in record), None)
+        if field is None:
+            raise BatchInputError(f"{path}:{line_number}: expected a string or an object "
+                                  f"with one of {', '.join(INPUT_FIELDS)}")
+        yield record[field]
+
+
+def read_conditions(path):
+    """Yields the condition texts in a CSV or JSONL file (chosen by extension).
+
+    CSV input uses the first column named in INPUT_FIELDS, or the first
+    column if the header names none; JSONL lines are strings or objects.
+    """
+    if not os.path.exists(path):
+        raise BatchInputError(f"Input not found: {path!r}")
+    reader = _read_jsonl if path.lower().endswith(JSONL_EXTENSIONS) else _read_csv
+    with open(path, encoding="utf-8", newline="") as f:
+        for condition in reader(f, path):
+            if condition is not None and str(condition).strip():
+                yield str(condition).strip()
+
+
+def dedupe(conditions):
+    """[(key, condition, occurrences)] per unique condition, in first-seen order.
+
+    Conditions differing only in case or whitespace share a key
+    (cache.normalize_query) and are answered once.
+    """
+    unique = {}
+    for condition in conditions:
+        key = normalize_query(condition)
+        if key in unique:
+            unique[key][2] += 1
+        else:
+            unique[key] = [key, condition, 1]
+    return [tuple(entry) for entry in unique.values()]
+
+
+def load_checkpoint(output_path):
+    """Keys already written to `output_path`; a torn last line from a crash is cut off."""
+    if not os.path.exists(output_path):
+        return set()
+    done, valid_bytes = set(), 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)['key'])
+            except (ValueError, KeyError, TypeError):
+                break
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+def _answer(engine, condition, retrieved):
+    answer = engine.generate(condition, retrieved)
+    record = {'ids': retrieved.get('ids', []), 'answer': answer.text,
+              'blocked': answer.blocked, 'from_cache': answer.from_cache}
+    if answer.structured is not None:
+        record['recommendation'] = answer.structured.to_dict()
+    return record
+
+
+def run_batch(engine, conditions, output_path, concurrency=DEFAULT_CONCURRENCY,
+              chunk_size=DEFAULT_CHUNK_SIZE, resume=True, progress_callback=None):
+    """Writes a recommendation for every unique condition to `output_path` (JSONL).
+
+    With `resume`, conditions already in the file are skipped; otherwise it
+    is overwritten. Each line is {"key", "condition", "occurrences", "ids",
+    "answer", "blocked", "from_cache"} (plus the parsed "recommendation" in
+    structured output mode), written in completion order. Failed
+    conditions are reported on stderr and not written, so a rerun retries
+    them. `progress_callback(done, total)` is called after each chunk.
+    Returns counts: total, unique, skipped, written, failed and seconds.
+    """
+    start = time.perf_counter()
+    conditions = list(conditions)
+    unique = dedupe(conditions)
+    done = load_checkpoint(output_path) if resume else set()
+    pending = [entry for entry in unique if entry[0] not in done]
+    stats = {'total': len(conditions), 'unique': len(unique),
+             'skipped': len(unique) - len(pending), 'written': 0, 'failed': 0}
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for chunk_start in range(0, len(pending), chunk_size):
+            chunk = pending[chunk_start:chunk_start + chunk_size]
+            try:
+                retrieved = engine.retrieve_batch([condition for _, condition, _ in chunk])
+            except DietRAGError as e:
+                print(f"Retrieval failed for {len(chunk)} conditions: {e}", file=sys.stderr)
+                stats['failed'] += len(chunk)
+                continue
+            futures = {executor.submit(_answer, engine, condition, result): (key, condition, count)
+                       for (key, condition, count), result in zip(chunk, retrieved)}
+            for future in as_completed(futures):
+                key, condition, count = futures[future]
+                try:
+                    record = future.result()
+                except DietRAGError as e:
+                    print(f"Failed {condition!r}: {e}", file=sys.stderr)
+                    stats['failed'] += 1
+                    continue
+                record = dict(key=key, condition=condition, occurrences=count, **record)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                stats['written'] += 1
+            os.fsync(out.fileno())
+            if progress_callback:
+                progress_callback(stats['skipped'] + chunk_start + len(chunk), len(unique))
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate recommendations for a list of conditions")
+    parser.add_argument("input", help="CSV or JSONL file of conditions")
+    parser.add_argument("--output", required=True, help="JSONL file to write (and resume from)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="answers generated at once")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="conditions retrieved per batch")
+    parser.add_argument("--restart", action="store_true",
+                        help="overwrite the output instead of resuming from it")
+    parser.add_argument("--stub", action="store_true",
+                        help="use the offline Gemini stub instead of the real API")
+    args = parser.parse_args(argv)
+
+    if args.stub:
+        from diet_rag.stubs import StubGemini
+        api = StubGemini()
+    else:
+        import google.generativeai as api
+        api.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    try:
+        conditions = list(read_conditions(args.input))
+    except BatchInputError as e:
+        parser.error(str(e))
+    config = dataclasses.replace(EngineConfig.from_mapping(env=os.environ), async_prefetch=False)
+    engine = DietRAGEngine(config, api=api)
+    engine.warm_up()
+
+    def report(done, total):
+        print(f"\rAnswered {done}/{total}", end="", flush=True)
+
+    stats = run_batch(engine, conditions, args.output, concurrency=args.concurrency,
+                      chunk_size=args.chunk_size, resume=not args.restart,
+                      progress_callback=report)
+    engine.close()
+    print(f"\n{stats['total']} conditions, {stats['unique']} unique: {stats['written']} written, "
+          f"{stats['skipped']} already done, {stats['failed']} failed in {stats['seconds']:.1f}s "
+          f"-> {args.output}")
+    if stats['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
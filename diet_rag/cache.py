@@ -0,0 +1,208 @@
+# diet_rag/cache.py
+
+# Process-wide caches shared by all Streamlit sessions.
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Lowercases and collapses whitespace so trivially different queries share a key."""
+    return " ".join(str(text).lower().split())
+
+
+class EmbeddingCache:
+    """Thread-safe query-embedding cache bounded by entry count, memory and TTL.
+
+    Keys are (normalized text, task_type). Embeddings are stored as float32
+    arrays to keep the memory bound honest. `eviction` is either "lru"
+    (reads refresh an entry) or "fifo" (entries leave in insertion order).
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024,
+                 ttl_seconds=24 * 3600, eviction="lru", clock=time.monotonic):
+        if eviction not in ("lru", "fifo"):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.eviction = eviction
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, array('f'))
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(text, task_type):
+        return (normalize_query(text), task_type)
+
+    @staticmethod
+    def _entry_bytes(key, vector):
+        return vector.itemsize * len(vector) + len(key[0]) + len(key[1] or "")
+
+    def _remove(self, key):
+        _, vector = self._entries.pop(key)
+        self._bytes -= self._entry_bytes(key, vector)
+
+    def get(self, text, task_type):
+        """Returns the cached embedding as a list, or None on a miss."""
+        key = self.make_key(text, task_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, vector = entry
+            if expires_at is not None and self._clock() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if self.eviction == "lru":
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return vector.tolist()
+
+    def put(self, text, task_type, embedding):
+        """Stores an embedding, evicting old entries to respect the bounds."""
+        key = self.make_key(text, task_type)
+        vector = array('f', embedding)
+        size = self._entry_bytes(key, vector)
+        if size > self.max_bytes:
+            return
+        expires_at = self._clock() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, vector)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+class SemanticResponseCache:
+    """Caches generated answers and serves them to semantically similar queries.
+
+    A cached answer is reused when the new query's embedding has cosine
+    similarity >= `threshold` with a cached query AND retrieval returned the
+    same document ids. Queries retrieved without an embedding (the lexical
+    fast path) match cached queries by their normalized text instead.
+    Entries are tagged with a knowledge base version; calling
+    `ensure_version` with a different version drops everything.
+    """
+
+    def __init__(self, threshold=0.92, max_entries=512):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.version = None
+        self._order = OrderedDict()  # (doc_ids, query key) -> None, LRU order
+        self._buckets = {}  # doc_ids -> {query key: (unit vector, answer)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _doc_key(doc_ids):
+        return tuple(sorted(doc_ids))
+
+    def ensure_version(self, version):
+        """Invalidates the cache if the knowledge base version changed."""
+        with self._lock:
+            if version != self.version:
+                if self._order:
+                    self.invalidations += 1
+                self._order.clear()
+                self._buckets.clear()
+                self.version = version
+
+    def lookup(self, embedding, doc_ids, query=None):
+        """Returns a cached answer for a similar query with the same documents, or None.
+
+        `embedding` may be None if `query` is given (exact-text match only).
+        """
+        doc_key = self._doc_key(doc_ids)
+        with self._lock:
+            bucket = self._buckets.get(doc_key, {})
+            best_key = normalize_query(query) if query is not None else None
+            if best_key not in bucket:
+                best_key = self._most_similar(bucket, embedding)
+            if best_key is not None:
+                self._order.move_to_end((doc_key, best_key))
+                self.hits += 1
+                return bucket[best_key][1]
+            self.misses += 1
+            return None
+
+    def _most_similar(self, bucket, embedding):
+        """Key of the bucket entry closest to `embedding` if within the threshold, else None."""
+        keys = [key for key, (vector, _) in bucket.items() if vector is not None]
+        if embedding is None or not keys:
+            return None
+        scores = np.stack([bucket[key][0] for key in keys]) @ self._unit(embedding)
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.threshold else None
+
+    def store(self, query, embedding, doc_ids, answer):
+        doc_key = self._doc_key(doc_ids)
+        query_key = normalize_query(query)
+        with self._lock:
+            vector = self._unit(embedding) if embedding is not None else None
+            self._buckets.setdefault(doc_key, {})[query_key] = (vector, answer)
+            self._order[(doc_key, query_key)] = None
+            self._order.move_to_end((doc_key, query_key))
+            while len(self._order) > self.max_entries:
+                old_doc_key, old_query_key = self._order.popitem(last=False)[0]
+                bucket = self._buckets[old_doc_key]
+                del bucket[old_query_key]
+                if not bucket:
+                    del self._buckets[old_doc_key]
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._order),
+            }
@@ -0,0 +1,122 @@
+# diet_rag/chunking.py
+
+# Section-aware chunking of knowledge base documents. Each document in
+# diet_data.py is a markdown blob with **Fruits:**, **Vegetables:**,
+# **Meats/Proteins:**, ... and **Simple Recipe Idea** sections; splitting along
+# those headers lets retrieval return just the sections a query needs.
+
+import re
+
+# Header prefix (lowercase) -> section type stored in chunk metadata
+SECTION_TYPES = (
+    ("fruits", "fruits"),
+    ("vegetables", "vegetables"),
+    ("meats", "proteins"),
+    ("proteins", "proteins"),
+    ("grains", "grains"),
+    ("dairy", "dairy"),
+    ("fats", "fats"),
+    ("other", "other"),
+    ("simple recipe idea", "recipe"),
+    ("recipe", "recipe"),
+)
+OVERVIEW_SECTION = "overview"
+# Section order for a query that just names its condition (see
+# routed_chunk_ids): the tips and recipe the initial prompt asks for come
+# before the food lists, and the title-only overview comes last
+ROUTED_SECTIONS = ("recipe", "other", "fruits", "vegetables", "proteins", "grains", "dairy",
+                   "fats", OVERVIEW_SECTION)
+# Query terms (diet_rag.lexical.tokenize form) asking for one section type
+SECTION_QUERY_TERMS = {"fruit": "fruits", "vegetable": "vegetables", "veggie": "vegetables",
+                       "protein": "proteins", "meat": "proteins", "recipe": "recipe",
+                       "tip": "other", "grain": "grains", "dairy": "dairy", "fat": "fats"}
+
+# A section header is a line starting with a bold label, e.g. "**Fruits:** ..."
+_HEADER_RE = re.compile(r'^\s*\*\*([^*]+?)\*\*', re.MULTILINE)
+
+
+def section_type(header):
+    """Maps a bold header label to its section type (None for unknown headers)."""
+    label = header.strip().lower()
+    for prefix, kind in SECTION_TYPES:
+        if label.startswith(prefix):
+            return kind
+    return None
+
+
+def _dedent(text):
+    return "\n".join(line.strip() for line in text.strip().splitlines())
+
+
+def split_document(doc_data):
+    """Splits one document into section chunks.
+
+    Text before the first known section header (title and focus line) becomes
+    the "overview" chunk; unknown headers stay with the preceding section.
+    Each chunk is a document dict with its own id plus 'parent_id' and 'section'.
+    """
+    text = doc_data['text']
+    boundaries = [(m.start(), section_type(m.group(1))) for m in _HEADER_RE.finditer(text)]
+    boundaries = [(start, kind) for start, kind in boundaries if kind]
+
+    sections = []
+    if not boundaries or boundaries[0][0] > 0:
+        end = boundaries[0][0] if boundaries else len(text)
+        sections.append((OVERVIEW_SECTION, text[:end]))
+    for i, (start, kind) in enumerate(boundaries):
+        end = boundaries[i + 1][0] if i + 1 < len(boundaries) else len(text)
+        sections.append((kind, text[start:end]))
+
+    chunks = []
+    seen = {}
+    for kind, section_text in sections:
+        section_text = _dedent(section_text)
+        if not section_text:
+            continue
+        seen[kind] = seen.get(kind, 0) + 1
+        suffix = kind if seen[kind] == 1 else f"{kind}-{seen[kind]}"
+        chunks.append({
+            "id": f"{doc_data['id']}#{suffix}",
+            "condition": doc_data['condition'],
+            "text": section_text,
+            "parent_id": doc_data['id'],
+            "section": kind,
+        })
+    return chunks
+
+
+def routed_chunk_ids(doc_id, query_terms=()):
+    """Ids a routed document's chunks can have, most useful for the first answer first.
+
+    Sections the query asks for (tokenized `query_terms`, e.g. "recipe") come
+    first, then ROUTED_SECTIONS.
+    """
+    asked = [SECTION_QUERY_TERMS[term] for term in query_terms if term in SECTION_QUERY_TERMS]
+    return [f"{doc_id}#{kind}" for kind in dict.fromkeys(asked + list(ROUTED_SECTIONS))]
+
+
+def chunk_documents(documents):
+    """Splits every document into section chunks."""
+    chunks = []
+    for doc_data in documents:
+        chunks.extend(split_document(doc_data))
+    return chunks
+
+
+def format_chunk(text, metadata):
+    """Prefixes a retrieved chunk with its condition so the prompt stays self-describing."""
+    condition = (metadata or {}).get('condition')
+    return f"Condition: {condition}\n{text}" if condition else text
+
+
+def expand_to_parents(ids, metadatas, documents_by_id):
+    """Replaces retrieved chunks with their parent documents (deduplicated, in rank order).
+
+    Returns (parent ids, parent texts).
+    """
+    parent_ids = []
+    for chunk_id, metadata in zip(ids, metadatas):
+        parent_id = (metadata or {}).get('parent_id', chunk_id)
+        if parent_id not in parent_ids and parent_id in documents_by_id:
+            parent_ids.append(parent_id)
+    return parent_ids, [documents_by_id[parent_id]['text'] for parent_id in parent_ids]
@@ -0,0 +1,153 @@
+# diet_rag/config.py
+
+# Engine settings. Every field can be overridden from a mapping such as
+# st.secrets (or the environment) using its upper-case name, e.g.
+# RETRIEVAL_BACKEND = "numpy" or HISTORY_TOKEN_BUDGET = 600.
+
+import dataclasses
+
+from diet_rag.ingest import EMBEDDING_MODEL_NAME
+from diet_rag.kb import DEFAULT_LOAD_BATCH_SIZE
+
+GENERATIVE_MODEL_NAME = 'gemini-2.0-flash'
+COMMON_FOLLOW_UPS = (
+    "what recipes?",
+    "what foods should I avoid?",
+    "can you suggest a meal plan?",
+    "what snacks are good?",
+)
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclasses.dataclass
+class EngineConfig:
+    embedding_model_name: str = EMBEDDING_MODEL_NAME
+    generative_model_name: str = GENERATIVE_MODEL_NAME
+    collection_name: str = "diet_recommendations_streamlit"
+
+    # Knowledge base: a JSON/JSONL file or directory of them, streamed in
+    # batches (diet_rag.kb); DIET_DOCUMENTS when unset
+    knowledge_base_path: str = None
+    kb_batch_size: int = DEFAULT_LOAD_BATCH_SIZE
+
+    # Vector store: "chroma" or "numpy"; persisted to disk if a directory is set
+    retrieval_backend: str = "chroma"
+    chroma_persist_dir: str = None
+    n_results: int = 2
+    # Open a prebuilt on-disk numpy index memory-mapped, without syncing it
+    # (how API workers share one index)
+    read_only_index: bool = False
+    # Precomputed embeddings (python -m diet_rag.artifact build); documents
+    # whose content hash matches are loaded from it instead of embedded
+    embedding_artifact: str = "diet_embeddings"
+    # Precomputed first answers per condition (python -m diet_rag.answers build);
+    # entries whose documents changed since the build are generated live
+    precomputed_answers: str = "diet_answers.json"
+
+    # Hybrid retrieval: a local BM25 index fused with vector results (reciprocal
+    # rank fusion over the top hybrid_candidates of each)
+    hybrid_retrieval: bool = True
+    hybrid_candidates: int = 10
+    rrf_k: int = 60
+    # Answer from lexical matches alone, skipping the embedding call, when the top
+    # hit contains every query term, scores at least lexical_min_score and beats
+    # the runner-up by this factor (0 disables the fast path)
+    lexical_fast_path_margin: float = 1.5
+    lexical_min_score: float = 1.0
+
+    # Condition router: queries naming a known condition (label parts, synonyms,
+    # misspellings within router_fuzzy_cutoff) go straight to its documents
+    # without an embedding call (0 disables fuzzy matching)
+    condition_router: bool = True
+    router_fuzzy_cutoff: float = 0.85
+
+    # Section-aware chunking
+    chunked_retrieval: bool = False
+    chunk_parent_expansion: bool = False
+    chunk_n_results: int = 4
+
+    # Process-wide query-embedding cache
+    query_cache_max_entries: int = 1024
+    query_cache_max_bytes: int = 16 * 1024 * 1024
+    query_cache_ttl_seconds: int = 24 * 3600
+    query_cache_eviction: str = "lru"
+
+    # Semantic response cache
+    response_cache_similarity: float = 0.92
+    response_cache_max_entries: int = 512
+
+    # Follow-up turns
+    follow_up_max_context_docs: int = 4
+    history_token_budget: int = 800
+    history_summary_tokens: int = 200
+
+    # Background async work
+    async_prefetch: bool = True
+    async_timeout_seconds: float = 30.0
+    common_follow_ups: tuple = COMMON_FOLLOW_UPS
+
+    # Prompt prefix: the static part of each prompt (diet_rag.prompts) is sent as
+    # the model's system instruction; with prompt_cache it is also registered as
+    # Gemini cached content once it reaches the API's minimum cacheable size
+    prompt_cache: bool = True
+    prompt_cache_min_tokens: int = 4096
+    prompt_cache_ttl_seconds: int = 3600
+
+    # Structured output (diet_rag.structured): first recommendations are
+    # requested as schema-checked JSON and rendered by the client (not streamed)
+    structured_output: bool = False
+
+    # Gemini API calls (diet_rag.resilience): retries of transient errors with
+    # jittered exponential backoff within a per-call deadline, a circuit breaker
+    # per operation (0 failures disables it) and a cap on calls in flight shared
+    # by all sessions (0 = unlimited); a hedge delay > 0 sends a duplicate
+    # embedding request when the first is slower than that
+    api_max_attempts: int = 4
+    api_deadline_seconds: float = 30.0
+    api_max_concurrency: int = 16
+    api_hedge_delay_seconds: float = 0.0
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30.0
+
+    # Log one JSON line per request (stage timings, tokens, cache use, errors) to stderr
+    metrics_json_logs: bool = False
+
+    @classmethod
+    def from_mapping(cls, mapping=None, env=None, **overrides):
+        """Builds a config from upper-case keys in `mapping`, falling back to `env`.
+
+        Values are coerced to each field's type (so "true", "600" etc. work;
+        tuple fields take comma-separated strings).
+        Keyword `overrides` win over both.
+        """
+        values = {}
+        for field in dataclasses.fields(cls):
+            key = field.name.upper()
+            value = None
+            for source in (mapping, env):
+                if source is not None and key in source:
+                    value = source[key]
+                    break
+            if value is None:
+                continue
+            default = field.default
+            if isinstance(default, bool):
+                value = _parse_bool(value)
+            elif isinstance(default, int):
+                value = int(value)
+            elif isinstance(default, float):
+                value = float(value)
+            elif isinstance(default, tuple):
+                if isinstance(value, str):
+                    value = [item.strip() for item in value.split(",")]
+                value = tuple(item for item in value if item)
+            else:
+                value = str(value)
+            values[field.name] = value
+        values.update(overrides)
+        return cls(**values)
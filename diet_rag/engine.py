@@ -0,0 +1,959 @@
+# diet_rag/engine.py
+
+# Headless RAG engine: warm-up, retrieval, prompt building and generation with
+# no Streamlit dependency. The Streamlit app, benchmarks and workers all drive
+# the same DietRAGEngine instance; UI concerns (spinners, error boxes) stay in
+# the clients, which catch the DietRAGError subclasses raised here.
+
+import datetime
+import os
+import threading
+import time
+
+from diet_rag import prompts
+from diet_rag.aio import (AsyncRAGService, BackgroundLoop,
+                          gemini_async_embedder, gemini_async_generator)
+from diet_rag.cache import EmbeddingCache, SemanticResponseCache, normalize_query
+from diet_rag.chunking import (chunk_documents, expand_to_parents, format_chunk,
+                               routed_chunk_ids)
+from diet_rag.config import EngineConfig
+from diet_rag.history import compact_history, count_tokens
+from diet_rag.ingest import (DEFAULT_BATCH_SIZE, AdaptiveBackoff, document_to_embedding_text,
+                             gemini_batch_embedder)
+from diet_rag.kb import KnowledgeBase, KnowledgeBaseError
+from diet_rag.lexical import BM25Index, reciprocal_rank_fusion, tokenize
+from diet_rag.metrics import MetricsRegistry, current_trace, enable_json_logs
+from diet_rag.resilience import ResilientGemini
+from diet_rag.retrieval import make_backend
+from diet_rag.router import ConditionRouter
+from diet_rag.store import CorpusHasher, sync_batches
+from diet_rag.structured import Recommendation, SchemaError
+
+
+class DietRAGError(Exception):
+    """Base class for errors raised by the engine."""
+
+
+class EmbeddingError(DietRAGError):
+    """Embedding a query or the knowledge base failed."""
+
+
+class RetrievalError(DietRAGError):
+    """Searching the vector store failed."""
+
+
+class GenerationError(DietRAGError):
+    """The generative model call failed."""
+
+
+class Answer:
+    """Result of a generation call.
+
+    Iterate over it to receive text chunks (a streamed answer yields chunks as
+    they arrive; a complete or cached one yields its text once). `text` holds
+    the full answer once available. A blocked answer carries `block_reason`
+    and the canned safety reply as its text. In structured output mode
+    `structured` holds the parsed diet_rag.structured.Recommendation and
+    `text` its markdown rendering.
+    """
+
+    def __init__(self, text=None, chunks=None, block_reason=None, from_cache=False,
+                 on_complete=None, structured=None):
+        self.text = text
+        self.structured = structured
+        self.block_reason = block_reason
+        self.from_cache = from_cache
+        self._chunks = chunks
+        self._on_complete = on_complete
+
+    @property
+    def blocked(self):
+        return bool(self.block_reason)
+
+    def __iter__(self):
+        if self._chunks is None:
+            if self.text:
+                yield self.text
+            return
+        parts = []
+        try:
+            for chunk in self._chunks:
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            raise GenerationError(str(e)) from e
+        finally:
+            self._chunks = None
+            self.text = "".join(parts)
+        if self._on_complete and self.text:
+            self._on_complete(self.text)
+
+    def resolve(self):
+        """Consumes any remaining stream and returns the full text."""
+        for _ in self:
+            pass
+        return self.text
+
+
+def iter_response_text(response):
+    """Yields the text of each streamed chunk, skipping chunks without text parts."""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:  # e.g. a chunk that only carries a finish reason
+            continue
+        if text:
+            yield text
+
+
+def usage_tokens(response):
+    """(prompt, output) token counts from the response's usage metadata, or None."""
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    output_tokens = getattr(usage, 'candidates_token_count', None)
+    if prompt_tokens is None or output_tokens is None:
+        return None
+    return prompt_tokens, output_tokens
+
+
+def cached_tokens(response):
+    """Prompt tokens served from cached content per the response's usage metadata, or None."""
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'cached_content_token_count', None)
+
+
+class DietRAGEngine:
+    """Retrieval-augmented diet recommender.
+
+    `api` is google.generativeai (default) or a diet_rag.stubs.StubGemini for
+    offline runs; every call to it goes through one diet_rag.resilience.ResilientGemini
+    (`client`). Call `warm_up()` once before retrieving; it builds (or syncs)
+    the vector store and starts the background event loop.
+    """
+
+    def __init__(self, config=None, documents=None, api=None, generative_model=None):
+        if api is None:
+            import google.generativeai as api
+        self.config = config or EngineConfig()
+        if documents is None and self.config.knowledge_base_path:
+            self.knowledge = KnowledgeBase(source=self.config.knowledge_base_path)
+        else:
+            if documents is None:
+                from diet_data import DIET_DOCUMENTS as documents
+            self.knowledge = KnowledgeBase(documents=documents)
+        # Parent texts for chunk_parent_expansion and the BM25 index, both filled
+        # while the vector store is built
+        self.documents_by_id = {}
+        self.lexical = BM25Index() if self.config.hybrid_retrieval else None
+
+        self.metrics = MetricsRegistry()
+        self.metrics.collectors += [self._cache_metrics, self._client_metrics]
+        if self.config.metrics_json_logs:
+            enable_json_logs()
+
+        self.client = ResilientGemini(
+            api, max_attempts=self.config.api_max_attempts,
+            deadline=self.config.api_deadline_seconds,
+            hedge_delay=self.config.api_hedge_delay_seconds,
+            max_in_flight=self.config.api_max_concurrency,
+            failure_threshold=self.config.circuit_failure_threshold,
+            reset_timeout=self.config.circuit_reset_seconds, metrics=self.metrics)
+        self.api = self.client
+        if generative_model is not None:
+            self.generative_model = self.client.wrap_model(generative_model)
+        else:
+            self.generative_model = self.client.GenerativeModel(self.config.generative_model_name)
+        # Per prompt template: a model carrying its static system instruction
+        # (prompts are then just the variable part), replaced by a cached-content
+        # model once registered; a caller-supplied model gets whole prompts inline
+        self.initial_template = (prompts.STRUCTURED_INITIAL_PROMPT if self.config.structured_output
+                                 else prompts.INITIAL_PROMPT)
+        self.templates = (self.initial_template, prompts.FOLLOW_UP_PROMPT)
+        self.prompt_prefix_tokens = {template.name: count_tokens(template.system_instruction)
+                                     for template in self.templates}
+        self._system_models = {}
+        if generative_model is None:
+            self._system_models = {
+                template.name: self.client.GenerativeModel(
+                    self.config.generative_model_name,
+                    system_instruction=template.system_instruction)
+                for template in self.templates}
+        self._prompt_models = {name: (model, "system_instruction", None)
+                               for name, model in self._system_models.items()}
+        self._prompt_lock = threading.Lock()
+
+        self.embedding_cache = EmbeddingCache(
+            max_entries=self.config.query_cache_max_entries,
+            max_bytes=self.config.query_cache_max_bytes,
+            ttl_seconds=self.config.query_cache_ttl_seconds,
+            eviction=self.config.query_cache_eviction)
+        self.response_cache = SemanticResponseCache(
+            threshold=self.config.response_cache_similarity,
+            max_entries=self.config.response_cache_max_entries)
+
+        # Precomputed first answers (diet_rag.answers): normalized condition or
+        # alias -> answer, for the entries whose documents are unchanged
+        self.precomputed = {}
+        self._answer_hasher = None
+        self._precomputed_lock = threading.Lock()
+        self.precomputed_hits = 0
+        self.precomputed_misses = 0
+
+        self.router = None
+        self.vector_store = None
+        self.sync_stats = None
+        self.loop = None
+        self.async_service = None
+        self._warm_lock = threading.Lock()
+
+    # --- Warm-up ---
+
+    @property
+    def is_ready(self):
+        return self.vector_store is not None
+
+    def collection_name(self):
+        name = self.config.collection_name
+        return name + "_chunks" if self.config.chunked_retrieval else name
+
+    @property
+    def conditions(self):
+        """id -> condition for every knowledge base document (after warm-up)."""
+        return self.knowledge.conditions or {}
+
+    @property
+    def load_report(self):
+        """The diet_rag.kb.LoadReport of the last pass over the knowledge base."""
+        return self.knowledge.report
+
+    def _index_batches(self):
+        """Streams the knowledge base as batches of documents (or section chunks) to index."""
+        keep_parents = self.config.chunked_retrieval and self.config.chunk_parent_expansion
+        for batch in self.knowledge.iter_batches(self.config.kb_batch_size):
+            if self._answer_hasher is not None:
+                self._answer_hasher.update(batch)
+            if keep_parents:
+                self.documents_by_id.update((doc_data['id'], {'text': doc_data['text']})
+                                            for doc_data in batch)
+            if self.config.chunked_retrieval:
+                batch = chunk_documents(batch)
+            if self.lexical is not None:
+                self.lexical.add_many([doc_data['id'] for doc_data in batch],
+                                      [document_to_embedding_text(doc_data) for doc_data in batch])
+            yield batch
+
+    def build_index(self, progress_callback=None, embed_fn=None):
+        """Opens the vector store and syncs the knowledge base into it.
+
+        Returns (vector_store, sync stats from diet_rag.store.sync_batches).
+        With `read_only_index` the existing index is opened as-is and the
+        knowledge base is only scanned. Raises EmbeddingError if the knowledge
+        base could not be embedded, diet_rag.kb.KnowledgeBaseError if it could
+        not be read and ValueError for an unknown retrieval backend.
+        """
+        vector_store = make_backend(self.config.retrieval_backend, self.collection_name(),
+                                    self.config.chroma_persist_dir,
+                                    read_only=self.config.read_only_index)
+        if self.config.read_only_index:
+            if vector_store.count() == 0:
+                raise EmbeddingError(f"No prebuilt index in {self.config.chroma_persist_dir!r}.")
+            hasher = CorpusHasher(self.config.embedding_model_name)
+            for batch in self._index_batches():
+                hasher.update(batch)
+            return vector_store, {'embedded': 0, 'from_artifact': 0, 'deleted': 0,
+                                  'unchanged': vector_store.count(), 'skipped': 0,
+                                  'corpus_hash': hasher.hexdigest()}
+        if embed_fn is None:
+            embed_fn = gemini_batch_embedder(self.config.embedding_model_name,
+                                             api=self.client.bulk)
+        backoff = AdaptiveBackoff()
+        try:
+            with self.metrics.stage("index_sync"):
+                total = None if self.config.chunked_retrieval else self.knowledge.size_hint
+                sync_stats = sync_batches(vector_store, self._index_batches(), embed_fn=embed_fn,
+                                          model_name=self.config.embedding_model_name,
+                                          progress_callback=progress_callback,
+                                          artifact=self._load_artifact(), total=total,
+                                          backoff=backoff)
+        except KnowledgeBaseError:
+            raise
+        except Exception as e:
+            raise EmbeddingError(str(e)) from e
+        finally:
+            if backoff.rate_limits:
+                self.metrics.record_retries("index_sync", backoff.rate_limits)
+        if vector_store.count() == 0:
+            raise EmbeddingError("No documents were embedded.")
+        return vector_store, sync_stats
+
+    def _load_artifact(self):
+        """The configured embedding artifact, or None if absent or unreadable."""
+        from diet_rag import artifact  # Only needed at warm-up
+        path = self.config.embedding_artifact
+        if not artifact.exists(path):
+            return None
+        try:
+            with self.metrics.stage("artifact_load"):
+                return artifact.load_artifact(path)
+        except artifact.ArtifactError:
+            return None  # Counted by the stage; everything is embedded live instead
+
+    def warm_up(self, progress_callback=None, embed_fn=None):
+        """Builds or syncs the vector store and starts the async loop (idempotent).
+
+        Returns the sync stats; raises like `build_index`.
+        """
+        with self._warm_lock:
+            if self.vector_store is not None:
+                return self.sync_stats
+            answer_store = self._load_answer_store()
+            if answer_store is not None:
+                from diet_rag.answers import ConditionHasher
+                self._answer_hasher = ConditionHasher(self.answer_version, set(answer_store.entries))
+            vector_store, sync_stats = self.build_index(progress_callback, embed_fn)
+            if answer_store is not None:
+                self.precomputed = answer_store.index(self._answer_hasher.hexdigests())
+                self._answer_hasher = None
+            if self.config.prompt_cache:
+                for template in self.templates:
+                    registered = self._register_prompt_cache(template)
+                    if registered is not None:
+                        self._prompt_models[template.name] = registered
+            if self.lexical is not None:
+                with self.metrics.stage("lexical_index"):
+                    self.lexical.finalize()
+            if self.config.condition_router:
+                with self.metrics.stage("router_build"):
+                    self.router = ConditionRouter.from_conditions(
+                        self.conditions, fuzzy_cutoff=self.config.router_fuzzy_cutoff)
+
+            # Drop cached answers whenever the knowledge base (or embedding model) changes
+            self.response_cache.ensure_version(sync_stats['corpus_hash'])
+            self.loop = BackgroundLoop()
+            self.async_service = AsyncRAGService(
+                embed_async=gemini_async_embedder(self.config.embedding_model_name, api=self.api),
+                query_fn=self.search,
+                fast_path_fn=self.fast_path,
+                generate_async=gemini_async_generator(self.generative_model),
+                embedding_cache=self.embedding_cache, n_results=self.config.n_results)
+            self.vector_store = vector_store
+            self.sync_stats = sync_stats
+            return sync_stats
+
+    @property
+    def answer_version(self):
+        """Version of the first answers this engine gives (see diet_rag.answers)."""
+        from diet_rag.answers import answer_version
+        return answer_version(self.config.generative_model_name, self.initial_template)
+
+    def _load_answer_store(self):
+        """The precomputed answers built for this model and prompt, or None."""
+        from diet_rag.answers import AnswerStore, AnswerStoreError  # Only needed at warm-up
+        path = self.config.precomputed_answers
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with self.metrics.stage("answers_load"):
+                store = AnswerStore.load(path)
+        except AnswerStoreError:
+            return None  # Counted by the stage; every answer is generated live instead
+        return store if store.version == self.answer_version else None
+
+    def _register_prompt_cache(self, template):
+        """Registers the template's system instruction as Gemini cached content.
+
+        Returns (model, "cached_content", expiry) or None when the API has no
+        caching support, the instruction is below prompt_cache_min_tokens or
+        the registration fails (the instruction is then sent uncached).
+        """
+        caching = getattr(self.client.api, 'caching', None)
+        if (caching is None or not self._system_models
+                or self.prompt_prefix_tokens[template.name] < self.config.prompt_cache_min_tokens):
+            return None
+        model_name = self.config.generative_model_name
+        if not model_name.startswith("models/"):
+            model_name = "models/" + model_name
+        ttl = self.config.prompt_cache_ttl_seconds
+        try:
+            with self.metrics.stage("prompt_cache"):
+                cached = caching.CachedContent.create(
+                    model=model_name, display_name=f"diet_rag_{template.name}",
+                    system_instruction=template.system_instruction,
+                    ttl=datetime.timedelta(seconds=ttl))
+                model = self.client.api.GenerativeModel.from_cached_content(cached_content=cached)
+        except Exception:
+            return None  # Counted by the stage
+        # Refreshed a minute before the cache expires
+        return self.client.wrap_model(model), "cached_content", time.monotonic() + ttl - 60
+
+    def _prompt_model(self, template):
+        """(model, mode) for a template: "cached_content", "system_instruction" or "inline"."""
+        if not self._system_models:
+            return self.generative_model, "inline"
+        model, mode, expires = self._prompt_models[template.name]
+        if expires is not None and time.monotonic() >= expires:
+            with self._prompt_lock:
+                model, mode, expires = self._prompt_models[template.name]
+                if expires is not None and time.monotonic() >= expires:
+                    registered = self._register_prompt_cache(template) or (
+                        self._system_models[template.name], "system_instruction", None)
+                    self._prompt_models[template.name] = registered
+                    model, mode, _ = registered
+        return model, mode
+
+    def prompt_prefix_stats(self):
+        """Per template: how its static prefix is sent and its size in (estimated) tokens."""
+        return {template.name: {'mode': self._prompt_model(template)[1],
+                                'prefix_tokens': self.prompt_prefix_tokens[template.name]}
+                for template in self.templates}
+
+    def prewarm(self):
+        """Embeds condition labels and common follow-ups in the background; returns the future."""
+        # Capped so a large knowledge base does not flush the query cache it is warming
+        texts = sorted(set(self.conditions.values()))[:self.config.query_cache_max_entries // 2]
+        texts += list(self.config.common_follow_ups)
+        return self.loop.submit(self.async_service.prewarm(texts))
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.stop()
+
+    # --- Retrieval ---
+
+    def embed_query(self, text, task_type="retrieval_query"):
+        """Embeds text, served from the process-wide embedding cache when possible."""
+        cached = self.embedding_cache.get(text, task_type)
+        self.metrics.record_cache("embedding", cached is not None)
+        if cached is not None:
+            return cached
+        try:
+            with self.metrics.stage("embed"):
+                embedding = self.api.embed_content(model=self.config.embedding_model_name,
+                                                   content=text,
+                                                   task_type=task_type)['embedding']
+        except Exception as e:
+            raise EmbeddingError(str(e)) from e
+        self.embedding_cache.put(text, task_type, embedding)
+        return embedding
+
+    def embed_queries(self, texts, task_type="retrieval_query", batch_size=DEFAULT_BATCH_SIZE):
+        """Embeds many texts, one batch request per `batch_size` texts not already cached.
+
+        Returns the embeddings in the order of `texts`.
+        """
+        embeddings = []
+        for text in texts:
+            cached = self.embedding_cache.get(text, task_type)
+            self.metrics.record_cache("embedding", cached is not None)
+            embeddings.append(cached)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            try:
+                with self.metrics.stage("embed"):
+                    batch_embeddings = self.api.embed_content(
+                        model=self.config.embedding_model_name,
+                        content=[texts[i] for i in batch], task_type=task_type)['embedding']
+            except Exception as e:
+                raise EmbeddingError(str(e)) from e
+            if len(batch_embeddings) != len(batch):
+                raise EmbeddingError(
+                    f"Got {len(batch_embeddings)} embeddings for {len(batch)} texts")
+            for i, embedding in zip(batch, batch_embeddings):
+                self.embedding_cache.put(texts[i], task_type, embedding)
+                embeddings[i] = embedding
+        return embeddings
+
+    def _present(self, results, n_results):
+        """Turns raw backend results into {'ids', 'documents'} for prompts.
+
+        In chunked mode the best-matching sections are returned (chunk_n_results
+        of them), or their parent documents if chunk_parent_expansion is on.
+        """
+        if not self.config.chunked_retrieval:
+            return {'ids': results['ids'][:n_results],
+                    'documents': results['documents'][:n_results]}
+        if self.config.chunk_parent_expansion:
+            parent_ids, parent_texts = expand_to_parents(
+                results['ids'], results['metadatas'], self.documents_by_id)
+            return {'ids': parent_ids[:n_results], 'documents': parent_texts[:n_results]}
+        return {'ids': results['ids'],
+                'documents': [format_chunk(text, metadata) for text, metadata
+                              in zip(results['documents'], results['metadatas'])]}
+
+    def lexical_search(self, query, k=None):
+        """BM25 hits for `query` ({'ids', 'scores', 'coverage'}); empty without an index."""
+        if self.lexical is None or not query:
+            return {'ids': [], 'scores': [], 'coverage': []}
+        with self.metrics.stage("lexical"):
+            return self.lexical.search(query, k or self.config.hybrid_candidates)
+
+    def _is_decisive(self, hits):
+        margin = self.config.lexical_fast_path_margin
+        if not margin or not hits['ids']:
+            return False
+        top = hits['scores'][0]
+        runner_up = hits['scores'][1] if len(hits['scores']) > 1 else 0.0
+        return (hits['coverage'][0] >= 1.0 and top >= self.config.lexical_min_score
+                and top >= margin * runner_up)
+
+    def lexical_fast_path(self, query, n_results=None, hits=None):
+        """Retrieval from lexical matches alone when they are decisive, else None.
+
+        The result has no embedding; the caller skips the embedding call.
+        `hits` are precomputed `lexical_search` results, if any.
+        """
+        if self.lexical is None:
+            return None
+        n_results = n_results or self.config.n_results
+        hits = hits if hits is not None else self.lexical_search(query)
+        decisive = self._is_decisive(hits)
+        self.metrics.record_cache("lexical_fast_path", decisive)
+        if not decisive:
+            return None
+        depth = self.config.chunk_n_results if self.config.chunked_retrieval else n_results
+        try:
+            with self.metrics.stage("search"):
+                results = self.vector_store.get(hits['ids'][:depth])
+        except Exception as e:
+            raise RetrievalError(str(e)) from e
+        self.metrics.inc("retrievals_total", {'path': 'lexical'}, help="Retrievals by path")
+        result = {'embedding': None}
+        result.update(self._present(results, n_results))
+        return result
+
+    def condition_route(self, query, n_results=None):
+        """The documents of the condition `query` names (see diet_rag.router), else None.
+
+        Like the lexical fast path, the result has no embedding. In chunked
+        mode chunk_n_results of the routed documents' sections are returned,
+        those the query asks for and then recipe and tips first (see
+        diet_rag.chunking.routed_chunk_ids), or the documents themselves with
+        chunk_parent_expansion.
+        """
+        if self.router is None:
+            return None
+        n_results = n_results or self.config.n_results
+        with self.metrics.stage("route"):
+            doc_ids = self.router.route(query, limit=n_results)
+        self.metrics.record_cache("condition_router", doc_ids is not None)
+        if doc_ids is None:
+            return None
+        self.metrics.inc("retrievals_total", {'path': 'router'}, help="Retrievals by path")
+        if self.config.chunked_retrieval and self.config.chunk_parent_expansion:
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id in self.documents_by_id]
+            return {'embedding': None, 'ids': doc_ids,
+                    'documents': [self.documents_by_id[doc_id]['text'] for doc_id in doc_ids]}
+        if self.config.chunked_retrieval:
+            terms = tokenize(query)
+            doc_ids = [chunk_id for doc_id in doc_ids for chunk_id in routed_chunk_ids(doc_id, terms)]
+        try:
+            with self.metrics.stage("search"):
+                results = self.vector_store.get(doc_ids)
+        except Exception as e:
+            raise RetrievalError(str(e)) from e
+        if self.config.chunked_retrieval:
+            depth = self.config.chunk_n_results
+            results = {key: values[:depth] for key, values in results.items()}
+        result = {'embedding': None}
+        result.update(self._present(results, n_results))
+        return result
+
+    def fast_path(self, query, n_results=None):
+        """Retrieval without an embedding call (condition router, then lexical), else None."""
+        routed = self.condition_route(query, n_results)
+        if routed is not None:
+            return routed
+        return self.lexical_fast_path(query, n_results)
+
+    def search(self, query_embedding, n_results=None, query=None, hits=None):
+        """Searches the vector store with an embedding; returns {'ids', 'documents'}.
+
+        With `query` text (or its precomputed `lexical_search` `hits`) and
+        hybrid retrieval on, vector and BM25 rankings are fused by reciprocal
+        rank fusion. In chunked mode the best-matching sections are returned
+        (see `_present`).
+        """
+        n_results = n_results or self.config.n_results
+        depth = self.config.chunk_n_results if self.config.chunked_retrieval else n_results
+        if hits is None:
+            hits = self.lexical_search(query)
+        try:
+            with self.metrics.stage("search"):
+                if not hits['ids']:
+                    results = self.vector_store.query(query_embedding, n_results=depth)
+                else:
+                    results = self._fused_query(query_embedding, hits['ids'], depth)
+        except Exception as e:
+            raise RetrievalError(str(e)) from e
+        self.metrics.inc("retrievals_total", {'path': 'hybrid' if hits['ids'] else 'vector'},
+                         help="Retrievals by path")
+        return self._present(results, n_results)
+
+    def _fused_query(self, query_embedding, lexical_ids, depth):
+        """Top `depth` results by reciprocal rank fusion of vector and lexical rankings."""
+        candidates = max(depth, self.config.hybrid_candidates)
+        vector = self.vector_store.query(query_embedding, n_results=candidates)
+        return self._fuse(vector, lexical_ids, depth)
+
+    def _fuse(self, vector, lexical_ids, depth):
+        """Fuses vector store results (at least `depth` deep) with a lexical ranking."""
+        fused = reciprocal_rank_fusion([vector['ids'], lexical_ids], k=self.config.rrf_k)[:depth]
+        rows = {doc_id: row for row, doc_id in enumerate(vector['ids'])}
+        extra = self.vector_store.get([doc_id for doc_id in fused if doc_id not in rows])
+        extra_rows = {doc_id: row for row, doc_id in enumerate(extra['ids'])}
+        results = {'ids': [], 'documents': [], 'metadatas': []}
+        for doc_id in fused:
+            source, row = (vector, rows[doc_id]) if doc_id in rows else (extra, extra_rows.get(doc_id))
+            if row is None:
+                continue  # Deleted from the store since the lexical index was built
+            results['ids'].append(doc_id)
+            results['documents'].append(source['documents'][row])
+            results['metadatas'].append(source['metadatas'][row])
+        return results
+
+    def retrieve(self, query, n_results=None):
+        """Retrieves for a query; returns {'embedding', 'ids', 'documents'}.
+
+        Queries naming a known condition (the condition router) and decisive
+        lexical matches are returned without embedding the query ('embedding'
+        is then None); otherwise vector and lexical results are fused.
+        """
+        if not query:
+            return {'embedding': None, 'ids': [], 'documents': []}
+        routed = self.condition_route(query, n_results)
+        if routed is not None:
+            return routed
+        hits = self.lexical_search(query)
+        fast = self.lexical_fast_path(query, n_results, hits=hits)
+        if fast is not None:
+            return fast
+        embedding = self.embed_query(query)
+        result = {'embedding': embedding}
+        result.update(self.search(embedding, n_results, hits=hits))
+        return result
+
+    def retrieve_batch(self, queries, n_results=None):
+        """`retrieve` for many queries at once; returns one result per query, in order.
+
+        Routed queries and decisive lexical matches are handled as in
+        `retrieve`. The rest are embedded with batch requests (`embed_queries`)
+        and searched with a single `query_batch` call on the vector store
+        before each is fused with its lexical hits.
+        """
+        n_results = n_results or self.config.n_results
+        depth = self.config.chunk_n_results if self.config.chunked_retrieval else n_results
+        results = [None] * len(queries)
+        pending, pending_hits = [], []
+        for i, query in enumerate(queries):
+            if not query:
+                results[i] = {'embedding': None, 'ids': [], 'documents': []}
+                continue
+            fast = self.condition_route(query, n_results)
+            if fast is None:
+                hits = self.lexical_search(query)
+                fast = self.lexical_fast_path(query, n_results, hits=hits)
+            if fast is not None:
+                results[i] = fast
+                continue
+            pending.append(i)
+            pending_hits.append(hits)
+        if not pending:
+            return results
+        embeddings = self.embed_queries([queries[i] for i in pending])
+        hybrid = any(hits['ids'] for hits in pending_hits)
+        candidates = max(depth, self.config.hybrid_candidates) if hybrid else depth
+        try:
+            with self.metrics.stage("search"):
+                vectors = self.vector_store.query_batch(embeddings, n_results=candidates)
+                found = [self._fuse(vector, hits['ids'], depth) if hits['ids']
+                         else {key: values[:depth] for key, values in vector.items()}
+                         for vector, hits in zip(vectors, pending_hits)]
+        except Exception as e:
+            raise RetrievalError(str(e)) from e
+        for i, embedding, hits, raw in zip(pending, embeddings, pending_hits, found):
+            self.metrics.inc("retrievals_total", {'path': 'hybrid' if hits['ids'] else 'vector'},
+                             help="Retrievals by path")
+            result = {'embedding': embedding}
+            result.update(self._present(raw, n_results))
+            results[i] = result
+        return results
+
+    # --- Generation ---
+
+    def _record_usage(self, response, prompt, text, trace, prefix=(0, False)):
+        """Records prompt, output and cached prompt tokens.
+
+        `prefix` is (system instruction tokens, whether they are cached content);
+        without usage metadata the counts are estimated.
+        """
+        prefix_tokens, prefix_cached = prefix
+        usage = usage_tokens(response)
+        prompt_tokens, output_tokens = usage or (prefix_tokens + count_tokens(prompt),
+                                                 count_tokens(text or ""))
+        self.metrics.record_tokens("prompt", prompt_tokens, trace)
+        self.metrics.record_tokens("output", output_tokens, trace)
+        cached = cached_tokens(response)
+        if cached is None:
+            cached = prefix_tokens if prefix_cached else 0
+        if cached:
+            self.metrics.record_tokens("prompt_cached", cached, trace)
+
+    def _timed_chunks(self, response, prompt, start, trace, prefix):
+        """Streams the response text, recording time to first chunk, duration and tokens."""
+        parts = []
+        try:
+            for text in iter_response_text(response):
+                if not parts:
+                    self.metrics.observe_stage("first_chunk", time.perf_counter() - start, trace)
+                parts.append(text)
+                yield text
+        except Exception as e:
+            self.metrics.record_error("generate", e, trace)
+            raise
+        finally:
+            self.metrics.observe_stage("generate", time.perf_counter() - start, trace)
+        self._record_usage(response, prompt, "".join(parts), trace, prefix)
+
+    def _generate(self, template, fields, stream, blocked_message, on_complete=None):
+        """Generates from a prompts.PromptTemplate filled with `fields`."""
+        trace = current_trace()  # Streams are consumed after this call returns
+        with self.metrics.stage("prompt"):
+            model, mode = self._prompt_model(template)
+            if mode == "inline":
+                prompt, prefix = template.inline(**fields), (0, False)
+            else:
+                prompt = template.render(**fields)
+                prefix = (self.prompt_prefix_tokens[template.name], mode == "cached_content")
+        options = {}
+        if template.generation_config:
+            options['generation_config'] = template.generation_config
+        start = time.perf_counter()
+        try:
+            response = model.generate_content(prompt, stream=stream, **options)
+            # Basic safety check, done before any text reaches the client
+            block_reason = response.prompt_feedback.block_reason
+        except Exception as e:
+            self.metrics.record_error("generate", e, trace)
+            raise GenerationError(str(e)) from e
+        if block_reason:
+            self.metrics.inc("blocked_total", help="Responses blocked by the safety filter")
+            self.metrics.observe_stage("generate", time.perf_counter() - start, trace)
+            return Answer(text=blocked_message, block_reason=block_reason)
+        if stream:
+            return Answer(chunks=self._timed_chunks(response, prompt, start, trace, prefix),
+                          on_complete=on_complete)
+        try:
+            text = response.text
+        except Exception as e:
+            self.metrics.record_error("generate", e, trace)
+            raise GenerationError(str(e)) from e
+        finally:
+            self.metrics.observe_stage("generate", time.perf_counter() - start, trace)
+        self._record_usage(response, prompt, text, trace, prefix)
+        if on_complete and text:
+            on_complete(text)
+        return Answer(text=text)
+
+    def precomputed_answer(self, user_problem):
+        """The stored answer (diet_rag.answers) if `user_problem` just names a condition, else None."""
+        if not self.precomputed:
+            return None
+        from diet_rag.answers import answer_key
+        text = self.precomputed.get(answer_key(user_problem))
+        with self._precomputed_lock:
+            if text is None:
+                self.precomputed_misses += 1
+            else:
+                self.precomputed_hits += 1
+        self.metrics.record_cache("precomputed", text is not None)
+        if text is None:
+            return None
+        if self.config.structured_output:
+            return self._structured_answer(text, from_cache=True)
+        return Answer(text=text, from_cache=True)
+
+    def generate(self, user_problem, retrieved, stream=False):
+        """Generates the first recommendation for `retrieved` (a `retrieve` result).
+
+        A question that just names a knowledge base condition (or an alias of
+        one) is answered from the precomputed answers. Semantically similar
+        earlier questions (or, without an embedding, the same question) that
+        retrieved the same documents are answered from the response cache.
+        With structured_output the answer is requested as JSON and never
+        streamed (see `_structured_answer`).
+        """
+        precomputed = self.precomputed_answer(user_problem)
+        if precomputed is not None:
+            return precomputed
+        embedding, doc_ids = retrieved.get('embedding'), retrieved.get('ids')
+        use_cache = bool(doc_ids)
+        if use_cache:
+            cached_answer = self.response_cache.lookup(embedding, doc_ids, query=user_problem)
+            self.metrics.record_cache("response", cached_answer is not None)
+            if cached_answer is not None:
+                if self.config.structured_output:
+                    return self._structured_answer(cached_answer, from_cache=True)
+                return Answer(text=cached_answer, from_cache=True)
+
+        def store(text):
+            self.response_cache.store(user_problem, embedding, doc_ids, text)
+
+        fields = prompts.initial_fields(user_problem, retrieved.get('documents'))
+        if self.config.structured_output:
+            answer = self._generate(self.initial_template, fields, False,
+                                    prompts.BLOCKED_INITIAL_MESSAGE)
+            if answer.blocked:
+                return answer
+            return self._structured_answer(answer.text, on_valid=store if use_cache else None)
+        return self._generate(self.initial_template, fields, stream, prompts.BLOCKED_INITIAL_MESSAGE,
+                              on_complete=store if use_cache else None)
+
+    def _structured_answer(self, text, from_cache=False, on_valid=None):
+        """An Answer for a JSON recommendation, or for `text` as is if it doesn't match the schema.
+
+        Valid answers are passed to `on_valid` in compact form (`Recommendation.to_json`).
+        """
+        try:
+            recommendation = (Recommendation.from_compact(text) if from_cache
+                              else Recommendation.from_json(text))
+        except SchemaError:
+            self.metrics.inc("structured_invalid_total",
+                             help="Structured answers that did not match the schema")
+            return Answer(text=text, from_cache=from_cache)
+        if on_valid:
+            on_valid(recommendation.to_json())
+        return Answer(text=recommendation.to_markdown(), from_cache=from_cache,
+                      structured=recommendation)
+
+    def generate_follow_up(self, initial_problem, conversation_history, user_input,
+                           context_docs=None, history_summary=None, stream=False):
+        """Generates a follow-up answer grounded in `context_docs`."""
+        fields = prompts.follow_up_fields(initial_problem, conversation_history, user_input,
+                                          context_docs, history_summary)
+        return self._generate(prompts.FOLLOW_UP_PROMPT, fields, stream,
+                              prompts.BLOCKED_FOLLOW_UP_MESSAGE)
+
+    def stream(self, user_problem, retrieved):
+        """Shorthand for `generate(..., stream=True)`."""
+        return self.generate(user_problem, retrieved, stream=True)
+
+    # --- Conversation helpers (state is a diet_rag.session.ConversationState) ---
+
+    def retrieve_for_session(self, state, query, n_results=None):
+        """Retrieves for a query, reusing results already fetched in this conversation."""
+        key = normalize_query(query)
+        retrieved = state.retrieval_cache.get(key)
+        if retrieved is None:
+            retrieved = self.retrieve(query, n_results)
+            if retrieved['ids']:
+                state.retrieval_cache[key] = retrieved
+        for doc_id, text in zip(retrieved['ids'], retrieved['documents']):
+            state.retrieved_context.setdefault(doc_id, text)
+        return retrieved
+
+    def session_documents(self, state, first_ids=()):
+        """Session context: `first_ids` first, then earlier documents, capped for follow-ups."""
+        doc_ids = list(first_ids)
+        doc_ids += [doc_id for doc_id in state.retrieved_context if doc_id not in doc_ids]
+        return [state.retrieved_context[doc_id]
+                for doc_id in doc_ids[:self.config.follow_up_max_context_docs]]
+
+    def start_follow_up_retrieval(self, state, user_input):
+        """Starts retrieval for a follow-up input on the async loop (None if already cached)."""
+        if normalize_query(user_input) in state.retrieval_cache:
+            return None
+        return self.loop.submit(self.async_service.retrieve(user_input))
+
+    def start_speculative_retrieval(self, state):
+        """Starts retrieval for common follow-ups while the user reads the answer."""
+        pending = [query for query in self.config.common_follow_ups
+                   if normalize_query(query) not in state.retrieval_cache]
+        if not pending:
+            return None
+        future = self.loop.submit(self.async_service.retrieve_many(pending))
+        future.queries = pending
+        return future
+
+    def collect_speculative_results(self, state, future):
+        """Moves a finished speculative retrieval into the state; returns True if consumed."""
+        if future is None or not future.done():
+            return False
+        if future.cancelled() or future.exception() is not None:
+            return True
+        for query, retrieved in zip(future.queries, future.result()):
+            if retrieved['ids']:
+                state.retrieval_cache.setdefault(normalize_query(query), retrieved)
+        return True
+
+    def follow_up_context(self, state, user_input, pending=None):
+        """Context for a follow-up: new matches for the input, then earlier session documents.
+
+        `pending` is a future from start_follow_up_retrieval; if it failed the
+        retrieval is retried synchronously (and its errors raised).
+        """
+        with self.metrics.stage("follow_up_context"):
+            key = normalize_query(user_input)
+            if pending is not None and key not in state.retrieval_cache:
+                try:
+                    retrieved = pending.result(timeout=self.config.async_timeout_seconds)
+                    if retrieved['ids']:
+                        state.retrieval_cache[key] = retrieved
+                except Exception:
+                    pass
+            retrieved = self.retrieve_for_session(state, user_input)
+            return self.session_documents(state, retrieved['ids'])
+
+    def compact_history(self, state, chat_history):
+        """Returns (summary, recent turns) for chat_history within the token budget."""
+        return compact_history(chat_history, state.history_summary,
+                               budget_tokens=self.config.history_token_budget,
+                               summary_tokens=self.config.history_summary_tokens)
+
+    # --- Metrics ---
+
+    def trace(self, kind):
+        """Context manager collecting one request's breakdown (see MetricsRegistry.trace)."""
+        return self.metrics.trace(kind)
+
+    def metrics_text(self):
+        """All metrics, including cache statistics, in Prometheus text format."""
+        return self.metrics.render()
+
+    def _cache_metrics(self):
+        lookups, entries = [], []
+        for name, cache_stats in self.stats().items():
+            cache = name.replace("_cache", "")
+            lookups += [({'cache': cache, 'result': 'hit'}, cache_stats['hits']),
+                        ({'cache': cache, 'result': 'miss'}, cache_stats['misses'])]
+            entries.append(({'cache': cache}, cache_stats['entries']))
+        return [("cache_lookups_total", "counter", "Cache lookups by result", lookups),
+                ("cache_entries", "gauge", "Entries currently cached", entries)]
+
+    def _client_metrics(self):
+        client_stats = self.client.stats()
+        circuits = client_stats['circuits']
+        return [("api_in_flight", "gauge", "Gemini API calls in flight",
+                 [({}, client_stats['in_flight'])]),
+                ("circuit_open", "gauge", "1 while an operation's circuit breaker is open",
+                 [({'operation': name}, int(circuit['state'] == "open"))
+                  for name, circuit in circuits.items()]),
+                ("circuit_opened_total", "counter", "Times each circuit breaker opened",
+                 [({'operation': name}, circuit['opened']) for name, circuit in circuits.items()]),
+                ("circuit_rejected_total", "counter", "Calls failed fast by an open circuit",
+                 [({'operation': name}, circuit['rejected'])
+                  for name, circuit in circuits.items()])]
+
+    def stats(self):
+        stats = {
+            'embedding_cache': self.embedding_cache.stats(),
+            'response_cache': self.response_cache.stats(),
+        }
+        if self.router is not None:
+            stats['condition_router'] = self.router.stats()
+        if self.precomputed:
+            with self._precomputed_lock:
+                stats['precomputed_answers'] = {'hits': self.precomputed_hits,
+                                                'misses': self.precomputed_misses,
+                                                'entries': len(self.precomputed)}
+        return stats
@@ -0,0 +1,329 @@
+# diet_rag/evaluation.py
+
+# Offline retrieval evaluation: quality and speed of retrieval on a labeled
+# query -> condition set (diet_eval_queries.jsonl), so a change to n_results,
+# chunking or the backend can be checked before it ships. Documents come from
+# the saved embedding artifact (diet_rag.artifact) and queries from a cached
+# query-embedding matrix next to it (<artifact>.queries.npz), so once that
+# cache exists a run makes no API calls. A retrieved document is relevant when
+# its condition is the query's label; retrieved chunks count as their parent
+# document. Recall@k, MRR and nDCG@k are computed for all queries at once from
+# a (queries x ranks) relevance matrix. Two views:
+#   backends  raw vector search on each retrieval backend, timed per query and
+#             as one batched search
+#   pipeline  DietRAGEngine.retrieve as deployed (condition router, lexical
+#             fast path, hybrid fusion, n_results and chunking settings)
+#
+# Usage: python -m diet_rag.evaluation [--artifact diet_embeddings] [--k 1,2,5] [--pipeline]
+#        (settings as in diet_rag/config.py; queries are embedded with the artifact's
+#        model, GOOGLE_API_KEY is only needed for queries missing from the cache;
+#        stub artifacts use the FakeEmbedder)
+
+import argparse
+import dataclasses
+import json
+import os
+import time
+
+import numpy as np
+
+from diet_rag.ingest import DEFAULT_BATCH_SIZE, FAKE_EMBEDDING_MODEL_NAME
+from diet_rag.retrieval import BACKENDS, make_backend
+
+EVAL_QUERIES = "diet_eval_queries.jsonl"
+QUERY_CACHE_SUFFIX = ".queries.npz"
+QUERY_TASK_TYPE = "retrieval_query"
+DEFAULT_KS = (1, 2, 5)
+
+
+class EvaluationError(Exception):
+    """The labeled set, the artifact or the query embeddings cannot be used."""
+
+
+def load_queries(path=EVAL_QUERIES):
+    """[(query, condition)] from a JSONL file of {"query", "condition"} objects."""
+    labeled = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                labeled.append((record['query'], record['condition']))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise EvaluationError(f"Cannot read labeled queries {path!r}: {e}") from e
+    if not labeled:
+        raise EvaluationError(f"No labeled queries in {path!r}")
+    return labeled
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def query_matrix(queries, path, model_name, embed_fn=None, batch_size=DEFAULT_BATCH_SIZE):
+    """(n_queries, dim) float32 matrix of L2-normalized query embeddings, cached at `path`.
+
+    `model_name` names the model `embed_fn` embeds with. Rows of queries
+    already in the cache for that model are reused; the others are embedded
+    with `embed_fn` and the cache is rewritten.
+    Raises EvaluationError when some are missing and there is no `embed_fn`.
+    """
+    cached = {}
+    if os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                if str(data['model_name']) == model_name:
+                    cached = dict(zip(data['texts'].tolist(), data['matrix']))
+        except (OSError, ValueError, KeyError) as e:
+            raise EvaluationError(f"Cannot load query embeddings {path!r}: {e}") from e
+    missing = [query for query in dict.fromkeys(queries) if query not in cached]
+    if missing:
+        if embed_fn is None:
+            raise EvaluationError(f"{len(missing)} queries are not in {path!r}; set GOOGLE_API_KEY "
+                                  f"to embed them once")
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            vectors = _normalize(np.asarray(embed_fn(batch), dtype=np.float32))
+            cached.update(zip(batch, vectors))
+        texts = list(cached)
+        np.savez(path, model_name=np.array(model_name), texts=np.array(texts),
+                 matrix=np.stack([cached[text] for text in texts]))
+    return np.stack([cached[query] for query in queries]).astype(np.float32, copy=False)
+
+
+def ranking_metrics(relevant, n_relevant, ks=DEFAULT_KS):
+    """Mean recall@k and nDCG@k (binary gains) for each k, and MRR.
+
+    `relevant` is a boolean (n_queries, depth) matrix, True where the result
+    at that rank is relevant (ranks past the end of a shorter result list are
+    False); `n_relevant` holds each query's number of relevant documents.
+    Ranks beyond `depth` count as misses.
+    """
+    relevant = np.asarray(relevant, dtype=bool)
+    n_relevant = np.asarray(n_relevant)
+    depth = relevant.shape[1]
+    discounts = 1.0 / np.log2(np.arange(2, max(depth, *ks) + 2))
+    hits = np.cumsum(relevant, axis=1)
+    dcg = np.cumsum(relevant * discounts[:depth], axis=1)
+    ideal = np.cumsum(discounts)
+    found = relevant.any(axis=1)
+    first_rank = np.where(found, relevant.argmax(axis=1) + 1, np.inf)
+    metrics = {}
+    for k in ks:
+        column = min(k, depth) - 1
+        if column < 0:
+            metrics[f'recall@{k}'] = metrics[f'ndcg@{k}'] = 0.0
+            continue
+        metrics[f'recall@{k}'] = float(np.mean(hits[:, column] / n_relevant))
+        metrics[f'ndcg@{k}'] = float(np.mean(dcg[:, column] / ideal[np.minimum(n_relevant, k) - 1]))
+    metrics['mrr'] = float(np.mean(1.0 / first_rank))
+    return metrics
+
+
+class Labels:
+    """Integer condition codes for documents and labeled queries, for vectorized relevance."""
+
+    def __init__(self, doc_conditions, query_conditions):
+        self.conditions = sorted(set(doc_conditions))
+        codes = {condition: code for code, condition in enumerate(self.conditions)}
+        unknown = sorted(set(query_conditions) - set(codes))
+        if unknown:
+            raise EvaluationError(f"Labels not in the knowledge base: {', '.join(unknown)}")
+        self.codes = codes
+        self.queries = np.array([codes[condition] for condition in query_conditions])
+
+    def counts(self, doc_conditions):
+        """Relevant documents per query among `doc_conditions` (the ranked collection)."""
+        per_condition = np.bincount([self.codes[condition] for condition in doc_conditions],
+                                    minlength=len(self.conditions))
+        return per_condition[self.queries]
+
+    def relevance(self, ranked_conditions, depth):
+        """Boolean (n_queries, depth) matrix from each query's ranked result conditions."""
+        ranked = np.full((len(ranked_conditions), depth), -1)
+        for i, conditions in enumerate(ranked_conditions):
+            codes = [self.codes.get(condition, -1) for condition in conditions[:depth]]
+            ranked[i, :len(codes)] = codes
+        return ranked == self.queries[:, None]
+
+
+def _latency_summary(latencies_ms):
+    return {'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p95_ms': float(np.percentile(latencies_ms, 95))}
+
+
+def _ranked_documents(ids, metadatas, depth):
+    """Document ids of ranked results, a chunk counting as its parent, first `depth` distinct."""
+    parents = dict.fromkeys((metadata or {}).get('parent_id', doc_id)
+                            for doc_id, metadata in zip(ids, metadatas))
+    return list(parents)[:depth]
+
+
+def evaluate_backend(name, artifact, queries, labels, depth, ks=DEFAULT_KS):
+    """Quality and latency of raw vector search on backend `name`, filled from `artifact`.
+
+    `queries` is the query_matrix and `depth` the number of documents
+    ranked (for a chunked artifact, enough chunks are fetched to cover
+    them). Latency is measured one query at a time; the ranking scored is
+    that of a single `query_batch` call.
+    """
+    condition_of = {metadata.get('parent_id', doc_id): metadata['condition']
+                    for doc_id, metadata in zip(artifact.ids, artifact.metadatas)}
+    n_results = depth * -(-len(artifact) // max(1, len(condition_of)))
+    backend = make_backend(name, f"eval-{name}")
+    backend.upsert_normalized(artifact.ids, artifact.documents,
+                              [dict(metadata) for metadata in artifact.metadatas], artifact.matrix)
+    latencies = []
+    for vector in queries.tolist():
+        start = time.perf_counter()
+        backend.query(vector, n_results=n_results)
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    results = backend.query_batch(queries.tolist(), n_results=n_results)
+    batch_ms = (time.perf_counter() - start) * 1000
+    ranked = [[condition_of[doc_id] for doc_id in
+               _ranked_documents(result['ids'], result['metadatas'], depth)]
+              for result in results]
+    report = ranking_metrics(labels.relevance(ranked, depth), labels.counts(condition_of.values()),
+                             ks)
+    report.update(_latency_summary(latencies), batch_ms=batch_ms)
+    return report
+
+
+class _OfflineAPI:
+    """Stands in for the Gemini API in pipeline runs: nothing may reach it."""
+
+    def GenerativeModel(self, model_name=None, **kwargs):  # noqa: N802 - mirrors the genai API
+        return None  # The pipeline run only retrieves
+
+    def embed_content(self, **kwargs):
+        raise EvaluationError("The pipeline tried to embed text missing from the query cache "
+                              "or the artifact; rebuild the artifact for this corpus and settings")
+
+
+def evaluate_pipeline(config, documents, artifact_path, labeled, queries, ks=DEFAULT_KS):
+    """Quality and latency of DietRAGEngine.retrieve with `config`, without API calls.
+
+    The engine's vector store is filled from the artifact at `artifact_path`
+    (which must cover the corpus as chunked by `config` and match its
+    embedding_model_name) and its query embedding cache from `queries`.
+    Returned chunks are scored as their parent documents.
+    """
+    from diet_rag.engine import DietRAGEngine, EmbeddingError
+
+    config = dataclasses.replace(
+        config, embedding_artifact=artifact_path, async_prefetch=False, precomputed_answers="",
+        chroma_persist_dir=None,
+        query_cache_max_entries=max(config.query_cache_max_entries, 2 * len(labeled)))
+    engine = DietRAGEngine(config, documents=documents, api=_OfflineAPI())
+    try:
+        engine.warm_up()
+        for (query, _), vector in zip(labeled, queries.tolist()):
+            engine.embedding_cache.put(query, QUERY_TASK_TYPE, vector)
+        chunked = config.chunked_retrieval and not config.chunk_parent_expansion
+        depth = config.chunk_n_results if chunked else config.n_results
+        condition_of = dict(engine.conditions)
+        stored = engine.vector_store.get_metadatas()
+        latencies, ranked, fast = [], [], 0
+        for query, _ in labeled:
+            start = time.perf_counter()
+            result = engine.retrieve(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            doc_ids = _ranked_documents(result['ids'],
+                                        [stored.get(doc_id) for doc_id in result['ids']], depth)
+            ranked.append([condition_of.get(doc_id) for doc_id in doc_ids])
+            fast += result['embedding'] is None
+    except EmbeddingError as e:
+        raise EvaluationError(str(e)) from e
+    finally:
+        engine.close()
+    labels = Labels(condition_of.values(), [condition for _, condition in labeled])
+    report = ranking_metrics(labels.relevance(ranked, depth), labels.counts(condition_of.values()),
+                             ks)
+    report.update(_latency_summary(latencies), depth=depth, fast_path=fast)
+    return report
+
+
+def _query_embedder(model_name, dimension):
+    """Embeds queries with `model_name` (the artifact's); None if that needs an absent API key."""
+    if model_name == FAKE_EMBEDDING_MODEL_NAME:
+        from diet_rag.ingest import FakeEmbedder
+        return FakeEmbedder(dimension=dimension)
+    if not os.environ.get("GOOGLE_API_KEY"):
+        return None
+    import google.generativeai as genai
+    from diet_rag.ingest import gemini_batch_embedder
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    return gemini_batch_embedder(model_name, task_type=QUERY_TASK_TYPE, api=genai)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency offline")
+    parser.add_argument("--artifact", default=None,
+                        help="embedding artifact path; defaults to EMBEDDING_ARTIFACT")
+    parser.add_argument("--queries", default=EVAL_QUERIES, help="labeled query -> condition JSONL")
+    parser.add_argument("--source", help="JSON/JSONL knowledge base file or directory "
+                                         "(diet_data_format.txt layout); defaults to DIET_DOCUMENTS")
+    parser.add_argument("--k", default=",".join(map(str, DEFAULT_KS)), help="cutoffs, e.g. 1,2,5")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--pipeline", action="store_true",
+                        help="also evaluate DietRAGEngine.retrieve with the configured settings")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    from diet_rag import artifact as artifacts
+    from diet_rag.config import EngineConfig
+    config = EngineConfig.from_mapping(env=os.environ)
+    path = args.artifact or config.embedding_artifact
+    ks = tuple(sorted({int(k) for k in args.k.split(",")}))
+    try:
+        artifact = artifacts.load_artifact(path)
+        labeled = load_queries(args.queries)
+        dimension = artifact.matrix.shape[1]
+        queries = query_matrix([query for query, _ in labeled], path + QUERY_CACHE_SUFFIX,
+                               artifact.model_name,
+                               _query_embedder(artifact.model_name, dimension))
+        if queries.shape[1] != dimension:
+            raise EvaluationError(f"Query embeddings have {queries.shape[1]} dimensions, "
+                                  f"the artifact {dimension}")
+        labels = Labels([metadata['condition'] for metadata in artifact.metadatas],
+                        [condition for _, condition in labeled])
+        results = {name: evaluate_backend(name, artifact, queries, labels, max(ks), ks)
+                   for name in args.backends.split(",") if name}
+        if args.pipeline:
+            from diet_rag.kb import KnowledgeBase
+            if args.source:
+                knowledge = KnowledgeBase(source=args.source)
+            else:
+                from diet_data import DIET_DOCUMENTS
+                knowledge = KnowledgeBase(documents=DIET_DOCUMENTS)
+            config = dataclasses.replace(config, embedding_model_name=artifact.model_name)
+            results['pipeline'] = evaluate_pipeline(config, list(knowledge), path, labeled,
+                                                    queries, ks)
+    except (artifacts.ArtifactError, EvaluationError) as e:
+        parser.exit(1, f"{parser.prog}: error: {e}\n")
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+        return
+    print(f"{len(labeled)} labeled queries over {len(labels.conditions)} conditions; "
+          f"{path}: {len(artifact)} x {dimension}, model {artifact.model_name}")
+    columns = [f"recall@{k}" for k in ks] + [f"ndcg@{k}" for k in ks] + ["mrr"]
+    print(f"{'':10}" + "".join(f"{column:>10}" for column in columns)
+          + f"{'p50 ms':>9}{'p95 ms':>9}")
+    for name, report in results.items():
+        note = ""
+        if 'batch_ms' in report:
+            note = f"  batch {report['batch_ms']:.1f} ms"
+        elif 'depth' in report:
+            note = (f"  {report['depth']} retrieved, {report['fast_path']}/{len(labeled)} "
+                    f"without vector search")
+        print(f"{name:10}" + "".join(f"{report[column]:10.3f}" for column in columns)
+              + f"{report['p50_ms']:9.3f}{report['p95_ms']:9.3f}{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# diet_rag/history.py
+
+# Token-budgeted conversation history for follow-up prompts. Recent turns are
+# kept verbatim up to a token budget; older turns are folded into a rolling
+# summary that is extended incrementally (never recomputed from scratch), and
+# UI placeholder turns such as "(Decision made)" are dropped.
+
+import math
+import re
+
+PLACEHOLDER_USER_MESSAGES = ("(Decision made)",)
+DEFAULT_HISTORY_TOKEN_BUDGET = 800
+DEFAULT_SUMMARY_TOKEN_BUDGET = 200
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+
+def _piece_tokens(piece):
+    return math.ceil(len(piece) / 4) if piece[0].isalnum() or piece[0] == "_" else 1
+
+
+def count_tokens(text):
+    """Estimates the token count locally (no API call).
+
+    Words are counted as roughly one token per 4 characters (as SentencePiece
+    splits long words) and every punctuation mark as one token.
+    """
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in _TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts text to at most `max_tokens` estimated tokens, marking the cut with an ellipsis."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    for match in _TOKEN_RE.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            return text[:match.start()].rstrip() + " ..."
+    return text
+
+
+def format_turn(user_msg, ai_msg):
+    return f"User: {user_msg}\nAI: {ai_msg}"
+
+
+def is_placeholder_turn(user_msg, ai_msg):
+    return not user_msg or not ai_msg or user_msg in PLACEHOLDER_USER_MESSAGES
+
+
+def _first_sentence(text):
+    text = " ".join(str(text).split())
+    return _SENTENCE_END_RE.split(text, maxsplit=1)[0]
+
+
+def extractive_summary(previous_summary, turns, max_tokens=DEFAULT_SUMMARY_TOKEN_BUDGET):
+    """Extends a rolling summary with new turns without calling the model.
+
+    Each turn contributes one line (the user's message and the first sentence
+    of the reply); when over budget the oldest lines are dropped first.
+    """
+    lines = previous_summary.splitlines() if previous_summary else []
+    for user_msg, ai_msg in turns:
+        lines.append(f"- User asked: {truncate_to_tokens(user_msg, 40)} "
+                     f"| AI said: {truncate_to_tokens(_first_sentence(ai_msg), 40)}")
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+def new_summary_state():
+    """State cached per session: the rolling summary and how many turns it covers."""
+    return {'summary': "", 'covered': 0}
+
+
+def compact_history(chat_history, summary_state, budget_tokens=DEFAULT_HISTORY_TOKEN_BUDGET,
+                    summary_tokens=DEFAULT_SUMMARY_TOKEN_BUDGET, summarize_fn=extractive_summary):
+    """Fits conversation history into a token budget.
+
+    `chat_history` is the app's list of (user, ai) tuples. `summary_state`
+    (from `new_summary_state`) is updated in place: only turns that newly fell
+    out of the verbatim window are passed to `summarize_fn(previous, turns,
+    max_tokens)`. Returns (summary, recent_turns) where recent_turns is a list
+    of {"user", "ai"} dicts whose formatted size fits the remaining budget.
+    """
+    turns = [(u, a) for u, a in chat_history if not is_placeholder_turn(u, a)]
+    recent_budget = max(1, budget_tokens - summary_tokens)
+
+    kept = 0
+    used = 0
+    for user_msg, ai_msg in reversed(turns):
+        cost = count_tokens(format_turn(user_msg, ai_msg))
+        if kept and used + cost > recent_budget:
+            break
+        used += cost
+        kept += 1
+
+    # The summarized prefix only ever grows, so each turn is summarized once
+    older_count = max(summary_state['covered'], len(turns) - kept)
+    newly_older = turns[summary_state['covered']:older_count]
+    if newly_older:
+        summary_state['summary'] = summarize_fn(summary_state['summary'], newly_older, summary_tokens)
+        summary_state['covered'] = older_count
+
+    recent = []
+    for user_msg, ai_msg in turns[older_count:]:
+        if count_tokens(format_turn(user_msg, ai_msg)) > recent_budget:
+            ai_msg = truncate_to_tokens(ai_msg, max(1, recent_budget - count_tokens(user_msg) - 4))
+        recent.append({"user": user_msg, "ai": ai_msg})
+    return summary_state['summary'], recent
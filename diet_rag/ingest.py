@@ -0,0 +1,231 @@
+# diet_rag/ingest.py
+
+# Ingestion pipeline: embeds knowledge base documents in batches, with a bounded
+# number of requests in flight and adaptive backoff when the API rate-limits us.
+# Kept free of Streamlit so it can be reused and benchmarked outside the app.
+
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = 'models/text-embedding-004'
+DEFAULT_BATCH_SIZE = 50  # The API accepts up to 100 texts per batch request
+DEFAULT_MAX_WORKERS = 4
+# Extra document fields copied into metadata when present (set by diet_rag.chunking)
+CHUNK_METADATA_KEYS = ("parent_id", "section")
+
+
+class RateLimitError(Exception):
+    """Raised by embedders when the backend signals a rate limit (HTTP 429)."""
+
+
+def is_rate_limit_error(error):
+    """Returns True if the exception looks like a rate-limit / quota error."""
+    if isinstance(error, RateLimitError):
+        return True
+    if getattr(error, 'code', None) == 429:
+        return True
+    return type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+def document_to_embedding_text(doc_data):
+    """Builds the text that gets embedded for a knowledge base document."""
+    return f"Condition: {doc_data['condition']}\nDetails: {doc_data['text']}"
+
+
+# --- Embedders ---
+# An embedder is any callable taking a list of texts and returning a list of
+# embeddings (one per text, same order).
+
+def gemini_batch_embedder(model_name=EMBEDDING_MODEL_NAME, task_type="retrieval_document", api=None):
+    """Returns an embedder that sends one batch request to the Gemini API per call.
+
+    `api` defaults to google.generativeai; pass a diet_rag.stubs.StubGemini to run offline.
+    """
+    if api is None:
+        import google.generativeai as api
+
+    def embed(texts):
+        result = api.embed_content(model=model_name,
+                                   content=list(texts),
+                                   task_type=task_type)
+        return result['embedding']
+
+    return embed
+
+
+# Model name recorded for FakeEmbedder vectors, so they never pass for real ones
+FAKE_EMBEDDING_MODEL_NAME = "fake-embedder"
+
+
+class FakeEmbedder:
+    """Deterministic offline embedder for benchmarks and local runs.
+
+    Produces pseudo-random unit vectors seeded from the text, sleeps `latency`
+    seconds per call (plus `per_item_latency` per text) and can simulate rate
+    limits with probability `rate_limit_prob`.
+    """
+
+    def __init__(self, dimension=768, latency=0.0, per_item_latency=0.0,
+                 rate_limit_prob=0.0, seed=0):
+        self.dimension = dimension
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.rate_limit_prob = rate_limit_prob
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.texts_embedded = 0
+        self.rate_limited = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def embed_one(self, text):
+        """Returns the deterministic embedding (float32 unit vector) for a single text."""
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+        vector = rng.standard_normal(self.dimension, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def __call__(self, texts):
+        texts = list(texts)
+        with self._lock:
+            self.calls += 1
+            limited = self._rng.random() < self.rate_limit_prob
+            if limited:
+                self.rate_limited += 1
+        if self.latency or self.per_item_latency:
+            time.sleep(self.latency + self.per_item_latency * len(texts))
+        if limited:
+            raise RateLimitError("429 Resource has been exhausted (simulated)")
+        with self._lock:
+            self.texts_embedded += len(texts)
+        return [self.embed_one(text) for text in texts]
+
+
+# --- Adaptive backoff ---
+
+class AdaptiveBackoff:
+    """Shared delay that grows on rate limits and decays on success.
+
+    All workers consult the same instance, so one 429 slows every in-flight
+    worker down instead of each one discovering the limit on its own.
+    """
+
+    def __init__(self, initial_delay=0.5, max_delay=30.0, decay=0.5):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.decay = decay
+        self.delay = 0.0
+        self.rate_limits = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Sleeps for the current delay (with jitter) before issuing a request."""
+        with self._lock:
+            delay = self.delay
+        if delay > 0:
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def on_success(self):
+        with self._lock:
+            self.delay *= self.decay
+            if self.delay < self.initial_delay / 4:
+                self.delay = 0.0
+
+    def on_rate_limit(self):
+        with self._lock:
+            self.rate_limits += 1
+            self.delay = min(self.max_delay,
+                             max(self.initial_delay, self.delay * 2))
+
+
+# --- Pipeline ---
+
+def _batched(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield start, items[start:start + batch_size]
+
+
+def _embed_batch(embed_fn, texts, backoff, max_retries):
+    """Embeds one batch, retrying only on rate-limit errors."""
+    attempt = 0
+    while True:
+        backoff.wait()
+        try:
+            embeddings = embed_fn(texts)
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= max_retries:
+                raise
+            attempt += 1
+            backoff.on_rate_limit()
+            continue
+        backoff.on_success()
+        if len(embeddings) != len(texts):
+            raise ValueError(
+                f"Embedder returned {len(embeddings)} embeddings for {len(texts)} texts")
+        return embeddings
+
+
+def embed_documents(documents, embed_fn=None, batch_size=DEFAULT_BATCH_SIZE,
+                    max_workers=DEFAULT_MAX_WORKERS, max_retries=6,
+                    progress_callback=None, backoff=None):
+    """Embeds knowledge base documents in concurrent batches.
+
+    Returns (ids, texts, metadatas, embeddings) ready for `collection.add`.
+    `progress_callback(done, total)` is called from the calling thread after
+    each batch completes, so it is safe to update Streamlit elements from it.
+    Documents with an empty embedding are skipped; any other failure is raised.
+    """
+    documents = list(documents)
+    if embed_fn is None:
+        embed_fn = gemini_batch_embedder()
+    if backoff is None:
+        backoff = AdaptiveBackoff()
+
+    total = len(documents)
+    texts = [document_to_embedding_text(doc) for doc in documents]
+    embeddings = [None] * total
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(_embed_batch, embed_fn, batch, backoff, max_retries): (start, len(batch))
+            for start, batch in _batched(texts, batch_size)
+        }
+        try:
+            for future in as_completed(futures):
+                start, size = futures[future]
+                embeddings[start:start + size] = future.result()
+                done += size
+                if progress_callback:
+                    progress_callback(done, total)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    doc_ids, doc_texts, doc_metadatas, doc_embeddings = [], [], [], []
+    for doc_data, embedding in zip(documents, embeddings):
+        if embedding is None or not len(embedding):
+            continue
+        doc_ids.append(doc_data['id'])
+        doc_texts.append(doc_data['text'])
+        metadata = {"condition": doc_data['condition']}
+        for key in CHUNK_METADATA_KEYS:
+            if key in doc_data:
+                metadata[key] = doc_data[key]
+        doc_metadatas.append(metadata)
+        doc_embeddings.append(embedding)
+    return doc_ids, doc_texts, doc_metadatas, doc_embeddings
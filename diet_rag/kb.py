@@ -0,0 +1,222 @@
+# diet_rag/kb.py
+
+# Knowledge base loading. Documents are streamed from a JSON array file (the
+# diet_data_format.txt layout), a JSONL file, or a directory tree of such files
+# (or taken from an in-memory list like DIET_DOCUMENTS), validated and
+# deduplicated on the fly, and handed to ingestion in batches. Only ids,
+# condition names and content digests are kept across the stream, so memory
+# stays bounded by the batch size rather than the corpus size.
+
+import hashlib
+import json
+import os
+
+DEFAULT_LOAD_BATCH_SIZE = 500
+REQUIRED_FIELDS = ("id", "condition", "text")
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+DIRECTORY_SUFFIXES = (".json", ".jsonl", ".ndjson")
+MAX_REPORTED_ERRORS = 20
+_READ_CHUNK_CHARS = 1 << 16
+
+
+class KnowledgeBaseError(ValueError):
+    """The knowledge base source is missing or cannot be parsed."""
+
+
+class LoadReport:
+    """What a full pass over the knowledge base kept and dropped."""
+
+    def __init__(self):
+        self.documents = 0
+        self.invalid = 0
+        self.duplicate_ids = 0
+        self.duplicate_content = 0
+        self.errors = []
+
+    @property
+    def dropped(self):
+        return self.invalid + self.duplicate_ids + self.duplicate_content
+
+    def note(self, counter, message):
+        setattr(self, counter, getattr(self, counter) + 1)
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def to_dict(self):
+        return {'documents': self.documents, 'invalid': self.invalid,
+                'duplicate_ids': self.duplicate_ids,
+                'duplicate_content': self.duplicate_content, 'errors': list(self.errors)}
+
+
+def validate_document(doc_data):
+    """Returns why `doc_data` is not a usable document, or None if it is."""
+    if not isinstance(doc_data, dict):
+        return f"expected an object, got {type(doc_data).__name__}"
+    for field in REQUIRED_FIELDS:
+        value = doc_data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return f"missing or empty '{field}'"
+    return None
+
+
+def _content_digest(doc_data):
+    normalized = " ".join(doc_data['condition'].lower().split()) + "\x00" + doc_data['text'].strip()
+    return hashlib.sha1(normalized.encode('utf-8')).digest()
+
+
+def _iter_json_array(f, location):
+    """Yields the elements of a top-level JSON array without reading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        more = f.read(_READ_CHUNK_CHARS)
+        eof = not more
+        buffer, pos = buffer[pos:] + more, 0
+        return not eof
+
+    def next_char(skip):
+        """Skips whitespace (and the `skip` characters); returns the next character or ''."""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in skip):
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return buffer[pos] if pos < len(buffer) else ""
+
+    first = next_char("")
+    if first == "{":  # A single document object
+        try:
+            yield json.loads(buffer[pos:] + f.read())
+        except ValueError as e:
+            raise KnowledgeBaseError(f"{location}: invalid JSON ({e})") from e
+        return
+    if first != "[":
+        raise KnowledgeBaseError(f"{location}: expected a JSON array of documents")
+    pos += 1
+    while True:
+        char = next_char(",")
+        if char == "]":
+            return
+        if char == "":
+            raise KnowledgeBaseError(f"{location}: unexpected end of file")
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except ValueError as e:
+            if fill():
+                continue
+            raise KnowledgeBaseError(f"{location}: invalid JSON ({e})") from e
+        pos = end
+        yield element
+
+
+def _iter_file(path):
+    """Yields (location, parsed element or ValueError) for every entry in one file."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            if path.lower().endswith(JSONL_SUFFIXES):
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield f"{path}:{line_number}", json.loads(line)
+                    except ValueError as e:
+                        yield f"{path}:{line_number}", e
+            else:
+                for index, element in enumerate(_iter_json_array(f, path)):
+                    yield f"{path}[{index}]", element
+    except OSError as e:
+        raise KnowledgeBaseError(f"Cannot read knowledge base file {path!r}: {e}") from e
+
+
+def _source_files(source):
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(DIRECTORY_SUFFIXES):
+                    yield os.path.join(root, name)
+    elif os.path.exists(source):
+        yield source
+    else:
+        raise KnowledgeBaseError(f"Knowledge base not found: {source!r}")
+
+
+class KnowledgeBase:
+    """A streamed, validated and deduplicated knowledge base.
+
+    `source` is a JSON/JSONL file or a directory tree of them; alternatively
+    pass `documents` (a list such as DIET_DOCUMENTS). Every complete pass
+    refreshes `report` (a LoadReport) and `conditions`, a condensed
+    id -> condition index for listings.
+    """
+
+    def __init__(self, source=None, documents=None):
+        if (source is None) == (documents is None):
+            raise ValueError("Pass exactly one of `source` or `documents`")
+        self.source = source
+        self._documents = list(documents) if documents is not None else None
+        self.report = None
+        self.conditions = None
+
+    @property
+    def size_hint(self):
+        """Document count if known up front (in-memory lists), else the last pass's count."""
+        if self._documents is not None:
+            return len(self._documents)
+        return self.report.documents if self.report else None
+
+    def _iter_raw(self):
+        if self._documents is not None:
+            for index, doc_data in enumerate(self._documents):
+                yield f"documents[{index}]", doc_data
+            return
+        for path in _source_files(self.source):
+            yield from _iter_file(path)
+
+    def __iter__(self):
+        return self.iter_documents()
+
+    def iter_documents(self):
+        """Yields valid documents, dropping invalid entries and duplicates (first one wins)."""
+        report = LoadReport()
+        conditions = {}
+        seen_content = set()
+        for location, doc_data in self._iter_raw():
+            if isinstance(doc_data, ValueError):
+                report.note('invalid', f"{location}: invalid JSON ({doc_data})")
+                continue
+            problem = validate_document(doc_data)
+            if problem:
+                report.note('invalid', f"{location}: {problem}")
+                continue
+            if doc_data['id'] in conditions:
+                report.note('duplicate_ids', f"{location}: duplicate id {doc_data['id']!r}")
+                continue
+            digest = _content_digest(doc_data)
+            if digest in seen_content:
+                report.note('duplicate_content', f"{location}: same content as an earlier document")
+                continue
+            seen_content.add(digest)
+            conditions[doc_data['id']] = doc_data['condition']
+            report.documents += 1
+            yield doc_data
+        self.report = report
+        self.conditions = conditions
+
+    def iter_batches(self, batch_size=DEFAULT_LOAD_BATCH_SIZE):
+        batch = []
+        for doc_data in self.iter_documents():
+            batch.append(doc_data)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def scan(self):
+        """Runs one pass (without keeping documents) to fill `report` and `conditions`."""
+        for _ in self.iter_documents():
+            pass
+        return self.report
@@ -0,0 +1,186 @@
+# diet_rag/lexical.py
+
+# Local BM25 index over the indexed document (or chunk) texts, built while the
+# knowledge base is streamed into the vector store. Exact term matches
+# ("GERD", "DASH", "iron", "sodium") are where embeddings are weakest, so the
+# engine fuses BM25 and vector rankings (reciprocal rank fusion) and, when the
+# lexical match is decisive, answers from it alone without an embedding call.
+
+import itertools
+import re
+import threading
+from array import array
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+    a about am an and any are as at be been but by can could did do does for from
+    get had has have having how i if in into is it its me my no not of on or our
+    should so some than that the their them then there these they this to too
+    up us very was we were what when which while who why will with would you your
+    diet diets eat eating food foods good help best advice suggest recommend
+    """.split())
+
+
+def normalize_term(term):
+    """Index form of a lower-cased term: '' for stopwords, a trailing plural 's' dropped."""
+    if term in STOPWORDS:
+        return ""
+    if len(term) > 4 and term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        return term[:-1]
+    return term
+
+
+def tokenize(text):
+    """Normalized terms of `text`, in order."""
+    return [term for term in map(normalize_term, TOKEN_PATTERN.findall(text.lower())) if term]
+
+
+class _Column:
+    """A growable 1-d array; appends are amortized O(1) and large buffers live outside the heap."""
+
+    def __init__(self, dtype, data=None):
+        self._data = np.empty(0, dtype=dtype) if data is None else data
+        self.size = len(self._data)
+
+    def extend(self, values):
+        needed = self.size + len(values)
+        if needed > len(self._data):
+            grown = np.empty(max(needed, 2 * len(self._data), 4096), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:needed] = values
+        self.size = needed
+
+    def view(self):
+        return self._data[:self.size]
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index.
+
+    Documents are added in batches (`add_many`), each tokenized into flat
+    arrays and counted with NumPy rather than term by term in Python. On the
+    first search (or `finalize`) the postings are sorted into CSR form: per
+    term a contiguous run of uint32 rows and uint16 term frequencies (6 bytes
+    per posting). A query costs one vectorized weight computation and
+    scatter-add per query term.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self._rows = {}
+        self._raw_ids = {}  # Raw token -> raw id
+        self._raw_terms = array('q')  # Raw id -> term id (-1 for stopwords)
+        self._vocabulary = {}  # Normalized term -> term id
+        # Postings in insertion order until finalized, then sorted by term
+        self._posting_rows = _Column(np.uint32)
+        self._posting_terms = _Column(np.uint32)  # None once finalized (see `_offsets`)
+        self._posting_tfs = _Column(np.uint16)
+        self._lengths = _Column(np.uint32)
+        self._offsets = None  # CSR offsets into the sorted postings, per term id
+        self._frozen = None  # (offsets, rows, term frequencies, length norms)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _term_ids(self, tokens):
+        """Maps raw tokens to term ids (-1 for stopwords), normalizing each distinct token once."""
+        raw_ids = self._raw_ids
+        ids = [raw_ids.setdefault(token, len(raw_ids)) for token in tokens]
+        for token in itertools.islice(raw_ids, len(self._raw_terms), None):
+            term = normalize_term(token)
+            self._raw_terms.append(
+                self._vocabulary.setdefault(term, len(self._vocabulary)) if term else -1)
+        return np.frombuffer(self._raw_terms, dtype=np.int64)[np.array(ids, dtype=np.int64)]
+
+    def add_many(self, ids, texts):
+        """Indexes documents; ids already indexed are ignored."""
+        new = [(doc_id, text) for doc_id, text in zip(ids, texts) if doc_id not in self._rows]
+        if not new:
+            return
+        with self._lock:
+            if self._posting_terms is None:  # Finalized: recover term ids from the offsets
+                self._posting_terms = _Column(np.uint32, np.repeat(
+                    np.arange(len(self._offsets) - 1, dtype=np.uint32), np.diff(self._offsets)))
+            tokens = [TOKEN_PATTERN.findall(text.lower()) for _, text in new]
+            terms = self._term_ids(itertools.chain.from_iterable(tokens))
+            docs = np.repeat(np.arange(len(new), dtype=np.int64), [len(doc) for doc in tokens])
+            keep = terms >= 0
+            pairs, counts = np.unique((docs[keep] << 32) | terms[keep], return_counts=True)
+            self._posting_rows.extend((pairs >> 32) + len(self.ids))
+            self._posting_terms.extend(pairs & 0xFFFFFFFF)
+            self._posting_tfs.extend(np.minimum(counts, 0xFFFF))
+            self._lengths.extend(np.bincount(docs[keep], minlength=len(new)))
+            for doc_id, _ in new:
+                self._rows[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+            self._frozen = None
+
+    def add(self, doc_id, text):
+        self.add_many([doc_id], [text])
+
+    def finalize(self):
+        """Sorts the postings into CSR form; called automatically by `search`."""
+        with self._lock:
+            if self._frozen is not None:
+                return
+            if self._posting_terms is not None:
+                terms = self._posting_terms.view()
+                order = np.argsort(terms, kind='stable')  # Stable: each term's rows stay ascending
+                self._offsets = np.zeros(len(self._vocabulary) + 1, dtype=np.int64)
+                np.cumsum(np.bincount(terms, minlength=len(self._vocabulary)),
+                          out=self._offsets[1:])
+                self._posting_rows = _Column(np.uint32, self._posting_rows.view()[order])
+                self._posting_tfs = _Column(np.uint16, self._posting_tfs.view()[order])
+                self._posting_terms = None
+                del order, terms
+            lengths = self._lengths.view()
+            average = float(lengths.mean()) if len(lengths) else 0.0
+            norms = (self.k1 * (1 - self.b + self.b * lengths / (average or 1.0))).astype(np.float32)
+            self._frozen = (self._offsets, self._posting_rows.view(),
+                            self._posting_tfs.view(), norms)
+
+    def search(self, query, k=10):
+        """Returns {'ids', 'scores', 'coverage'} for the k best documents, best first.
+
+        `coverage` is the share of the query's terms each hit contains
+        (terms unknown to the index count as missing).
+        """
+        terms = set(tokenize(query))
+        if self._frozen is None:
+            self.finalize()
+        offsets, rows, tfs, norms = self._frozen
+        matched = [self._vocabulary[term] for term in terms if term in self._vocabulary]
+        if not matched or k <= 0:
+            return {'ids': [], 'scores': [], 'coverage': []}
+        total = len(self.ids)
+        scores = np.zeros(total, dtype=np.float32)
+        hits = np.zeros(total, dtype=np.int32)
+        for term_id in matched:
+            start, end = offsets[term_id], offsets[term_id + 1]
+            term_rows, tf = rows[start:end], tfs[start:end].astype(np.float32)
+            idf = np.log(1 + (total - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            scores[term_rows] += idf * tf * (self.k1 + 1) / (tf + norms[term_rows])
+            hits[term_rows] += 1
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], len(candidates) - k)[-k:]]
+        order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return {'ids': [self.ids[row] for row in order],
+                'scores': scores[order].tolist(),
+                'coverage': (hits[order] / len(terms)).tolist()}
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses ranked id lists: score(id) = sum of 1 / (k + rank). Earlier lists win ties."""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    # sorted() is stable, so ties keep first-seen order
+    return sorted(fused, key=fused.get, reverse=True)
@@ -0,0 +1,226 @@
+# diet_rag/metrics.py
+
+# Hot-path instrumentation for the engine: per-stage latency histograms,
+# counters (tokens, retries, cache lookups, errors) and per-request traces.
+# Exported as Prometheus text (MetricsRegistry.render) and as one structured
+# JSON log line per request on the "diet_rag.requests" logger. Standard
+# library only; every process (Streamlit server, API worker) has its own registry.
+
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+
+REQUEST_LOGGER = logging.getLogger("diet_rag.requests")
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace = contextvars.ContextVar("diet_rag_trace", default=None)
+
+
+def current_trace():
+    """The RequestTrace active in this context, or None."""
+    return _current_trace.get()
+
+
+def enable_json_logs(stream=None):
+    """Writes request traces as JSON lines to `stream` (stderr by default); idempotent."""
+    if not any(getattr(handler, '_diet_rag_json', False) for handler in REQUEST_LOGGER.handlers):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._diet_rag_json = True
+        REQUEST_LOGGER.addHandler(handler)
+    REQUEST_LOGGER.setLevel(logging.INFO)
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class RequestTrace:
+    """Breakdown of one user request: stage timings, tokens, cache use, retries, errors."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = time.time()
+        self.duration_ms = None
+        self.stages = {}
+        self.tokens = {}
+        self.cache = {}
+        self.retries = 0
+        self.errors = []
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000
+
+    def add(self, field, key, amount=1):
+        counts = getattr(self, field)
+        counts[key] = counts.get(key, 0) + amount
+
+    def to_dict(self):
+        return {
+            'request': self.kind,
+            'timestamp': self.started,
+            'duration_ms': self.duration_ms,
+            'stages_ms': {stage: round(ms, 3) for stage, ms in self.stages.items()},
+            'tokens': self.tokens,
+            'cache': self.cache,
+            'retries': self.retries,
+            'errors': self.errors,
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe counters and latency histograms with Prometheus text export.
+
+    Metric names are given without the `prefix`. `collectors` are callables
+    returning extra (name, type, help, [(labels, value), ...]) families at
+    render time, e.g. cache statistics kept elsewhere.
+    """
+
+    def __init__(self, prefix="diet_rag", buckets=LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self._help = {}
+        self.collectors = []
+        self.last_trace = None
+
+    def inc(self, name, labels=None, amount=1, help=""):
+        key = _label_key(labels)
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=None, help=""):
+        key = _label_key(labels)
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += seconds
+            state[-1] += 1
+
+    def observe_stage(self, stage, seconds, trace=None):
+        """Records a stage duration in the histogram and the (given or current) trace."""
+        self.observe("stage_seconds", seconds, {'stage': stage},
+                     help="Duration of each pipeline stage")
+        trace = trace or current_trace()
+        if trace is not None:
+            trace.add_stage(stage, seconds)
+
+    def record_error(self, stage, error, trace=None):
+        self.inc("errors_total", {'stage': stage, 'error': type(error).__name__},
+                 help="Failed pipeline stages by exception type")
+        trace = trace or current_trace()
+        if trace is not None:
+            trace.errors.append({'stage': stage, 'error': type(error).__name__,
+                                 'message': str(error)[:200]})
+
+    def record_retries(self, stage, count=1, trace=None):
+        self.inc("retries_total", {'stage': stage}, count, help="Retried API calls by stage")
+        trace = trace or current_trace()
+        if trace is not None:
+            trace.retries += count
+
+    def record_tokens(self, kind, count, trace=None):
+        self.inc("tokens_total", {'kind': kind}, count,
+                 help="Prompt, cached prompt and output tokens (API usage metadata, else estimated)")
+        trace = trace or current_trace()
+        if trace is not None:
+            trace.add('tokens', kind, count)
+
+    def record_cache(self, cache, hit, trace=None):
+        trace = trace or current_trace()
+        if trace is not None:
+            trace.add('cache', f"{cache}_{'hit' if hit else 'miss'}")
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Times the block as `stage`; errors are counted and re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record_error(stage, e)
+            raise
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def trace(self, kind):
+        """Collects everything recorded in the block into a RequestTrace.
+
+        On exit the request's latency is observed, the trace is logged as a
+        JSON line and kept as `last_trace`.
+        """
+        request = RequestTrace(kind)
+        token = _current_trace.set(request)
+        start = time.perf_counter()
+        try:
+            yield request
+        except Exception as e:
+            request.errors.append({'stage': 'request', 'error': type(e).__name__,
+                                   'message': str(e)[:200]})
+            raise
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - start
+            request.duration_ms = elapsed * 1000
+            self.observe("request_seconds", elapsed, {'request': kind},
+                         help="End-to-end duration of each request")
+            self.inc("requests_total", {'request': kind, 'status': 'error' if request.errors else 'ok'},
+                     help="Requests by kind and status")
+            self.last_trace = request
+            if REQUEST_LOGGER.isEnabledFor(logging.INFO):
+                REQUEST_LOGGER.info(json.dumps(request.to_dict()))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: list(state) for key, state in series.items()}
+                          for name, series in self._histograms.items()}
+        for name, series in sorted(counters.items()):
+            full = f"{self.prefix}_{name}"
+            lines += [f"# HELP {full} {self._help.get(name, '')}", f"# TYPE {full} counter"]
+            lines += [f"{full}{_format_labels(key)} {value}" for key, value in sorted(series.items())]
+        for name, series in sorted(histograms.items()):
+            full = f"{self.prefix}_{name}"
+            lines += [f"# HELP {full} {self._help.get(name, '')}", f"# TYPE {full} histogram"]
+            for key, state in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    lines.append(f"{full}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{full}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+                lines.append(f"{full}_sum{_format_labels(key)} {state[-2]}")
+                lines.append(f"{full}_count{_format_labels(key)} {state[-1]}")
+        for collect in self.collectors:
+            for name, kind, help, samples in collect():
+                full = f"{self.prefix}_{name}"
+                lines += [f"# HELP {full} {help}", f"# TYPE {full} {kind}"]
+                lines += [f"{full}{_format_labels(_label_key(labels))} {value}"
+                          for labels, value in samples]
+        return "\n".join(lines) + "\n"
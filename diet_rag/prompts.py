@@ -0,0 +1,176 @@
+# diet_rag/prompts.py
+
+# Prompt templates and canned replies shared by every client of the engine.
+# Each prompt is split into a static system instruction (persona, rules,
+# output format and a short example), identical for every request and so sent
+# as the model's system instruction and cacheable, and a small variable part
+# with the user's text and retrieved context. Templates are parsed once at
+# import time; rendering only joins the precomputed pieces.
+
+import string
+import textwrap
+
+from diet_rag.structured import JSON_GENERATION_CONFIG
+
+BLOCKED_INITIAL_MESSAGE = "I apologize, but I can't provide a response to that specific request due to safety guidelines. Could you perhaps rephrase or ask about a different aspect? After responding, ask: Do you want to discuss further details about your problem?"
+BLOCKED_FOLLOW_UP_MESSAGE = "I apologize, but I can't provide a response to that specific request due to safety guidelines. Could you perhaps rephrase or ask about a different aspect? After responding, ask: Do you want to continue discussing?"
+ERROR_INITIAL_MESSAGE = "Sorry, I encountered an error. Please try again. Do you want to discuss further details about your problem?"
+ERROR_FOLLOW_UP_MESSAGE = "Sorry, I had trouble processing that. Do you want to try asking differently? Do you want to continue discussing?"
+NO_CONTEXT = "No specific context found."
+
+
+class PromptTemplate:
+    """A static system instruction plus a variable part compiled from a format string.
+
+    `render(**fields)` fills the variable part only; `inline(**fields)` returns
+    both as one prompt, for models that take no system instruction.
+    `generation_config`, if set, is sent with every request using the template.
+    """
+
+    def __init__(self, name, system_instruction, template, generation_config=None):
+        self.name = name
+        self.generation_config = generation_config
+        self.system_instruction = textwrap.dedent(system_instruction).strip()
+        self._pieces = [(literal, field) for literal, field, _, _
+                        in string.Formatter().parse(textwrap.dedent(template).strip())]
+        self.fields = tuple(field for _, field in self._pieces if field is not None)
+
+    def render(self, **fields):
+        parts = []
+        for literal, field in self._pieces:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(fields[field]))
+        return "".join(parts)
+
+    def inline(self, **fields):
+        return f"{self.system_instruction}\n\n{self.render(**fields)}"
+
+
+INITIAL_PROMPT = PromptTemplate("initial", """
+    You are a friendly and helpful AI assistant acting like a personal diet planner. Your goal is to provide diet recommendations based *only* on the context information given with each request.
+
+    **Instructions:**
+    1. Carefully review the context information related to the user's problem.
+    2. If relevant context is found, synthesize the information to provide clear diet recommendations. List specific suggestions for:
+        * Fruits
+        * Vegetables
+        * Meats/Proteins
+        * Other relevant foods/tips
+        * Suggest 1-2 simple recipe ideas mentioned or inspired by the context.
+    3. If no relevant context is found, state that you couldn't find specific information for that exact condition, but offer general healthy eating tips. Do NOT invent recommendations.
+    4. Use a friendly, empathetic, family meal planner tone.
+    5. **Crucially:** After providing the recommendations/info, ALWAYS end your response by asking: "Do you want to discuss further details about your problem?"
+
+    **Example:**
+    User's problem: "I get heartburn after dinner"
+    Context: "Fruits: bananas, melons. Vegetables: green beans, broccoli. Proteins: skinless chicken, fish. Avoid: citrus, tomatoes, fried foods. Eat smaller meals, not close to bedtime."
+    Response:
+    I'm sorry to hear about the heartburn - a few changes can make evenings much more comfortable!
+    * **Fruits:** bananas and melons are gentle choices.
+    * **Vegetables:** green beans and broccoli.
+    * **Meats/Proteins:** skinless chicken or baked fish.
+    * **Other tips:** skip citrus, tomatoes and fried foods, eat smaller meals and finish dinner a few hours before bed.
+    * **Recipe idea:** baked fish with steamed green beans and a side of melon.
+    Do you want to discuss further details about your problem?
+    """, """
+    **User's Problem:** "{user_problem}"
+
+    **Context Information:**
+    ```
+    {context}
+    ```
+
+    **Your Response:**
+    """)
+
+FOLLOW_UP_PROMPT = PromptTemplate("follow_up", """
+    You are a friendly AI personal diet planner continuing a conversation.
+
+    Instructions:
+    1. Respond helpfully and conversationally to the user's latest input, keeping the initial problem and prior conversation in mind.
+    2. Provide additional details, clarification, or answer related questions, grounded in the context information where it is relevant. Prioritize safety and avoid giving specific medical advice - stick to general dietary patterns and suggestions based on common knowledge for the condition.
+    3. Keep the tone friendly and supportive.
+    4. **Crucially:** After your response, ALWAYS ask: "Do you want to continue discussing?"
+
+    **Example:**
+    Latest input: "what snacks are good?"
+    Response:
+    Great question! Based on your plan, try a banana with a spoon of almond butter, a small bowl of oatmeal, or veggie sticks with hummus - all gentle, filling options.
+    Do you want to continue discussing?
+    """, """
+    The user's initial problem was: "{initial_problem}"
+    Conversation History:
+    {history}
+
+    The user's latest input is: "{user_input}"
+
+    **Context Information:**
+    ```
+    {context}
+    ```
+
+    **Your Response:**
+    """)
+
+# Same request as INITIAL_PROMPT, answered as JSON (diet_rag.structured.RECOMMENDATION_SCHEMA)
+STRUCTURED_INITIAL_PROMPT = PromptTemplate("initial_structured", """
+    You are a friendly AI personal diet planner. Recommend a diet based *only* on the context information given with each request.
+
+    Answer with a JSON object:
+    - "summary": one or two empathetic sentences about the user's problem. If the context has nothing relevant, say you couldn't find specific information for that condition and leave the food lists empty; do NOT invent recommendations.
+    - "fruits", "vegetables", "proteins": short food names from the context.
+    - "tips": other relevant foods, foods to avoid and eating habits, each one short sentence.
+    - "recipes": 1-2 simple recipe ideas mentioned in or inspired by the context, each with a "name" and a one or two sentence "description".
+
+    **Example:**
+    User's problem: "I get heartburn after dinner"
+    Context: "Fruits: bananas, melons. Vegetables: green beans, broccoli. Proteins: skinless chicken, fish. Avoid: citrus, tomatoes, fried foods. Eat smaller meals, not close to bedtime."
+    Response:
+    {"summary":"I'm sorry to hear about the heartburn - a few changes can make evenings much more comfortable!","fruits":["bananas","melons"],"vegetables":["green beans","broccoli"],"proteins":["skinless chicken","baked fish"],"tips":["Skip citrus, tomatoes and fried foods.","Eat smaller meals and finish dinner a few hours before bed."],"recipes":[{"name":"Baked fish with green beans","description":"Bake a fish fillet with lemon-free herbs and serve with steamed green beans and melon."}]}
+    """, """
+    **User's Problem:** "{user_problem}"
+
+    **Context Information:**
+    ```
+    {context}
+    ```
+    """, generation_config=JSON_GENERATION_CONFIG)
+
+TEMPLATES = (INITIAL_PROMPT, FOLLOW_UP_PROMPT, STRUCTURED_INITIAL_PROMPT)
+
+
+def join_context(documents):
+    return "\n\n---\n\n".join(documents) if documents else NO_CONTEXT
+
+
+def initial_fields(user_problem, retrieved_docs):
+    """Variable fields of INITIAL_PROMPT."""
+    return {'user_problem': user_problem, 'context': join_context(retrieved_docs)}
+
+
+def follow_up_fields(initial_problem, conversation_history, user_input,
+                     context_docs=None, history_summary=None):
+    """Variable fields of FOLLOW_UP_PROMPT.
+
+    `conversation_history` is a list of {"user", "ai"} dicts; `history_summary`
+    summarizes turns older than those.
+    """
+    history_str = "\n".join(
+        [f"User: {turn['user']}\nAI: {turn['ai']}" for turn in conversation_history])
+    if history_summary:
+        history_str = f"(Summary of earlier turns)\n{history_summary}\n\n{history_str}"
+    return {'initial_problem': initial_problem, 'history': history_str,
+            'user_input': user_input, 'context': join_context(context_docs)}
+
+
+def build_initial_prompt(user_problem, retrieved_docs):
+    """The full single-string prompt for the first diet recommendation."""
+    return INITIAL_PROMPT.inline(**initial_fields(user_problem, retrieved_docs))
+
+
+def build_follow_up_prompt(initial_problem, conversation_history, user_input,
+                           context_docs=None, history_summary=None):
+    """The full single-string prompt for a follow-up turn."""
+    return FOLLOW_UP_PROMPT.inline(**follow_up_fields(
+        initial_problem, conversation_history, user_input, context_docs, history_summary))
@@ -0,0 +1,484 @@
+# diet_rag/resilience.py
+
+# Resilient wrapper around the Gemini API (google.generativeai or a
+# diet_rag.stubs.StubGemini). Every embed / generate call goes through one
+# shared ResilientGemini, which adds:
+#   - retries of transient failures (429, 5xx, timeouts) with jittered
+#     exponential backoff, bounded by a per-call deadline
+#   - optional hedging: a duplicate embedding request when the first one is
+#     slower than `hedge_delay`, first answer wins
+#   - a circuit breaker per operation, so a failing API is not hammered and
+#     callers fail fast while it recovers
+#   - a process-wide limit on calls in flight, shared by every session
+# The wrapper mirrors the API's call shapes, so embedders, async adapters and
+# the engine use it exactly like the module it wraps.
+
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from diet_rag.ingest import is_rate_limit_error
+
+# HTTP status codes and exception names worth retrying
+RETRYABLE_CODES = (408, 429, 500, 502, 503, 504)
+RETRYABLE_ERRORS = ("DeadlineExceeded", "ServiceUnavailable", "InternalServerError",
+                    "TooManyRequests", "ResourceExhausted", "GatewayTimeout")
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open: recent calls failed, so this one was not attempted."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """A call (with its retries) did not finish within its deadline."""
+
+
+class ConcurrencyLimitError(TimeoutError):
+    """No slot for another call in flight became free within the deadline."""
+
+
+def is_retryable_error(error):
+    """True for transient failures: rate limits, server errors, timeouts, dropped connections."""
+    # Checked first: ConcurrencyLimitError is a TimeoutError but says nothing about the API
+    if isinstance(error, (CircuitOpenError, ConcurrencyLimitError)):
+        return False
+    if is_rate_limit_error(error) or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if getattr(error, 'code', None) in RETRYABLE_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n waits U(0, min(max_delay, initial * 2^n))."""
+
+    def __init__(self, max_attempts=4, initial_delay=0.25, max_delay=8.0, multiplier=2.0,
+                 rng=None):
+        self.max_attempts = max(1, max_attempts)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self._rng = rng or random.Random()
+
+    def delay(self, attempt):
+        """Seconds to wait after failed attempt number `attempt` (0-based)."""
+        cap = min(self.max_delay, self.initial_delay * self.multiplier ** attempt)
+        return self._rng.uniform(0, cap)
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures -> half-open after `reset_timeout`.
+
+    While open, calls fail fast with CircuitOpenError. In the half-open state
+    a single trial call is let through: success closes the circuit, failure
+    opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.opened = 0  # Times the circuit opened
+        self.rejected = 0  # Calls failed fast while open
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Raises CircuitOpenError unless a call may proceed."""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self.reset_timeout - (self._clock() - self._opened_at)
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Gemini {self.name} calls are failing; "
+                                           f"retrying in {remaining:.0f}s")
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Gemini {self.name} is recovering; trial call in flight")
+                self._trial_in_flight = True
+
+    def on_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def on_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or (
+                    self.failure_threshold and self._failures >= self.failure_threshold):
+                if self._state != self.OPEN:
+                    self.opened += 1
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def on_other(self):
+        """The call ended with a non-transient error (e.g. a bad request) or was never
+        made (deadline, no free slot, cancelled): frees any trial slot without an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class ConcurrencyLimiter:
+    """A counting semaphore that also tracks how many calls are in flight and the peak."""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self._semaphore = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    def acquire(self, timeout=None):
+        """Blocks for a slot up to `timeout` seconds (None waits forever); returns True if acquired."""
+        if self._semaphore is not None and not self._semaphore.acquire(
+                timeout=None if timeout is None else max(0.0, timeout)):
+            return False
+        return self._enter()
+
+    def try_acquire(self):
+        """Takes a slot only if one is free right now."""
+        if self._semaphore is not None and not self._semaphore.acquire(blocking=False):
+            return False
+        return self._enter()
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+class ResilientGemini:
+    """Drop-in wrapper for the Gemini API module (see the module comment).
+
+    `deadline` bounds each call including its retries and waits for a free
+    slot; the remaining time is passed to the API as the request timeout.
+    `hedge_delay` > 0 enables hedging of embedding calls (generation is not
+    hedged, as a duplicate answer costs a full generation). Streamed answers
+    are retried only until the stream starts. `metrics` is an optional
+    diet_rag.metrics.MetricsRegistry for retry, hedge and circuit counters.
+    """
+
+    def __init__(self, api, max_attempts=4, deadline=30.0, hedge_delay=0.0, max_in_flight=16,
+                 failure_threshold=5, reset_timeout=30.0, retry_policy=None, metrics=None):
+        self.api = api
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_attempts)
+        self.limiter = ConcurrencyLimiter(max_in_flight)
+        self.breakers = {operation: CircuitBreaker(operation, failure_threshold, reset_timeout)
+                         for operation in ("embed", "generate")}
+        self.metrics = metrics
+        self._hedge_pool = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def __getattr__(self, name):  # configure(), list_models() etc. pass straight through
+        return getattr(self.api, name)
+
+    def _count(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def _remaining(self, deadline_at):
+        return None if deadline_at is None else deadline_at - time.monotonic()
+
+    def _check_deadline(self, deadline_at, operation):
+        remaining = self._remaining(deadline_at)
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError(f"Gemini {operation} call exceeded its "
+                                        f"{self.deadline:g}s deadline")
+        return remaining
+
+    def _with_timeout(self, kwargs, remaining):
+        if remaining is None or 'request_options' in kwargs:
+            return kwargs
+        return {**kwargs, 'request_options': {'timeout': remaining}}
+
+    def _on_retry(self, operation):
+        self._count('retries')
+        if self.metrics is not None:
+            self.metrics.record_retries(operation)
+
+    def _backoff(self, operation, attempt, error, deadline_at):
+        """Seconds to sleep before retrying, or re-raises `error` if no retry is possible."""
+        if not is_retryable_error(error) or attempt + 1 >= self.retry_policy.max_attempts:
+            raise error
+        delay = self.retry_policy.delay(attempt)
+        remaining = self._remaining(deadline_at)
+        if remaining is not None and delay >= remaining:
+            raise error  # The retry could not finish in time anyway
+        self._on_retry(operation)
+        return delay
+
+    def _record_outcome(self, breaker, error):
+        if error is None:
+            breaker.on_success()
+        elif is_retryable_error(error):
+            breaker.on_failure()
+            self._count('failures')
+        else:
+            breaker.on_other()
+
+    # --- Sync calls ---
+
+    def _call(self, operation, fn, args, kwargs, hedge=False):
+        """Runs `fn(*args, **kwargs)` with the breaker, limiter, deadline, retries and optional hedging."""
+        self._count('calls')
+        breaker = self.breakers[operation]
+        deadline_at = time.monotonic() + self.deadline if self.deadline else None
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                remaining = self._check_deadline(deadline_at, operation)
+                if not self.limiter.acquire(remaining):
+                    raise ConcurrencyLimitError(f"No free slot for a Gemini {operation} call "
+                                                f"within the {self.deadline:g}s deadline")
+            except BaseException:
+                breaker.on_other()
+                raise
+            error = None
+            try:
+                call_kwargs = self._with_timeout(kwargs, remaining)
+                if hedge and self.hedge_delay:
+                    return self._hedged(fn, args, call_kwargs, deadline_at, operation)
+                try:
+                    return fn(*args, **call_kwargs)
+                finally:
+                    self.limiter.release()
+            except Exception as e:
+                error = e
+            except BaseException as e:  # Cancelled or interrupted: no outcome to record
+                error = e
+                raise
+            finally:
+                self._record_outcome(breaker, error)
+            time.sleep(self._backoff(operation, attempt, error, deadline_at))
+            attempt += 1
+
+    def _hedge_executor(self):
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(
+                    max_workers=max(2, 2 * (self.limiter.max_in_flight or 8)),
+                    thread_name_prefix="gemini-hedge")
+            return self._hedge_pool
+
+    def _hedged(self, fn, args, kwargs, deadline_at, operation):
+        """One attempt as a primary request plus, if it is slow, a duplicate; first success wins.
+
+        Called holding one limiter slot, which the primary request releases when
+        it finishes; the hedge only starts if another slot is free right away.
+        """
+        def run():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.limiter.release()
+
+        executor = self._hedge_executor()
+        futures = [executor.submit(run)]
+        done, _ = wait(futures, timeout=self.hedge_delay)
+        if not done and self.limiter.try_acquire():
+            self._count('hedges')
+            if self.metrics is not None:
+                self.metrics.inc("hedged_requests_total", {'operation': operation},
+                                 help="Duplicate requests sent because the first was slow")
+            futures.append(executor.submit(run))
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, timeout=self._remaining(deadline_at),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceededError(f"Gemini {operation} call exceeded its "
+                                            f"{self.deadline:g}s deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def embed_content(self, **kwargs):
+        return self._call("embed", self.api.embed_content, (), kwargs, hedge=True)
+
+    def _call_bulk(self, fn, args, kwargs):
+        """Runs `fn` holding a limiter slot only: no breaker, deadline, retries or hedging."""
+        self._count('calls')
+        self.limiter.acquire()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.limiter.release()
+
+    @property
+    def bulk(self):
+        """The API as bulk ingestion should call it (see BulkGemini)."""
+        return BulkGemini(self)
+
+    def GenerativeModel(self, model_name=None, **kwargs):  # noqa: N802 - mirrors the genai API
+        return ResilientModel(self.api.GenerativeModel(model_name, **kwargs), self)
+
+    def wrap_model(self, model):
+        """Wraps an already created generative model."""
+        return model if isinstance(model, ResilientModel) else ResilientModel(model, self)
+
+    # --- Async calls ---
+
+    async def _call_async(self, operation, fn, args, kwargs, hedge=False):
+        self._count('calls')
+        breaker = self.breakers[operation]
+        deadline_at = time.monotonic() + self.deadline if self.deadline else None
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                remaining = self._check_deadline(deadline_at, operation)
+                # Waiting for the shared (thread) semaphore must not block the event loop
+                if not self.limiter.try_acquire() and not await asyncio.to_thread(
+                        self.limiter.acquire, remaining):
+                    raise ConcurrencyLimitError(f"No free slot for a Gemini {operation} call "
+                                                f"within the {self.deadline:g}s deadline")
+            except BaseException:
+                breaker.on_other()
+                raise
+            error = None
+            try:
+                call_kwargs = self._with_timeout(kwargs, remaining)
+                if hedge and self.hedge_delay:
+                    return await self._hedged_async(fn, args, call_kwargs, deadline_at, operation)
+                try:
+                    return await asyncio.wait_for(fn(*args, **call_kwargs), remaining)
+                finally:
+                    self.limiter.release()
+            except Exception as e:
+                error = e
+            except BaseException as e:  # Cancelled or interrupted: no outcome to record
+                error = e
+                raise
+            finally:
+                self._record_outcome(breaker, error)
+            await asyncio.sleep(self._backoff(operation, attempt, error, deadline_at))
+            attempt += 1
+
+    async def _hedged_async(self, fn, args, kwargs, deadline_at, operation):
+        async def run():
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.limiter.release()
+
+        tasks = [asyncio.ensure_future(run())]
+        done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+        if not done and self.limiter.try_acquire():
+            self._count('hedges')
+            if self.metrics is not None:
+                self.metrics.inc("hedged_requests_total", {'operation': operation},
+                                 help="Duplicate requests sent because the first was slow")
+            tasks.append(asyncio.ensure_future(run()))
+        pending, error = set(tasks), None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self._remaining(deadline_at),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceededError(f"Gemini {operation} call exceeded its "
+                                                f"{self.deadline:g}s deadline")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def embed_content_async(self, **kwargs):
+        return await self._call_async("embed", self.api.embed_content_async, (), kwargs,
+                                      hedge=True)
+
+    def stats(self):
+        with self._lock:
+            stats = {'calls': self.calls, 'retries': self.retries, 'hedges': self.hedges,
+                     'hedge_wins': self.hedge_wins, 'failures': self.failures}
+        stats['in_flight'] = self.limiter.in_flight
+        stats['peak_in_flight'] = self.limiter.peak_in_flight
+        stats['circuits'] = {name: {'state': breaker.state, 'opened': breaker.opened,
+                                    'rejected': breaker.rejected}
+                             for name, breaker in self.breakers.items()}
+        return stats
+
+
+class ResilientModel:
+    """A generative model whose generate_content(_async) calls go through a ResilientGemini."""
+
+    def __init__(self, model, client):
+        self.model = model
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        return self.client._call("generate", self.model.generate_content, (prompt,),
+                                 {'stream': stream, **kwargs})
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return await self.client._call_async("generate", self.model.generate_content_async,
+                                             (prompt,), kwargs)
+
+
+class BulkGemini:
+    """Embedding calls of bulk ingestion (knowledge base sync, artifact builds).
+
+    They share the process-wide limit on calls in flight but bypass the
+    circuit breaker and the retries: diet_rag.ingest.AdaptiveBackoff paces
+    rate limits for the whole batch, and a rate-limited ingest must not open
+    the circuit that live queries go through.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client.api, name)
+
+    def embed_content(self, **kwargs):
+        return self.client._call_bulk(self.client.api.embed_content, (), kwargs)
@@ -0,0 +1,355 @@
+# diet_rag/retrieval.py
+
+# Pluggable retrieval backends behind the app's retrieval functions.
+#   - "chroma": ChromaDB collection (HNSW index, optional on-disk persistence)
+#   - "numpy":  exact cosine search over one contiguous float32 matrix; no
+#               sqlite/HNSW layer, which is cheaper for a small knowledge base
+
+import contextlib
+import json
+import os
+
+import numpy as np
+
+
+class RetrievalBackend:
+    """Interface every retrieval backend implements.
+
+    `query` returns a dict of flat lists: 'ids', 'documents', 'metadatas' and
+    'distances' (cosine distance, lower is closer), best match first.
+    """
+
+    name = "base"
+
+    def count(self):
+        raise NotImplementedError
+
+    def get_metadatas(self):
+        """Returns a dict mapping every stored id to its metadata."""
+        raise NotImplementedError
+
+    def get(self, ids):
+        """Returns {'ids', 'documents', 'metadatas'} for the stored ones of `ids`, in order."""
+        raise NotImplementedError
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        raise NotImplementedError
+
+    def upsert_normalized(self, ids, documents, metadatas, embeddings):
+        """Like `upsert` for rows already L2-normalized (e.g. from an embedding artifact)."""
+        self.upsert(ids, documents, metadatas, embeddings)
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def deferred_save(self):
+        """Batches the persistence of several writes (a no-op unless overridden)."""
+        yield
+
+    def query(self, embedding, n_results=2):
+        raise NotImplementedError
+
+    def query_batch(self, embeddings, n_results=2):
+        """`query` for each of several embeddings; returns one result dict per embedding."""
+        return [self.query(embedding, n_results) for embedding in embeddings]
+
+
+class ChromaBackend(RetrievalBackend):
+    """Wraps a ChromaDB collection created with cosine space."""
+
+    name = "chroma"
+    max_batch_size = 1000
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    @classmethod
+    def create(cls, collection_name, persist_dir=None):
+        """Opens (or creates) the collection, persistent if `persist_dir` is set."""
+        import chromadb
+        if persist_dir:
+            client = chromadb.PersistentClient(path=persist_dir)
+        else:
+            client = chromadb.Client()  # In-memory client
+        collection = client.get_or_create_collection(
+            name=collection_name, metadata={"hnsw:space": "cosine"})
+        return cls(collection)
+
+    def count(self):
+        return self.collection.count()
+
+    def get_metadatas(self):
+        stored = self.collection.get(include=['metadatas'])
+        return dict(zip(stored['ids'], stored['metadatas'] or []))
+
+    def get(self, ids):
+        if not ids:
+            return {'ids': [], 'documents': [], 'metadatas': []}
+        stored = self.collection.get(ids=list(ids), include=['documents', 'metadatas'])
+        rows = {doc_id: row for row, doc_id in enumerate(stored['ids'])}
+        found = [doc_id for doc_id in ids if doc_id in rows]
+        return {'ids': found,
+                'documents': [stored['documents'][rows[doc_id]] for doc_id in found],
+                'metadatas': [stored['metadatas'][rows[doc_id]] for doc_id in found]}
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        # Chroma caps the size of a single write, so large corpora go in chunks
+        for start in range(0, len(ids), self.max_batch_size):
+            end = start + self.max_batch_size
+            self.collection.upsert(ids=ids[start:end], documents=documents[start:end],
+                                   metadatas=metadatas[start:end],
+                                   embeddings=embeddings[start:end])
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def query(self, embedding, n_results=2):
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=n_results,
+            include=['documents', 'metadatas', 'distances']
+        )
+        return {key: (results.get(key) or [[]])[0]
+                for key in ('ids', 'documents', 'metadatas', 'distances')}
+
+    def query_batch(self, embeddings, n_results=2):
+        embeddings = [list(map(float, embedding)) for embedding in embeddings]
+        if not embeddings:
+            return []
+        results = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=n_results,
+            include=['documents', 'metadatas', 'distances']
+        )
+        return [{key: (results.get(key) or [[]] * len(embeddings))[i]
+                 for key in ('ids', 'documents', 'metadatas', 'distances')}
+                for i in range(len(embeddings))]
+
+
+class NumpyBackend(RetrievalBackend):
+    """Exact top-k cosine search over L2-normalized float32 rows.
+
+    All embeddings live in one contiguous (n_docs, dim) matrix, so a query is
+    a single matrix-vector product followed by `argpartition`. If `path` is
+    given the index is loaded from / saved to `<path>.npy` + `<path>.json`.
+
+    With `read_only=True` the matrix is memory-mapped instead of copied, so
+    several processes serving the same index share one copy of it in the page
+    cache; writes raise RuntimeError.
+    """
+
+    name = "numpy"
+
+    def __init__(self, path=None, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self._rows = {}
+        self._capacity = None  # Rows allocated behind `matrix` when it is a growable buffer
+        self._defer_saves = 0
+        self._dirty = False
+        if path and os.path.exists(path + ".npy"):
+            self._load()
+
+    @staticmethod
+    def _normalize(embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(matrix / norms)
+
+    def count(self):
+        return len(self.ids)
+
+    def get_metadatas(self):
+        return dict(zip(self.ids, self.metadatas))
+
+    def get(self, ids):
+        rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        return {'ids': [self.ids[row] for row in rows],
+                'documents': [self.documents[row] for row in rows],
+                'metadatas': [self.metadatas[row] for row in rows]}
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Index {self.path!r} is opened read-only")
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        self._check_writable()
+        if not ids:
+            return
+        new_rows = self._normalize(embeddings)
+        if not self.ids:
+            self.matrix = np.empty((0, new_rows.shape[1]), dtype=np.float32)
+            self._capacity = None
+        appended = []
+        for i, doc_id in enumerate(ids):
+            row = self._rows.get(doc_id)
+            if row is None:
+                appended.append(i)
+                continue
+            self.matrix[row] = new_rows[i]
+            self.documents[row] = documents[i]
+            self.metadatas[row] = metadatas[i]
+        if appended:
+            self._append_rows(new_rows[appended])
+            for i in appended:
+                self._rows[ids[i]] = len(self.ids)
+                self.ids.append(ids[i])
+                self.documents.append(documents[i])
+                self.metadatas.append(metadatas[i])
+        self._save()
+
+    def _append_rows(self, rows):
+        """Appends to the matrix, growing its buffer geometrically so batched syncs stay linear."""
+        used, needed = len(self.matrix), len(self.matrix) + len(rows)
+        if self._capacity is None or needed > self._capacity:
+            capacity = max(needed, 2 * used, 64)
+            buffer = np.empty((capacity, rows.shape[1]), dtype=np.float32)
+            buffer[:used] = self.matrix
+            self._buffer, self._capacity = buffer, capacity
+        self._buffer[used:needed] = rows
+        self.matrix = self._buffer[:needed]  # A leading slice, so still C-contiguous
+
+    def upsert_normalized(self, ids, documents, metadatas, embeddings):
+        # An empty index adopts the matrix as-is, so a memory-mapped artifact isn't copied
+        if self.ids or not ids:
+            self.upsert(ids, documents, metadatas, embeddings)
+            return
+        self._check_writable()
+        self.matrix = np.asarray(embeddings, dtype=np.float32)
+        self._capacity = None
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self._save()
+
+    def delete(self, ids):
+        self._check_writable()
+        drop = {self._rows[doc_id] for doc_id in ids if doc_id in self._rows}
+        if not drop:
+            return
+        keep = [row for row in range(len(self.ids)) if row not in drop]
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        self._capacity = None
+        self.ids = [self.ids[row] for row in keep]
+        self.documents = [self.documents[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self._save()
+
+    def top_k(self, embedding, k):
+        """Returns (row indices, cosine similarities) of the k best rows, best first."""
+        total = len(self.ids)
+        k = min(k, total)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        scores = self.matrix @ self._normalize(embedding)[0]
+        if k < total:
+            candidates = np.argpartition(scores, total - k)[total - k:]
+        else:
+            candidates = np.arange(total)
+        order = candidates[np.argsort(scores[candidates])[::-1]]
+        return order, scores[order]
+
+    def top_k_batch(self, embeddings, k):
+        """`top_k` for a batch: one matrix product, then a row-wise `argpartition`.
+
+        Returns (rows, scores), both (n_queries, k) arrays, best first per query.
+        """
+        queries = self._normalize(embeddings)
+        total = len(self.ids)
+        k = min(k, total)
+        if k <= 0:
+            return (np.empty((len(queries), 0), dtype=np.intp),
+                    np.empty((len(queries), 0), dtype=np.float32))
+        scores = queries @ self.matrix.T
+        if k < total:
+            candidates = np.argpartition(scores, total - k, axis=1)[:, total - k:]
+        else:
+            candidates = np.broadcast_to(np.arange(total), scores.shape)
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(candidate_scores, axis=1)[:, ::-1]
+        return (np.take_along_axis(candidates, order, axis=1),
+                np.take_along_axis(candidate_scores, order, axis=1))
+
+    def _results(self, rows, scores):
+        return {
+            'ids': [self.ids[row] for row in rows],
+            'documents': [self.documents[row] for row in rows],
+            'metadatas': [self.metadatas[row] for row in rows],
+            'distances': [float(1.0 - score) for score in scores],
+        }
+
+    def query(self, embedding, n_results=2):
+        return self._results(*self.top_k(embedding, n_results))
+
+    def query_batch(self, embeddings, n_results=2):
+        if not len(embeddings):
+            return []
+        rows, scores = self.top_k_batch(embeddings, n_results)
+        return [self._results(query_rows, query_scores)
+                for query_rows, query_scores in zip(rows, scores)]
+
+    @contextlib.contextmanager
+    def deferred_save(self):
+        self._defer_saves += 1
+        try:
+            yield
+        finally:
+            self._defer_saves -= 1
+            if not self._defer_saves and self._dirty:
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        if self._defer_saves:
+            self._dirty = True
+            return
+        self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        np.save(self.path + ".npy", self.matrix)
+        with open(self.path + ".json", "w", encoding="utf-8") as f:
+            json.dump({'ids': self.ids, 'documents': self.documents,
+                       'metadatas': self.metadatas}, f)
+
+    def _load(self):
+        if self.read_only:
+            # Rows are stored normalized float32, so the mapping is used as-is
+            self.matrix = np.load(self.path + ".npy", mmap_mode='r')
+        else:
+            self.matrix = np.ascontiguousarray(
+                np.load(self.path + ".npy").astype(np.float32, copy=False))
+        with open(self.path + ".json", encoding="utf-8") as f:
+            table = json.load(f)
+        self.ids = table['ids']
+        self.documents = table['documents']
+        self.metadatas = table['metadatas']
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+
+BACKENDS = ("chroma", "numpy")
+
+
+def make_backend(name, collection_name, persist_dir=None, read_only=False):
+    """Creates the retrieval backend selected by `name` ("chroma" or "numpy").
+
+    `read_only` opens an existing on-disk NumPy index memory-mapped (the only
+    backend several processes can safely share).
+    """
+    if read_only and (name != "numpy" or not persist_dir):
+        raise ValueError("A read-only index needs the numpy backend and a persist directory")
+    if name == "chroma":
+        return ChromaBackend.create(collection_name, persist_dir)
+    if name == "numpy":
+        path = os.path.join(persist_dir, collection_name) if persist_dir else None
+        return NumpyBackend(path, read_only=read_only)
+    raise ValueError(f"Unknown retrieval backend: {name!r} (expected one of {BACKENDS})")
@@ -0,0 +1,203 @@
+# diet_rag/router.py
+
+# Condition router: most first-turn questions name one of the knowledge base's
+# condition labels ("I have GERD", "diet for high blood pressure"). An alias
+# table built from the labels at load time (label parts plus a small synonym
+# list), with fuzzy matching for misspellings, maps such queries straight to
+# their documents in microseconds; only unmatched queries go on to embedding
+# and vector search.
+
+import difflib
+import re
+import threading
+
+from diet_rag.lexical import TOKEN_PATTERN, tokenize
+
+# Splits a label into alternative names: "GERD / Acid Reflux Management",
+# "High Blood Pressure (Hypertension)"
+_LABEL_PARTS = re.compile(r"[/()&,;]| - ")
+# Label words that describe the document rather than name the condition
+LABEL_FILLER = frozenset("""
+    management relief support general initial phase example symptom symptoms post
+    event prevention plan healthy
+    """.split())
+# Lay phrasings -> an alias derived from the labels; entries whose target
+# alias does not occur in the knowledge base are ignored
+SYNONYMS = {
+    "hypertension": ("high bp", "hypertensive"),
+    # Not bare "diabetes" / "diabetic": type 1 needs different advice
+    "type 2 diabetes": ("prediabetes", "pre diabetes", "prediabetic", "high blood sugar",
+                        "insulin resistance"),
+    "acid reflux": ("reflux", "heartburn", "indigestion"),
+    "iron deficiency anemia": ("anemia", "anaemia", "anemic", "low iron", "iron deficiency"),
+    "constipation": ("constipated", "irregular bowel movements"),
+    "ibs": ("irritable bowel", "irritable bowel syndrome", "fodmap"),
+    "heart health": ("heart disease", "heart attack", "high cholesterol", "cholesterol",
+                     "cardiovascular disease"),
+    "weight": ("lose weight", "weight loss", "overweight", "obesity"),
+    "back pain": ("backache", "lower back pain", "sciatica"),
+    "inflammation": ("inflammatory", "arthritis", "joint pain"),
+    "building muscle": ("build muscle", "muscle gain", "gain muscle", "bodybuilding",
+                        "strength training"),
+}
+# Query words that may surround a condition's name without changing which
+# document answers it ("my doctor says I have GERD, any meal ideas?"); any
+# other term left outside the matched aliases ("type 1", "gain", "dog") sends
+# the query to retrieval
+QUERY_FILLER = LABEL_FILLER | frozenset(tokenize("""
+    doctor says said told diagnosed diagnosis suffer suffering got dealing living
+    manage managing condition problem problems issue issues want need like tips
+    meals ideas recipes please currently recently lately
+    """))
+# Words that negate or exclude what follows ("no back pain", "not diabetic");
+# queries containing them are left to retrieval
+NEGATIONS = frozenset("no not non without never nor don dont doesn isn aren".split())
+# Queries with more terms than this are narratives that need real retrieval
+MAX_ROUTED_TERMS = 12
+# Shortest query term the fuzzy match tries to correct
+MIN_FUZZY_LENGTH = 5
+
+
+def label_aliases(label):
+    """Alias token tuples naming the condition in `label` (the whole label and its parts)."""
+    aliases = []
+    for text in [label] + _LABEL_PARTS.split(label):
+        alias = tuple(term for term in tokenize(text) if term not in LABEL_FILLER)
+        if alias and alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+class ConditionRouter:
+    """Maps queries naming a known condition to that condition's document ids.
+
+    A query routes when the aliases it contains (as whole-term runs) agree on
+    at least one document and cover every query term other than QUERY_FILLER;
+    queries naming several different conditions, none, or a condition with
+    qualifiers or a negation are left to retrieval. With `fuzzy_cutoff` > 0,
+    unknown query terms are first corrected to the closest alias term
+    (difflib ratio) before giving up.
+    """
+
+    def __init__(self, fuzzy_cutoff=0.85, synonyms=None, max_terms=MAX_ROUTED_TERMS):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.synonyms = SYNONYMS if synonyms is None else synonyms
+        self.max_terms = max_terms
+        self._aliases = {}  # Alias token tuple -> document ids, in load order
+        self._longest = 0
+        self._vocabulary = {}  # Length -> alias terms fuzzy matching may correct to
+        self._known = frozenset()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_conditions(cls, conditions, **kwargs):
+        """Builds a router from an id -> condition label mapping (KnowledgeBase.conditions)."""
+        router = cls(**kwargs)
+        router.add_conditions(conditions)
+        return router
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def add_conditions(self, conditions):
+        doc_ids_by_label = {}
+        for doc_id, label in conditions.items():
+            doc_ids_by_label.setdefault(label, []).append(doc_id)
+        for label, doc_ids in doc_ids_by_label.items():
+            for alias in label_aliases(label):
+                self._aliases.setdefault(alias, []).extend(doc_ids)
+        for target, phrasings in self.synonyms.items():
+            doc_ids = self._aliases.get(tuple(tokenize(target)))
+            if doc_ids is None:
+                continue
+            for phrasing in phrasings:
+                alias = tuple(tokenize(phrasing))
+                if alias and alias not in self._aliases:
+                    self._aliases[alias] = doc_ids
+        self._longest = max(map(len, self._aliases), default=0)
+        self._known = frozenset(term for alias in self._aliases for term in alias)
+        self._vocabulary = {}
+        for term in sorted(self._known):
+            if len(term) >= MIN_FUZZY_LENGTH - 1 and term.isalpha():
+                self._vocabulary.setdefault(len(term), []).append(term)
+
+    def _match(self, terms):
+        """Document ids all contained aliases agree on, in load order.
+
+        Empty if there are none, they conflict, or a term outside them is not filler.
+        """
+        matched, covered = [], set()
+        for start in range(len(terms)):
+            for end in range(start + 1, min(start + self._longest, len(terms)) + 1):
+                doc_ids = self._aliases.get(tuple(terms[start:end]))
+                if doc_ids is not None:
+                    matched.append(doc_ids)
+                    covered.update(range(start, end))
+        if not matched or any(term not in QUERY_FILLER for position, term in enumerate(terms)
+                              if position not in covered):
+            return []
+        matched.sort(key=len)
+        routed = matched[0]
+        for doc_ids in matched[1:]:
+            if doc_ids is routed:
+                continue
+            members = set(doc_ids)
+            routed = [doc_id for doc_id in routed if doc_id in members]
+        return routed
+
+    def _correct(self, terms):
+        """`terms` with unknown ones replaced by their closest alias term, or None if none changed."""
+        corrected, changed = [], False
+        for term in terms:
+            if term not in self._known and len(term) >= MIN_FUZZY_LENGTH:
+                # A ratio of 2 * matches / (len(a) + len(b)) >= cutoff bounds the lengths
+                # worth comparing
+                slack = int(2 * len(term) * (1 - self.fuzzy_cutoff) / self.fuzzy_cutoff)
+                candidates = [candidate for length in range(len(term) - slack, len(term) + slack + 1)
+                              for candidate in self._vocabulary.get(length, ())]
+                close = difflib.get_close_matches(term, candidates, n=1, cutoff=self.fuzzy_cutoff)
+                if close:
+                    term, changed = close[0], True
+            corrected.append(term)
+        return corrected if changed else None
+
+    def lookup(self, query):
+        """(document ids for the condition `query` names, whether fuzzy matching was needed).
+
+        The ids are empty if the query does not route. Not counted in `stats`.
+        """
+        terms = tokenize(query or "")
+        if not terms or len(terms) > self.max_terms:
+            return [], False
+        if NEGATIONS.intersection(TOKEN_PATTERN.findall(query.lower())):
+            return [], False
+        routed = self._match(terms)
+        if routed or not self.fuzzy_cutoff:
+            return routed, False
+        corrected = self._correct(terms)
+        if corrected is None:
+            return [], False
+        return self._match(corrected), True
+
+    def route(self, query, limit=None):
+        """Document ids for the condition `query` names (at most `limit`), or None."""
+        routed, fuzzy = self.lookup(query)
+        with self._lock:
+            if routed:
+                self.hits += 1
+                self.fuzzy_hits += fuzzy
+            else:
+                self.misses += 1
+        if not routed:
+            return None
+        return list(routed[:limit] if limit else routed)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'fuzzy_hits': self.fuzzy_hits,
+                    'entries': len(self._aliases),
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,336 @@
+# diet_rag/server.py
+
+# HTTP/JSON API over DietRAGEngine, for clients that don't need a Streamlit
+# session. Standard library only:
+#   GET  /health     -> {"ready", "documents", "pid"}
+#   GET  /metrics    -> Prometheus text (this worker's registry; "pid" tells workers apart)
+#   POST /recommend  {"problem", "stream"?}           -> answer (+ parsed recommendation in
+#                                                        STRUCTURED_OUTPUT mode) + conversation token
+#   POST /follow-up  {"token", "message", "stream"?}  -> answer + updated token
+# With "stream": true the answer is sent as server-sent events: "chunk" events
+# carrying {"text"} followed by one "done" event with the JSON body (or "error").
+#
+# The server keeps no conversation state: the initial problem, recent history
+# and retrieval context travel in a signed token the client sends back.
+#
+# Several worker processes accept on one listening socket. The knowledge base
+# is synced into an on-disk NumPy index once (in a spawned child, so the parent
+# forks before any API or Chroma client exists), then every worker opens
+# it memory-mapped read-only, so the index is embedded and held in memory once.
+#
+# Usage: python -m diet_rag.server --workers 4 --port 8000 [--stub]
+#        (GOOGLE_API_KEY from the environment; settings as in diet_rag/config.py)
+
+import argparse
+import dataclasses
+import json
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import sys
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from diet_rag.config import EngineConfig
+from diet_rag.engine import DietRAGEngine, DietRAGError
+from diet_rag.session import ConversationState, InvalidTokenError, decode_token, encode_token
+
+DEFAULT_INDEX_DIR = "diet_index"
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class RequestError(Exception):
+    """Client error, answered with `status` and a JSON {"error": message}."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class DietAPI:
+    """Request handling independent of the HTTP layer (one instance per worker)."""
+
+    def __init__(self, engine, secret):
+        self.engine = engine
+        self.secret = secret
+
+    def _issue_token(self, initial_problem, chat_history, state):
+        # Turns already folded into the rolling summary aren't needed again
+        covered = state.history_summary['covered']
+        state.history_summary = {**state.history_summary, 'covered': 0}
+        return encode_token({
+            'initial_problem': initial_problem,
+            'chat_history': chat_history[covered:],
+            'state': state.to_dict(include_embeddings=False),
+        }, self.secret)
+
+    def _read_token(self, token):
+        try:
+            data = decode_token(token, self.secret)
+        except InvalidTokenError as e:
+            raise RequestError(400, str(e)) from None
+        return (data['initial_problem'], [tuple(turn) for turn in data['chat_history']],
+                ConversationState.from_dict(data['state']))
+
+    def recommend(self, body):
+        """Returns (answer, finish) where finish(text) builds the response body."""
+        problem = body.get('problem')
+        if not isinstance(problem, str) or not problem.strip():
+            raise RequestError(400, "'problem' must be a non-empty string")
+        state = ConversationState()
+        retrieved = self.engine.retrieve_for_session(state, problem)
+        answer = self.engine.generate(problem, retrieved, stream=bool(body.get('stream')))
+
+        def finish(text):
+            return {'answer': text, 'blocked': answer.blocked,
+                    'block_reason': str(answer.block_reason) if answer.blocked else None,
+                    'from_cache': answer.from_cache, 'sources': retrieved['ids'],
+                    'recommendation': answer.structured.to_dict() if answer.structured else None,
+                    'token': self._issue_token(problem, [(problem, text)], state)}
+        return answer, finish
+
+    def follow_up(self, body):
+        message = body.get('message')
+        if not isinstance(message, str) or not message.strip():
+            raise RequestError(400, "'message' must be a non-empty string")
+        if not isinstance(body.get('token'), str):
+            raise RequestError(400, "'token' is required")
+        initial_problem, chat_history, state = self._read_token(body['token'])
+        # Retrieval runs on the engine's loop while the history is compacted
+        pending = self.engine.start_follow_up_retrieval(state, message)
+        history_summary, history_context = self.engine.compact_history(state, chat_history)
+        context_docs = self.engine.follow_up_context(state, message, pending)
+        answer = self.engine.generate_follow_up(initial_problem, history_context, message,
+                                                context_docs=context_docs,
+                                                history_summary=history_summary,
+                                                stream=bool(body.get('stream')))
+
+        def finish(text):
+            return {'answer': text, 'blocked': answer.blocked,
+                    'block_reason': str(answer.block_reason) if answer.blocked else None,
+                    'from_cache': answer.from_cache,
+                    'token': self._issue_token(initial_problem,
+                                               chat_history + [(message, text)], state)}
+        return answer, finish
+
+    def health(self):
+        return {'ready': self.engine.is_ready, 'documents': self.engine.vector_store.count(),
+                'pid': os.getpid()}
+
+
+class DietAPIHandler(BaseHTTPRequestHandler):
+    server_version = "DietRAG/1.0"
+    routes = {'/recommend': 'recommend', '/follow-up': 'follow_up'}
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise RequestError(413, "Request body too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise RequestError(400, "Request body must be JSON") from None
+        if not isinstance(body, dict):
+            raise RequestError(400, "Request body must be a JSON object")
+        return body
+
+    def do_GET(self):  # noqa: N802 - http.server naming
+        if self.path == '/health':
+            self._send_json(200, self.api.health())
+        elif self.path == '/metrics':
+            body = self.api.engine.metrics_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):  # noqa: N802 - http.server naming
+        route = self.routes.get(self.path)
+        if route is None:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        with self.api.engine.trace(route):
+            self._handle(route)
+
+    def _handle(self, route):
+        try:
+            body = self._read_json()
+            answer, finish = getattr(self.api, route)(body)
+            if not body.get('stream'):
+                self._send_json(200, finish(answer.resolve()))
+                return
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+        except DietRAGError as e:
+            self._send_json(502, {'error': str(e)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            for chunk in answer:
+                self._send_event("chunk", {'text': chunk})
+            self._send_event("done", finish(answer.text))
+        except DietRAGError as e:
+            self._send_event("error", {'error': str(e)})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away mid-stream
+        self.close_connection = True
+
+
+class DietAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, sock, api, quiet=False):
+        super().__init__(sock.getsockname()[:2], DietAPIHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.api = api
+        self.quiet = quiet
+
+
+def worker_config(config, index_dir):
+    """The config workers use: the shared on-disk NumPy index, opened read-only."""
+    return dataclasses.replace(config, retrieval_backend="numpy",
+                               chroma_persist_dir=config.chroma_persist_dir or index_dir,
+                               read_only_index=True)
+
+
+def _sync_index(config, api, documents):
+    engine = DietRAGEngine(config, documents=documents, api=api)
+    try:
+        _, sync_stats = engine.build_index()
+    finally:
+        engine.close()
+    return sync_stats
+
+
+def build_shared_index(config, api=None, documents=None):
+    """Syncs the knowledge base into the on-disk index workers will share.
+
+    The build runs in a short-lived spawned process, so the parent never holds
+    the gRPC channel, Chroma client or thread pools it opens and the workers
+    forked afterwards start clean. A module `api` (google.generativeai) can't be
+    sent there; the child imports its own, which reads GOOGLE_API_KEY.
+    """
+    build_config = dataclasses.replace(config, read_only_index=False)
+    if isinstance(api, types.ModuleType):
+        api = None
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_sync_index, (build_config, api, documents))
+
+
+def run_worker(sock, config, secret, api=None, documents=None, quiet=False):
+    engine = DietRAGEngine(config, documents=documents, api=api)
+    engine.warm_up()
+    if config.async_prefetch:
+        engine.prewarm()
+    server = DietAPIServer(sock, DietAPI(engine, secret), quiet=quiet)
+    try:
+        server.serve_forever()
+    finally:
+        engine.close()
+
+
+def serve(host="127.0.0.1", port=8000, workers=2, config=None, secret=None, api=None,
+          documents=None, index_dir=DEFAULT_INDEX_DIR, quiet=False):
+    """Builds the shared index, then serves it from `workers` processes.
+
+    `secret` signs conversation tokens; all workers must share it (a random
+    one is generated per start if unset, invalidating older tokens).
+    """
+    config = worker_config(config or EngineConfig(), index_dir)
+    secret = secret or secrets.token_bytes(32)
+    sync_stats = build_shared_index(config, api=api, documents=documents)
+    print(f"Index ready in {config.chroma_persist_dir}: {sync_stats}", file=sys.stderr)
+
+    sock = socket.create_server((host, port), backlog=128)
+    if workers <= 1 or not hasattr(os, "fork"):
+        run_worker(sock, config, secret, api=api, documents=documents, quiet=quiet)
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(sock, config, secret, api=api, documents=documents, quiet=quiet)
+            finally:
+                os._exit(1)
+        children.append(pid)
+    sock.close()
+    print(f"Serving on http://{host}:{port} with {workers} workers", file=sys.stderr)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for _ in children:
+            os.wait()
+    except KeyboardInterrupt:
+        stop(signal.SIGINT, None)
+        for _ in children:
+            try:
+                os.wait()
+            except ChildProcessError:
+                break
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the diet recommender over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR,
+                        help="where the shared index is written (unless CHROMA_PERSIST_DIR is set)")
+    parser.add_argument("--stub", action="store_true",
+                        help="serve with the offline Gemini stub instead of the real API")
+    parser.add_argument("--quiet", action="store_true", help="don't log every request")
+    args = parser.parse_args(argv)
+
+    if args.stub:
+        from diet_rag.stubs import StubGemini
+        api = StubGemini()
+    else:
+        import google.generativeai as api
+        api.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    secret = os.environ.get("DIET_API_SECRET", "").encode("utf-8") or None
+    serve(args.host, args.port, args.workers, config=EngineConfig.from_mapping(env=os.environ),
+          secret=secret, api=api, index_dir=args.index_dir, quiet=args.quiet)
+
+
+if __name__ == "__main__":
+    main()
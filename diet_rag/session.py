@@ -0,0 +1,74 @@
+# diet_rag/session.py
+
+# Per-conversation state the engine reads and updates. Clients own it: the
+# Streamlit app keeps one in st.session_state, other clients can serialize it
+# (the HTTP API hands it back and forth as a signed token).
+
+import base64
+import hashlib
+import hmac
+import json
+import zlib
+
+from diet_rag.history import new_summary_state
+
+
+class InvalidTokenError(ValueError):
+    """A conversation token was malformed or its signature did not match."""
+
+
+class ConversationState:
+    """Retrieval and history state for one conversation.
+
+    - retrieval_cache: normalized query -> {'ids', 'documents', 'embedding'}
+    - retrieved_context: every document retrieved so far, in first-seen order (id -> text)
+    - history_summary: rolling summary state from diet_rag.history
+    """
+
+    def __init__(self, retrieval_cache=None, retrieved_context=None, history_summary=None):
+        self.retrieval_cache = retrieval_cache if retrieval_cache is not None else {}
+        self.retrieved_context = retrieved_context if retrieved_context is not None else {}
+        self.history_summary = history_summary if history_summary is not None else new_summary_state()
+
+    def to_dict(self, include_embeddings=True):
+        cache = self.retrieval_cache
+        if not include_embeddings:
+            cache = {key: {**value, 'embedding': None} for key, value in cache.items()}
+        return {
+            'retrieval_cache': cache,
+            'retrieved_context': self.retrieved_context,
+            'history_summary': self.history_summary,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(retrieval_cache=data.get('retrieval_cache'),
+                   retrieved_context=data.get('retrieved_context'),
+                   history_summary=data.get('history_summary'))
+
+
+def encode_token(data, secret):
+    """Serializes `data` (JSON-compatible) into a compact, HMAC-signed token.
+
+    The payload is compressed but not encrypted: clients can read it, not change it.
+    """
+    payload = base64.urlsafe_b64encode(
+        zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8")))
+    signature = hmac.new(secret, payload, hashlib.sha256).hexdigest()
+    return payload.decode("ascii") + "." + signature
+
+
+def decode_token(token, secret):
+    """Returns the data in a token from `encode_token`; raises InvalidTokenError."""
+    try:
+        payload, signature = token.encode("ascii").rsplit(b".", 1)
+    except (AttributeError, UnicodeEncodeError, ValueError):
+        raise InvalidTokenError("Malformed conversation token") from None
+    expected = hmac.new(secret, payload, hashlib.sha256).hexdigest().encode("ascii")
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidTokenError("Conversation token signature mismatch")
+    try:
+        return json.loads(zlib.decompress(base64.urlsafe_b64decode(payload)))
+    except (ValueError, zlib.error):
+        raise InvalidTokenError("Malformed conversation token") from None
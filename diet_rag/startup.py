@@ -0,0 +1,92 @@
+# diet_rag/startup.py
+
+# Staged startup: the engine (API client import, model handles, vector store
+# sync, BM25 index, router) is built and warmed up in a daemon thread so a UI
+# can render immediately. Callers poll `state` / `progress` while it runs and
+# `wait()` for the engine when a request needs it; requests made meanwhile
+# wait for it too, as there is nothing to answer them from before the engine
+# (and its caches) exists. A failed startup stays failed: callers start a new
+# BackgroundStartup to retry.
+
+import threading
+import time
+
+STARTING, INDEXING, READY, FAILED = "starting", "indexing", "ready", "failed"
+
+
+class BackgroundStartup:
+    """Creates and warms up an engine in a background thread.
+
+    `factory()` returns an unwarmed DietRAGEngine (heavy imports belong in
+    it, so they also happen off the calling thread). `warm_up_kwargs` are
+    passed to `engine.warm_up`; with `prewarm` the engine's embedding
+    pre-warming is started once it is ready. `timings` records seconds per
+    stage ('create', 'warm_up', 'total') as they finish.
+    """
+
+    def __init__(self, factory, prewarm=False, **warm_up_kwargs):
+        self.factory = factory
+        self.prewarm = prewarm
+        self.warm_up_kwargs = warm_up_kwargs
+        self.state = STARTING
+        self.progress = (0, None)  # (documents indexed, total or None if unknown)
+        self.engine = None
+        self.sync_stats = None
+        self.error = None
+        self.timings = {}
+        self.started = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the background thread (once); returns self."""
+        with self._lock:
+            if self._thread is None:
+                self.started = time.perf_counter()
+                self._thread = threading.Thread(target=self._run, name="diet-rag-startup",
+                                                daemon=True)
+                self._thread.start()
+        return self
+
+    def _report(self, done, total):
+        self.progress = (done, total)
+
+    def _run(self):
+        try:
+            start = time.perf_counter()
+            engine = self.factory()
+            self.timings['create'] = time.perf_counter() - start
+            self.state = INDEXING
+            start = time.perf_counter()
+            self.sync_stats = engine.warm_up(progress_callback=self._report, **self.warm_up_kwargs)
+            self.timings['warm_up'] = time.perf_counter() - start
+            if self.prewarm:
+                engine.prewarm()
+            self.engine = engine
+            self.state = READY
+        except Exception as e:
+            self.error = e
+            self.state = FAILED
+        finally:
+            self.timings['total'] = time.perf_counter() - self.started
+            self._ready.set()
+
+    @property
+    def done(self):
+        """True once the engine is ready or startup failed."""
+        return self._ready.is_set()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def wait(self, timeout=None):
+        """Blocks until startup finishes (or `timeout`); returns the engine, or None if not ready.
+
+        Raises the startup error if it failed.
+        """
+        self._ready.wait(timeout)
+        if self.state == FAILED:
+            raise self.error
+        return self.engine if self.state == READY else None
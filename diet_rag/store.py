@@ -0,0 +1,158 @@
+# diet_rag/store.py
+
+# Content-hashed vector store sync: each stored document carries a hash of its
+# condition + text + embedding model name, so on startup only new or changed
+# documents are re-embedded and removed ones are deleted. With a persistent
+# backend this makes warm restarts free of embedding calls; a precomputed
+# artifact (diet_rag.artifact) does the same for fresh deployments. The corpus
+# can arrive in batches (sync_batches), so it never has to be held in memory.
+
+import hashlib
+
+from diet_rag.ingest import EMBEDDING_MODEL_NAME, embed_documents
+
+
+def content_hash(doc_data, model_name=EMBEDDING_MODEL_NAME):
+    """Returns a stable hash of a document's condition, text and embedding model."""
+    hasher = hashlib.sha256()
+    for part in (doc_data['condition'], doc_data['text'], model_name):
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\x00')
+    return hasher.hexdigest()
+
+
+def plan_sync(documents, stored_metadatas, model_name=EMBEDDING_MODEL_NAME):
+    """Compares the corpus against stored metadata.
+
+    `stored_metadatas` maps stored document id -> metadata dict. Returns
+    (to_embed, to_delete, unchanged_count) where `to_embed` is the list of
+    new or changed documents and `to_delete` the ids no longer in the corpus.
+    """
+    to_embed = []
+    seen_ids = set()
+    for doc_data in documents:
+        seen_ids.add(doc_data['id'])
+        stored = stored_metadatas.get(doc_data['id'])
+        if not stored or stored.get('content_hash') != content_hash(doc_data, model_name):
+            to_embed.append(doc_data)
+    to_delete = [doc_id for doc_id in stored_metadatas if doc_id not in seen_ids]
+    unchanged = len(seen_ids) - len(to_embed)
+    return to_embed, to_delete, unchanged
+
+
+def _load_from_artifact(backend, documents, artifact, model_name):
+    """Upserts the artifact rows matching `documents`; returns (loaded count, documents left)."""
+    rows, missing = artifact.rows_for(documents, model_name)
+    if rows:
+        if rows == list(range(len(artifact))):
+            embeddings = artifact.matrix  # The whole artifact: no copy
+        else:
+            embeddings = artifact.matrix[rows]
+        backend.upsert_normalized([artifact.ids[row] for row in rows],
+                                  [artifact.documents[row] for row in rows],
+                                  [dict(artifact.metadatas[row]) for row in rows],
+                                  embeddings)
+    return len(rows), missing
+
+
+def sync_batches(backend, batches, embed_fn=None, model_name=EMBEDDING_MODEL_NAME,
+                 progress_callback=None, artifact=None, total=None, **embed_kwargs):
+    """Syncs a corpus streamed as `batches` (lists of documents) into a backend.
+
+    Each batch is planned against the stored metadata, filled from `artifact`
+    where possible and embedded otherwise before the next one is read, so only
+    one batch of documents is held at a time. Stored documents absent from
+    every batch are deleted at the end. `progress_callback(done, total)` counts
+    processed documents; `total` is passed through (None if unknown).
+
+    Returns the `sync_backend` counts plus 'corpus_hash' of everything seen.
+    """
+    stored_metadatas = backend.get_metadatas()
+    seen_ids = set()
+    hasher = CorpusHasher(model_name)
+    stats = {'embedded': 0, 'from_artifact': 0, 'deleted': 0, 'unchanged': 0, 'skipped': 0}
+
+    with backend.deferred_save():
+        for batch in batches:
+            seen_ids.update(doc_data['id'] for doc_data in batch)
+            hasher.update(batch)
+            stored = {doc_data['id']: stored_metadatas[doc_data['id']]
+                      for doc_data in batch if doc_data['id'] in stored_metadatas}
+            to_embed, _, unchanged = plan_sync(batch, stored, model_name)
+            stats['unchanged'] += unchanged
+
+            if to_embed and artifact is not None:
+                from_artifact, to_embed = _load_from_artifact(backend, to_embed, artifact,
+                                                              model_name)
+                stats['from_artifact'] += from_artifact
+
+            offset = sum(stats[key] for key in ('unchanged', 'from_artifact', 'embedded', 'skipped'))
+            if progress_callback:
+                progress_callback(offset, total)
+            if to_embed:
+                batch_progress = None
+                if progress_callback:
+                    def batch_progress(done, _, offset=offset):
+                        progress_callback(offset + done, total)
+                doc_ids, doc_texts, doc_metadatas, doc_embeddings = embed_documents(
+                    to_embed, embed_fn=embed_fn, progress_callback=batch_progress, **embed_kwargs)
+                hashes = {doc_data['id']: content_hash(doc_data, model_name)
+                          for doc_data in to_embed}
+                for doc_id, metadata in zip(doc_ids, doc_metadatas):
+                    metadata['content_hash'] = hashes[doc_id]
+                    metadata['embedding_model'] = model_name
+                if doc_ids:
+                    backend.upsert(doc_ids, doc_texts, doc_metadatas, doc_embeddings)
+                stats['embedded'] += len(doc_ids)
+                stats['skipped'] += len(to_embed) - len(doc_ids)
+
+        to_delete = [doc_id for doc_id in stored_metadatas if doc_id not in seen_ids]
+        if to_delete:
+            backend.delete(to_delete)
+    stats['deleted'] = len(to_delete)
+    stats['corpus_hash'] = hasher.hexdigest()
+    return stats
+
+
+def sync_backend(backend, documents, embed_fn=None,
+                 model_name=EMBEDDING_MODEL_NAME, progress_callback=None,
+                 artifact=None, **embed_kwargs):
+    """Brings a retrieval backend in line with `documents`, embedding only what changed.
+
+    New or changed documents are taken from `artifact` (a loaded
+    diet_rag.artifact.EmbeddingArtifact) when their content hash matches and
+    embedded live otherwise. Returns a dict with 'embedded', 'from_artifact',
+    'deleted', 'unchanged' and 'skipped' counts (and the 'corpus_hash').
+    """
+    documents = list(documents)
+    return sync_batches(backend, [documents], embed_fn=embed_fn, model_name=model_name,
+                        progress_callback=progress_callback, artifact=artifact,
+                        total=len(documents), **embed_kwargs)
+
+
+class CorpusHasher:
+    """Incremental corpus_hash for documents that arrive in batches, in any order."""
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        self._total = 0
+
+    def update(self, documents):
+        for doc_data in documents:
+            pair = hashlib.sha256(doc_data['id'].encode('utf-8') + b'\x00'
+                                  + content_hash(doc_data, self.model_name).encode('ascii'))
+            self._total = (self._total + int.from_bytes(pair.digest(), 'big')) % (1 << 256)
+
+    def hexdigest(self):
+        return f"{self._total:064x}"
+
+
+def corpus_hash(documents, model_name=EMBEDDING_MODEL_NAME):
+    """Returns a single hash identifying the whole corpus (ids + content hashes).
+
+    Order-independent (a sum of per-document hashes), so it can be computed
+    while the corpus is streamed.
+    """
+    hasher = CorpusHasher(model_name)
+    hasher.update(documents)
+    return hasher.hexdigest()
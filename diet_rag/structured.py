@@ -0,0 +1,129 @@
+# diet_rag/structured.py
+
+# Structured output mode: the first recommendation is requested as JSON
+# matching RECOMMENDATION_SCHEMA (Gemini controlled generation), validated into
+# a Recommendation and rendered by the client, instead of free-form markdown
+# that downstream consumers would have to re-parse. The schema is written in
+# the OpenAPI subset the API accepts, and the same dict drives `validate`.
+
+import dataclasses
+import json
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+RECOMMENDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string",
+                    "description": "One or two friendly sentences about the user's problem"},
+        "fruits": _STRING_LIST,
+        "vegetables": _STRING_LIST,
+        "proteins": _STRING_LIST,
+        "tips": _STRING_LIST,
+        "recipes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"},
+                               "description": {"type": "string"}},
+                "required": ["name", "description"],
+            },
+        },
+    },
+    "required": ["summary", "fruits", "vegetables", "proteins", "tips", "recipes"],
+}
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json",
+                          "response_schema": RECOMMENDATION_SCHEMA}
+LIST_FIELDS = ("fruits", "vegetables", "proteins", "tips")
+# Section headings used when rendering, in order
+SECTION_TITLES = {"fruits": "Fruits", "vegetables": "Vegetables",
+                  "proteins": "Meats/Proteins", "tips": "Other tips"}
+CLOSING_QUESTION = "Do you want to discuss further details about your problem?"
+
+
+class SchemaError(ValueError):
+    """A structured answer is not valid JSON or does not match the schema."""
+
+
+_JSON_TYPES = {"object": dict, "array": list, "string": str}
+
+
+def validate(value, schema=RECOMMENDATION_SCHEMA, path="$"):
+    """Checks `value` against the (object / array / string) schema; raises SchemaError.
+
+    Returns the value with properties the schema doesn't define dropped.
+    """
+    expected = _JSON_TYPES[schema["type"]]
+    if not isinstance(value, expected):
+        raise SchemaError(f"{path}: expected {schema['type']}, got {type(value).__name__}")
+    if expected is list:
+        return [validate(item, schema["items"], f"{path}[{i}]") for i, item in enumerate(value)]
+    if expected is dict:
+        missing = [name for name in schema.get("required", ()) if name not in value]
+        if missing:
+            raise SchemaError(f"{path}: missing {', '.join(missing)}")
+        return {name: validate(value[name], field_schema, f"{path}.{name}")
+                for name, field_schema in schema["properties"].items() if name in value}
+    return value
+
+
+@dataclasses.dataclass
+class Recommendation:
+    """A validated structured recommendation; recipes are {"name", "description"} dicts."""
+
+    summary: str
+    fruits: list
+    vegetables: list
+    proteins: list
+    tips: list
+    recipes: list
+
+    @classmethod
+    def from_dict(cls, data):
+        data = validate(data)
+        return cls(**{field.name: data.get(field.name, [])
+                      for field in dataclasses.fields(cls)})
+
+    @classmethod
+    def from_json(cls, text):
+        """Parses and validates a model answer (or a `to_json` string); raises SchemaError."""
+        try:
+            data = json.loads(text)
+        except (TypeError, ValueError) as e:
+            raise SchemaError(f"Not valid JSON: {e}") from e
+        return cls.from_dict(data)
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+    def to_json(self):
+        """Compact JSON (no whitespace, empty lists dropped), as stored in caches and sessions."""
+        data = {name: value for name, value in self.to_dict().items() if value or name == "summary"}
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_compact(cls, text):
+        """Inverse of `to_json` (restores the dropped empty lists)."""
+        try:
+            data = json.loads(text)
+        except (TypeError, ValueError) as e:
+            raise SchemaError(f"Not valid JSON: {e}") from e
+        if not isinstance(data, dict):
+            raise SchemaError("$: expected object")
+        return cls.from_dict({**{name: [] for name in LIST_FIELDS + ("recipes",)}, **data})
+
+    def to_markdown(self, closing_question=CLOSING_QUESTION):
+        """The recommendation as the markdown answer the unstructured mode would give.
+
+        Used for conversation history and clients that only show text.
+        """
+        lines = [self.summary] if self.summary else []
+        for name, title in SECTION_TITLES.items():
+            items = getattr(self, name)
+            if items:
+                lines.append(f"* **{title}:** {', '.join(items)}")
+        for recipe in self.recipes:
+            lines.append(f"* **Recipe idea - {recipe['name']}:** {recipe['description']}")
+        if closing_question:
+            lines.append(closing_question)
+        return "\n".join(lines)
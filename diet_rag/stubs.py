@@ -0,0 +1,279 @@
+# diet_rag/stubs.py
+
+# Local stand-in for the parts of the Gemini API the app uses, so pipelines can
+# be exercised and benchmarked offline. Mirrors the call shapes of
+# google.generativeai: embed_content(_async) and a model's generate_content(_async).
+# Latency and failures follow configurable distributions for load testing.
+
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+
+from diet_rag.ingest import FakeEmbedder, RateLimitError
+from diet_rag.structured import Recommendation
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+# Generative model name recorded for canned stub answers (see diet_rag.answers)
+STUB_MODEL_NAME = "stub-gemini"
+# Share of a streamed answer's latency spent before the first chunk arrives
+FIRST_CHUNK_FRACTION = 0.2
+STREAM_CHUNK_WORDS = 8
+# Knowledge base sections the stub answers from (with answer_from_context)
+_SECTION_RE = re.compile(r"\*\*(Fruits|Vegetables|Meats/Proteins|Other):\*\*\s*([^\n]+)")
+_RECIPE_RE = re.compile(r"\*\*Simple Recipe Idea:\s*([^*\n]+)\*\*\s*\n\s*\*\s+([^\n]+)")
+_SECTION_FIELDS = {"Fruits": "fruits", "Vegetables": "vegetables", "Meats/Proteins": "proteins",
+                   "Other": "tips"}
+
+
+class StubAPIError(Exception):
+    """Simulated server-side failure (HTTP 5xx)."""
+
+    code = 500
+
+
+class LatencyModel:
+    """Samples per-call latencies around `mean` seconds.
+
+    - "fixed": always `mean`
+    - "uniform": mean * U(1 - spread, 1 + spread)
+    - "lognormal": median `mean`, shape `spread` (a long right tail, like real APIs)
+    With probability `tail_prob` a call is additionally `tail_multiplier` times slower.
+    """
+
+    def __init__(self, mean, distribution="fixed", spread=0.0, tail_prob=0.0,
+                 tail_multiplier=10.0, rng=None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution!r} "
+                             f"(expected one of {LATENCY_DISTRIBUTIONS})")
+        self.mean = mean
+        self.distribution = distribution
+        self.spread = spread
+        self.tail_prob = tail_prob
+        self.tail_multiplier = tail_multiplier
+        self._rng = rng or random.Random(0)
+
+    def sample(self):
+        if self.distribution == "uniform":
+            latency = self.mean * self._rng.uniform(1 - self.spread, 1 + self.spread)
+        elif self.distribution == "lognormal":
+            latency = self.mean * self._rng.lognormvariate(0.0, self.spread)
+        else:
+            latency = self.mean
+        if self.tail_prob and self._rng.random() < self.tail_prob:
+            latency *= self.tail_multiplier
+        return max(0.0, latency)
+
+
+def _section_items(text, limit=6):
+    """Food names from a knowledge base section line ("Berries (blueberries), cherries. Rich in...")."""
+    text = re.sub(r"\([^)]*\)", "", text.split(". ")[0])
+    items = (item.strip(" .").removeprefix("and ") for item in text.split(","))
+    return [item for item in items if item][:limit]
+
+
+def context_recommendation(prompt):
+    """The Recommendation a model would plausibly derive from the knowledge base text in `prompt`."""
+    fields = {"fruits": [], "vegetables": [], "proteins": [], "tips": [], "recipes": []}
+    for section, text in _SECTION_RE.findall(prompt):
+        field = _SECTION_FIELDS[section]
+        if not fields[field]:
+            fields[field] = _section_items(text)
+    for name, step in _RECIPE_RE.findall(prompt)[:2]:
+        fields["recipes"].append({"name": name.strip(), "description": step.strip()})
+    summary = ("Here are some diet suggestions for your problem, based on the knowledge base."
+               if any(fields.values()) else
+               "I couldn't find specific information for that condition, but a balanced diet helps.")
+    return Recommendation(summary=summary, **fields)
+
+
+class StubPromptFeedback:
+    def __init__(self, block_reason=None):
+        self.block_reason = block_reason
+
+
+class StubResponse:
+    """Minimal GenerateContentResponse: `.text`, `.prompt_feedback` and chunk iteration."""
+
+    def __init__(self, text, block_reason=None, chunk_words=STREAM_CHUNK_WORDS, chunk_delay=0.0):
+        self.text = text
+        self.prompt_feedback = StubPromptFeedback(block_reason)
+        self._chunk_words = chunk_words
+        self._chunk_delay = chunk_delay
+
+    def __iter__(self):
+        words = self.text.split(" ")
+        for start in range(0, len(words), self._chunk_words):
+            if self._chunk_delay:
+                time.sleep(self._chunk_delay)
+            chunk = " ".join(words[start:start + self._chunk_words])
+            if start + self._chunk_words < len(words):
+                chunk += " "
+            yield StubResponse(chunk, self.prompt_feedback.block_reason)
+
+
+class StubGemini:
+    """Offline Gemini stub with configurable latency and failures.
+
+    `embed_latency` / `generate_latency` are mean seconds per call, sampled
+    with `latency_distribution` / `latency_spread` / `tail_prob` (see
+    LatencyModel). Each call fails with probability `error_rate` (StubAPIError)
+    or `rate_limit_rate` (RateLimitError). A streamed answer spends
+    FIRST_CHUNK_FRACTION of its latency before the first chunk and the rest
+    spread over the chunks. `start_outage(seconds)` makes every call fail
+    (StubAPIError) for a while, e.g. to trip a circuit breaker. Requests with a
+    JSON `generation_config` are answered with a JSON recommendation built
+    from the knowledge base text in the prompt; with `answer_from_context`
+    other answers are that recommendation as markdown, else a canned sentence. Tracks call and
+    failure counts and the peak number of concurrent calls so overlap can be
+    measured.
+    """
+
+    def __init__(self, dimension=768, embed_latency=0.05, generate_latency=0.5,
+                 model_name="stub-gemini", latency_distribution="fixed", latency_spread=0.0,
+                 tail_prob=0.0, error_rate=0.0, rate_limit_rate=0.0, seed=0,
+                 answer_from_context=False):
+        self.model_name = model_name
+        self.answer_from_context = answer_from_context
+        self._rng = random.Random(seed)
+        self.embed_latency = LatencyModel(embed_latency, latency_distribution, latency_spread,
+                                          tail_prob, rng=self._rng)
+        self.generate_latency = LatencyModel(generate_latency, latency_distribution,
+                                             latency_spread, tail_prob, rng=self._rng)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.embedder = FakeEmbedder(dimension=dimension)
+        self._lock = threading.Lock()
+        self.embed_calls = 0
+        self.generate_calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._outage_until = 0.0
+
+    def __getstate__(self):
+        # Picklable, so the server can hand it to its spawned index build
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def start_outage(self, seconds):
+        """Fails every call for the next `seconds` seconds."""
+        with self._lock:
+            self._outage_until = time.monotonic() + seconds
+
+    def _enter(self, kind, latency_model):
+        """Counts the call and returns (latency, exception to raise or None)."""
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            latency = latency_model.sample()
+            roll = self._rng.random()
+            error = None
+            if time.monotonic() < self._outage_until:
+                self.errors += 1
+                error = StubAPIError("503 Service unavailable (simulated outage)")
+            elif roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                error = RateLimitError("429 Resource has been exhausted (simulated)")
+            elif roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                error = StubAPIError("500 Internal error (simulated)")
+        return latency, error
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _embed(self, content):
+        if isinstance(content, str):
+            return {'embedding': self.embedder.embed_one(content).tolist()}
+        return {'embedding': [self.embedder.embed_one(text).tolist() for text in content]}
+
+    def _respond(self, prompt, latency, stream, generation_config=None):
+        json_mode = (generation_config or {}).get("response_mime_type") == "application/json"
+        text = self.answer_for(str(prompt), json_mode)
+        if not stream:
+            return StubResponse(text)
+        chunks = max(1, -(-len(text.split(" ")) // STREAM_CHUNK_WORDS))
+        return StubResponse(text, chunk_delay=latency * (1 - FIRST_CHUNK_FRACTION) / chunks)
+
+    def answer_for(self, prompt, json_mode=False):
+        if json_mode:
+            return json.dumps(context_recommendation(prompt).to_dict())
+        if self.answer_from_context:
+            return context_recommendation(prompt).to_markdown()
+        return (f"Here are some diet suggestions based on {len(prompt)} characters of context. "
+                "Do you want to discuss further details about your problem?")
+
+    def GenerativeModel(self, model_name=None, system_instruction=None, **kwargs):  # noqa: N802
+        """The stub doubles as its own generative model; a system instruction gets a StubModel."""
+        return StubModel(self, system_instruction) if system_instruction else self
+
+    # --- Sync API ---
+
+    def embed_content(self, model=None, content=None, task_type=None, **kwargs):
+        latency, error = self._enter('embed_calls', self.embed_latency)
+        try:
+            time.sleep(latency)
+            if error:
+                raise error
+            return self._embed(content)
+        finally:
+            self._exit()
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        latency, error = self._enter('generate_calls', self.generate_latency)
+        try:
+            time.sleep(latency * FIRST_CHUNK_FRACTION if stream else latency)
+            if error:
+                raise error
+            return self._respond(prompt, latency, stream, kwargs.get('generation_config'))
+        finally:
+            self._exit()
+
+    # --- Async API ---
+
+    async def embed_content_async(self, model=None, content=None, task_type=None, **kwargs):
+        latency, error = self._enter('embed_calls', self.embed_latency)
+        try:
+            await asyncio.sleep(latency)
+            if error:
+                raise error
+            return self._embed(content)
+        finally:
+            self._exit()
+
+    async def generate_content_async(self, prompt, **kwargs):
+        latency, error = self._enter('generate_calls', self.generate_latency)
+        try:
+            await asyncio.sleep(latency)
+            if error:
+                raise error
+            return self._respond(prompt, latency, False, kwargs.get('generation_config'))
+        finally:
+            self._exit()
+
+
+class StubModel:
+    """A StubGemini model with a system instruction, answered as if prepended to each prompt."""
+
+    def __init__(self, stub, system_instruction):
+        self.stub = stub
+        self.system_instruction = system_instruction
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        return self.stub.generate_content(f"{self.system_instruction}\n\n{prompt}", stream=stream,
+                                          **kwargs)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return await self.stub.generate_content_async(f"{self.system_instruction}\n\n{prompt}",
+                                                      **kwargs)
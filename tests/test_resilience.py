@@ -0,0 +1,123 @@
+# tests/test_resilience.py
+
+import threading
+import time
+
+import pytest
+
+from diet_rag.resilience import (CircuitBreaker, CircuitOpenError, ConcurrencyLimitError,
+                                 DeadlineExceededError, ResilientGemini, RetryPolicy,
+                                 is_retryable_error)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAPI:
+    """Embeds with `embed_delays` seconds per successive call (then instantly), raising `error` if set."""
+
+    def __init__(self, error=None, embed_delays=()):
+        self.error = error
+        self.embed_delays = list(embed_delays)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embed_content(self, **kwargs):
+        with self._lock:
+            call = self.calls
+            self.calls += 1
+        if call < len(self.embed_delays):
+            time.sleep(self.embed_delays[call])
+        if self.error is not None:
+            raise self.error
+        return {'embedding': [float(call)]}
+
+
+def make_client(api, **kwargs):
+    kwargs.setdefault('retry_policy', RetryPolicy(max_attempts=kwargs.pop('max_attempts', 1),
+                                                  initial_delay=0))
+    return ResilientGemini(api, **kwargs)
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (TimeoutError("read timed out"), True),
+    (ConnectionError("reset"), True),
+    (DeadlineExceededError("deadline"), True),
+    (ValueError("400 invalid argument"), False),
+    (CircuitOpenError("open"), False),
+    (ConcurrencyLimitError("no free slot"), False),
+])
+def test_is_retryable_error(error, retryable):
+    assert is_retryable_error(error) is retryable
+
+
+def test_half_open_trial_slot_is_released_without_an_outcome():
+    clock = FakeClock()
+    breaker = CircuitBreaker("embed", failure_threshold=1, reset_timeout=10.0, clock=clock)
+    breaker.before_call()
+    breaker.on_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now = 10.0
+    breaker.before_call()  # The trial call
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_other()
+    breaker.before_call()  # Another trial may go now
+    breaker.on_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_that_finds_no_free_slot_is_released():
+    api = FakeAPI(error=TimeoutError("read timed out"))
+    client = make_client(api, deadline=0.2, max_in_flight=1, failure_threshold=1,
+                         reset_timeout=0.05)
+    with pytest.raises(TimeoutError):
+        client.embed_content(content="a")
+    time.sleep(0.1)
+    client.limiter.acquire()
+    with pytest.raises(ConcurrencyLimitError):
+        client.embed_content(content="a")
+    client.limiter.release()
+    api.error = None
+    assert client.embed_content(content="a") == {'embedding': [1.0]}
+    assert client.breakers['embed'].state == CircuitBreaker.CLOSED
+
+
+def test_non_retryable_errors_do_not_trip_the_breaker():
+    api = FakeAPI(error=ValueError("400 invalid argument"))
+    client = make_client(api, max_attempts=3, failure_threshold=2)
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            client.embed_content(content="a")
+    assert api.calls == 5  # Not retried either
+    assert client.breakers['embed'].state == CircuitBreaker.CLOSED
+    assert client.stats()['failures'] == 0
+
+
+def test_retryable_errors_trip_the_breaker():
+    client = make_client(FakeAPI(error=TimeoutError("read timed out")), failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            client.embed_content(content="a")
+    with pytest.raises(CircuitOpenError):
+        client.embed_content(content="a")
+    assert client.stats()['circuits']['embed'] == {'state': 'open', 'opened': 1, 'rejected': 1}
+
+
+@pytest.mark.parametrize("embed_delays, hedges, hedge_wins", [
+    ((), 0, 0),  # The primary answers before the hedge delay
+    ((1.0,), 1, 1),  # A slow primary: the hedge is sent and wins
+    ((0.2, 1.0), 1, 0),  # The hedge is sent but the primary still wins
+])
+def test_hedge_accounting(embed_delays, hedges, hedge_wins):
+    api = FakeAPI(embed_delays=embed_delays)
+    client = make_client(api, hedge_delay=0.05, deadline=5.0)
+    assert client.embed_content(content="a") == {'embedding': [float(hedge_wins)]}
+    stats = client.stats()
+    assert (stats['hedges'], stats['hedge_wins']) == (hedges, hedge_wins)
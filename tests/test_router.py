@@ -0,0 +1,37 @@
+# tests/test_router.py
+
+import pytest
+
+from diet_data import DIET_DOCUMENTS
+from diet_rag.router import ConditionRouter
+
+
+@pytest.fixture(scope="module")
+def router():
+    return ConditionRouter.from_conditions({doc['id']: doc['condition'] for doc in DIET_DOCUMENTS})
+
+
+@pytest.mark.parametrize("query, doc_id", [
+    ("I have GERD", "doc6"),
+    ("What should I eat with heartburn?", "doc6"),
+    ("My doctor says I have high blood pressure, any food advice?", "doc2"),
+    ("I was diagnosed with type 2 diabetes", "doc3"),
+    ("I want to lose weight", "doc4"),
+    ("I want to build muscle", "doc8"),
+    ("I have acid reflx", "doc6"),
+])
+def test_routes_queries_naming_a_condition(router, query, doc_id):
+    assert router.route(query) == [doc_id]
+
+
+@pytest.mark.parametrize("query", [
+    "I have type 1 diabetes",
+    "my dog has diabetes",
+    "I have diabetes",
+    "I want to gain weight",
+    "I am underweight and need to gain weight",
+    "I have no back pain but need muscle",
+    "not GERD, just bloating",
+])
+def test_leaves_qualified_or_negated_queries_to_retrieval(router, query):
+    assert router.route(query) is None